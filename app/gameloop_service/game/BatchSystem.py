@@ -0,0 +1,402 @@
+"""
+NumPy physics backend (settings.GAME_PHYSICS_BACKEND = 'numpy').
+
+Every Physics body of the BatchWorlds in the process has a row in one PhysicsBatch, which keeps
+positions, velocities, rotations and mesh extents as contiguous arrays (struct of arrays). Movement
+and the collision tests of all worlds that get updated in the same PhysicsBatch.update() call run as
+one vectorized call.
+
+Entities stay regular Entity objects with their own vectors, so game code keeps using the Entity/World
+API at python speed. A batched system copies the state of the bodies into the arrays when it starts
+(gather) and only writes back the bodies that moved.
+
+Collisions: one separating axis test over every circle/box pair of every world checks the bounds of
+the body swept along its velocity against the bounds of the other mesh (boxes as oriented boxes,
+circles as squares). A world only runs the python narrow phase in the ticks where one of its pairs
+may touch, the collisions themselves are resolved exactly like on the python backend. In a match
+these are the few ticks around the ball hitting something.
+
+Differences to the pure python systems:
+-	BatchMovementSystem moves bodies in bulk, entity.move() overrides are not called.
+	The Physics leash (anchor/max_distance) is honoured and on_moved() gets called for every body that moved.
+-	Only circle vs box pairs collide, the ones with a continuous test. Box vs box and circle vs circle
+	pairs are never tested, in Pong these are paddles touching walls or each other, which has no effect.
+-	Static geometry (meshes without Physics) is read once when it gets added to the world,
+	call PhysicsBatch.mark_dirty() after moving it.
+"""
+import threading, time
+import numpy as np
+from .GameSystem import *
+
+GRAVITY = 0.0981
+# values gather() copies per body: position, velocity, rotation
+STATE_SIZE = 5
+
+
+def mesh_extent(mesh):
+	"""
+	Half width and half height of a box around the mesh in its local space, circles get a square
+	"""
+	if isinstance(mesh, Circle):
+		return mesh.width * 0.5, mesh.width * 0.5
+	if isinstance(mesh, Box):
+		return mesh.width * 0.5, mesh.height * 0.5
+	reach = max((point.length() for point in mesh.points), default=0)
+	return reach, reach
+
+
+class PhysicsBatch:
+
+	shared_batch: 'PhysicsBatch' = None
+
+	def __init__(self, capacity=64):
+		self.lock = threading.RLock()
+		self.capacity = 0
+		# rows below capacity are bodies, the static meshes follow them (refresh)
+		self.center = np.zeros((0, 2))
+		self.velocity = np.zeros((0, 2))
+		self.rotation = np.zeros(0)
+		# mesh_extent() of the mesh, 0 for a body without one
+		self.extent = np.zeros((0, 2))
+		# bodies only
+		self.gravity = np.zeros(0)
+		self.anchor = np.zeros((0, 2))
+		self.max_distance = np.zeros(0)
+		self.row_world = np.zeros(0, dtype=np.int64)
+		# row -> (entity, physics)
+		self.bodies: list[tuple] = []
+		self.free_rows: list[int] = []
+		self.grow(capacity)
+
+		self.worlds: dict[int, 'BatchWorld'] = {}
+		self.next_world_id = 0
+		self.dirty = True
+		# the body in pair_mover moves against the body or static mesh in pair_other
+		self.pair_mover = np.zeros(0, dtype=np.int64)
+		self.pair_other = np.zeros(0, dtype=np.int64)
+		self.pair_world = np.zeros(0, dtype=np.int64)
+
+	@classmethod
+	def shared(cls):
+		if cls.shared_batch is None:
+			cls.shared_batch = PhysicsBatch()
+		return cls.shared_batch
+
+	def grow(self, capacity):
+		"""
+		The static meshes get dropped and added again by the next refresh
+		"""
+		old = self.capacity
+		def resize(array, fill=0):
+			shape = (capacity,) + array.shape[1:]
+			new_array = np.full(shape, fill, dtype=array.dtype)
+			new_array[:old] = array[:old]
+			return new_array
+		self.center = resize(self.center)
+		self.velocity = resize(self.velocity)
+		self.rotation = resize(self.rotation)
+		self.extent = resize(self.extent)
+		self.gravity = resize(self.gravity)
+		self.anchor = resize(self.anchor)
+		self.max_distance = resize(self.max_distance, np.inf)
+		self.row_world = resize(self.row_world, -1)
+		self.bodies.extend([None] * (capacity - old))
+		self.free_rows.extend(range(capacity - 1, old - 1, -1))
+		self.capacity = capacity
+		self.dirty = True
+
+	def add_world(self, world):
+		with self.lock:
+			world_id = self.next_world_id
+			self.next_world_id += 1
+			self.worlds[world_id] = world
+			self.dirty = True
+			return world_id
+
+	def remove_world(self, world):
+		with self.lock:
+			for ent in world.entities:
+				self.remove_entity(world, ent)
+			self.worlds.pop(world.world_id, None)
+			self.dirty = True
+
+	def add_entity(self, world, ent):
+		"""
+		Physics bodies get a row, what does not change while they move (gravity, mesh, leash) is copied once
+		"""
+		phys = ent.get_component(Physics)
+		with self.lock:
+			self.dirty = True
+			if phys is None:
+				return
+			if not self.free_rows:
+				self.grow(self.capacity * 2)
+			row = self.free_rows.pop()
+			self.bodies[row] = (ent, phys)
+			self.row_world[row] = world.world_id
+			self.gravity[row] = GRAVITY if phys.has_gravity else 0
+			mesh = ent.get_component(Mesh)
+			self.extent[row] = mesh_extent(mesh) if mesh is not None else (0, 0)
+			self.anchor[row] = (phys.anchor.x, phys.anchor.y) if phys.anchor is not None else (0, 0)
+			self.max_distance[row] = phys.max_distance
+			ent.batch_row = row
+			world.rows.append(row)
+
+	def remove_entity(self, world, ent):
+		with self.lock:
+			self.dirty = True
+			row = getattr(ent, 'batch_row', None)
+			if row is None:
+				return
+			ent.batch_row = None
+			world.rows.remove(row)
+			self.bodies[row] = None
+			self.row_world[row] = -1
+			self.max_distance[row] = np.inf
+			self.free_rows.append(row)
+
+	def mark_dirty(self):
+		self.dirty = True
+
+	def refresh(self):
+		"""
+		Rebuilds the static meshes and the circle/box pairs of all worlds, both directions of a pair
+		of bodies are tested because CollisionSystem moves each of them against the other
+		"""
+		centers, extents, rotations = [], [], []
+		movers, others, pair_worlds = [], [], []
+		for world_id, world in self.worlds.items():
+			# (row, mesh), rows of static meshes start at capacity
+			bodies = []
+			meshes = []
+			for ent in world.entities:
+				mesh = ent.get_component(Mesh)
+				if mesh is None:
+					continue
+				if getattr(ent, 'batch_row', None) is not None:
+					bodies.append((ent.batch_row, mesh))
+					meshes.append((ent.batch_row, mesh))
+				else:
+					meshes.append((self.capacity + len(centers), mesh))
+					centers.append((ent.position.x, ent.position.y))
+					extents.append(mesh_extent(mesh))
+					rotations.append(ent.rotation)
+			for mover, mover_mesh in bodies:
+				for other, other_mesh in meshes:
+					if other != mover and CollisionSystem.is_swept_pair(mover_mesh, other_mesh):
+						movers.append(mover)
+						others.append(other)
+						pair_worlds.append(world_id)
+		capacity = self.capacity
+		self.center = np.concatenate((self.center[:capacity], np.array(centers, dtype=float).reshape(-1, 2)))
+		self.velocity = np.concatenate((self.velocity[:capacity], np.zeros((len(centers), 2))))
+		self.rotation = np.concatenate((self.rotation[:capacity], np.array(rotations, dtype=float)))
+		self.extent = np.concatenate((self.extent[:capacity], np.array(extents, dtype=float).reshape(-1, 2)))
+		self.pair_mover = np.array(movers, dtype=np.int64)
+		self.pair_other = np.array(others, dtype=np.int64)
+		self.pair_world = np.array(pair_worlds, dtype=np.int64)
+		self.dirty = False
+
+	def world_mask(self, worlds):
+		mask = np.zeros(self.next_world_id, dtype=bool)
+		mask[[world.world_id for world in worlds]] = True
+		return mask
+
+	def gather(self, worlds):
+		"""
+		Copies position, velocity and rotation of the bodies of the worlds into the arrays, returns their rows.
+		Rows are in the order of the worlds and of their entities.
+		"""
+		rows = [row for world in worlds for row in world.rows]
+		bodies = self.bodies
+		state = np.fromiter(
+			(value for ent, phys in map(bodies.__getitem__, rows) for value in (ent.position.x, ent.position.y, phys.velocity.x, phys.velocity.y, ent.rotation)),
+			dtype=float, count=len(rows) * STATE_SIZE,
+		).reshape(-1, STATE_SIZE)
+		rows = np.array(rows, dtype=np.int64)
+		self.center[rows] = state[:, 0:2]
+		self.velocity[rows] = state[:, 2:4]
+		self.rotation[rows] = state[:, 4]
+		return rows
+
+	def touching_worlds(self, worlds, margin):
+		"""
+		Ids of the worlds with a pair that may touch this tick. Separating axis test on the axes of both
+		meshes: the bounds of the mover swept along its velocity against the bounds of the other mesh,
+		grown by margin. Testing fewer axes than the swept shape has only finds more pairs, never less.
+		Pairs without a moving body are skipped, same as CollisionSystem.broad_phase.
+		"""
+		self.gather(worlds)
+		active = self.world_mask(worlds)[self.pair_world]
+		moving = (self.velocity != 0).any(axis=1)
+		mover = self.pair_mover[active]
+		other = self.pair_other[active]
+		checked = moving[mover] | moving[other]
+		mover = mover[checked]
+		other = other[checked]
+		if len(mover) == 0:
+			return set()
+
+		# everything relative to the mover at its start
+		offset = self.center[other] - self.center[mover]
+		displacement = self.velocity[mover]
+		mover_angle = np.radians(self.rotation[mover])
+		other_angle = np.radians(self.rotation[other])
+		cos = np.abs(np.cos(other_angle - mover_angle))
+		sin = np.abs(np.sin(other_angle - mover_angle))
+		mover_extent = self.extent[mover]
+		other_extent = self.extent[other]
+		# axis and the reach of both meshes along it: x and y of the mover, x and y of the other mesh
+		axes = (
+			(mover_angle, mover_extent[:, 0] + cos * other_extent[:, 0] + sin * other_extent[:, 1]),
+			(mover_angle + np.pi / 2, mover_extent[:, 1] + sin * other_extent[:, 0] + cos * other_extent[:, 1]),
+			(other_angle, cos * mover_extent[:, 0] + sin * mover_extent[:, 1] + other_extent[:, 0]),
+			(other_angle + np.pi / 2, sin * mover_extent[:, 0] + cos * mover_extent[:, 1] + other_extent[:, 1]),
+		)
+		separated = np.zeros(len(mover), dtype=bool)
+		for angle, reach in axes:
+			axis_x = np.cos(angle)
+			axis_y = np.sin(angle)
+			along = offset[:, 0] * axis_x + offset[:, 1] * axis_y
+			moved = displacement[:, 0] * axis_x + displacement[:, 1] * axis_y
+			gap = np.maximum(along - np.maximum(moved, 0), np.minimum(moved, 0) - along)
+			separated |= gap > reach + margin
+		return set(np.unique(self.pair_world[active][checked][~separated]).tolist())
+
+	def integrate(self, worlds):
+		"""
+		Vectorized MovementSystem: gravity, velocity and the Physics leash for every body of the worlds
+		"""
+		rows = self.gather(worlds)
+		if len(rows) == 0:
+			return
+		gravity = self.gravity[rows]
+		velocity = self.velocity[rows]
+		velocity[:, 1] += gravity
+		pos = self.center[rows]
+		new_pos = pos + velocity
+		dist = np.sqrt(((new_pos - self.anchor[rows])**2).sum(axis=1))
+		allowed = ~(dist > self.max_distance[rows])
+		changed = allowed & (new_pos != pos).any(axis=1)
+		bodies = self.bodies
+		falling = gravity != 0
+		for row, velocity_y in zip(rows[falling].tolist(), velocity[falling, 1].tolist()):
+			bodies[row][1].velocity.y = velocity_y
+		moved = rows[changed]
+		self.center[moved] = new_pos[changed]
+		current_world = -1
+		for row, world_id, x, y in zip(moved.tolist(), self.row_world[moved].tolist(), new_pos[changed, 0].tolist(), new_pos[changed, 1].tolist()):
+			if world_id != current_world:
+				current_world = world_id
+				self.worlds[world_id].enter()
+			ent = bodies[row][0]
+			ent.set_pos(x, y)
+			ent.on_moved()
+
+	def update(self, worlds):
+		"""
+		Runs one tick of all given worlds, every batch system runs once for all of them.
+		Systems that are not batch systems run per world.
+		"""
+		with self.lock:
+			if self.dirty:
+				self.refresh()
+			step = 0
+			while True:
+				steps = [(world, world.systems[step]) for world in worlds if step < len(world.systems)]
+				if not steps:
+					break
+				batched: dict[type, list] = {}
+				for world, sys in steps:
+					if isinstance(sys, BatchSystem):
+						batched.setdefault(type(sys), []).append((world, sys))
+					else:
+						world.enter()
+						sys.execute(world.entities)
+				for entries in batched.values():
+					# a batched system runs once for all worlds, the profiler of the first one gets its time
+					profiler = entries[0][0].profiler
+					if profiler is None:
+						entries[0][1].execute_batch(self, entries)
+					else:
+						start = time.perf_counter()
+						entries[0][1].execute_batch(self, entries)
+						profiler(entries[0][1], time.perf_counter() - start)
+				step += 1
+			for world in worlds:
+				world.enter()
+				for ent in world.entities:
+					ent.update()
+
+
+class BatchSystem(System):
+	def execute_batch(self, batch: PhysicsBatch, entries):
+		"""
+		entries are the (world, system) pairs of every world in this update that runs this system
+		"""
+		for world, sys in entries:
+			world.enter()
+			sys.execute(world.entities)
+
+
+class BatchMovementSystem(BatchSystem, MovementSystem):
+	def execute_batch(self, batch, entries):
+		batch.integrate([world for world, _ in entries])
+
+
+class BatchCollisionSystem(BatchSystem, CollisionSystem):
+	"""
+	One vectorized test for all worlds, the python narrow phase only runs in the worlds where something may touch
+	"""
+	def execute_batch(self, batch, entries):
+		touching = batch.touching_worlds([world for world, _ in entries], self.BOUNDS_MARGIN)
+		for world, sys in entries:
+			if world.world_id in touching:
+				world.enter()
+				sys.execute(world.entities)
+
+	def execute(self, entities):
+		"""
+		Same as CollisionSystem.execute without the pairs that have no continuous test
+		"""
+		candidates = {}
+		for index, others in self.broad_phase(entities).items():
+			mesh = entities[index].get_component(Mesh)
+			swept = [other for other in others if self.is_swept_pair(mesh, entities[other].get_component(Mesh))]
+			if swept:
+				candidates[index] = swept
+		self.collide(entities, candidates)
+
+
+class BatchWorld(World):
+	def __init__(self, batch: PhysicsBatch = None):
+		super().__init__()
+		self.batch = batch or PhysicsBatch.shared()
+		self.world_id = self.batch.add_world(self)
+		# rows of the Physics bodies in the order of entities
+		self.rows: list[int] = []
+		# called before entity callbacks of this world run, several worlds share one update
+		self.on_enter = None
+
+	def enter(self):
+		if self.on_enter is not None:
+			self.on_enter()
+
+	def addEntity(self, ent):
+		super().addEntity(ent)
+		self.batch.add_entity(self, ent)
+
+	def removeEntity(self, ent):
+		super().removeEntity(ent)
+		self.batch.remove_entity(self, ent)
+
+	def update(self):
+		self.batch.update([self])
+
+	def release(self):
+		self.batch.remove_world(self)
+
+	def reuse(self):
+		self.world_id = self.batch.add_world(self)
+		for ent in self.entities:
+			self.batch.add_entity(self, ent)
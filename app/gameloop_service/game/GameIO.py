@@ -0,0 +1,55 @@
+import os, time
+from . import PongProtocol
+from .MatchOutbox import MatchOutbox
+
+class GameIO:
+	"""
+	Everything a PongGame sends outside of its consumers goes through here: events for the whole
+	group (scores, round start, game over), the match results for gamehub (MatchOutbox) and the replay of the match.
+	PongHeadless has one that only records.
+	"""
+	def __init__(self, game):
+		self.game = game
+
+	def group_send(self, event):
+		"""
+		A reliable message in the SendQueue of every player and spectator, so it stays in order with the frames
+		"""
+		self.game.broadcast(bytes_data=PongProtocol.encode_frame([encode_event(event)]))
+
+	def post_match(self, data):
+		"""
+		Queued in the MatchOutbox, a running tournament score is replaced by the next one if it was not sent yet
+		"""
+		MatchOutbox.get(self.game.event_loop).put(data)
+
+	def save_replay(self, name, replay):
+		"""
+		Written to settings.GAME_REPLAY_DIR as <name>_<unix time>.pongreplay, nothing is written if it is not set
+		"""
+		from django.conf import settings
+		directory = getattr(settings, 'GAME_REPLAY_DIR', '')
+		if not directory:
+			return
+		path = os.path.join(directory, f'{name}_{int(time.time())}.pongreplay')
+		self.game.run_blocking(write_file, path, replay.encode())
+
+
+def encode_event(event):
+	kind = event['type']
+	if kind == 'player_score':
+		return PongProtocol.encode_set_score(event['id'], event['score'])
+	if kind == 'round_start':
+		return PongProtocol.encode_round_start()
+	if kind == 'game_over':
+		return PongProtocol.encode_game_over()
+	raise ValueError(f'Unknown group event {kind}')
+
+
+def write_file(path, data):
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'wb') as file:
+			file.write(data)
+	except OSError as e:
+		print(f'Could not write {path}: {e}')
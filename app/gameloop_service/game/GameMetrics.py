@@ -0,0 +1,55 @@
+"""
+Prometheus metrics of the game loop, django_prometheus serves them on /metrics of the process.
+
+Timing every tick of every game would cost more than the metrics are worth, so the per tick
+metrics are sampled: one tick in settings.GAME_PROFILE_INTERVAL of every game is measured
+(0 turns the sampling off). Counters and gauges are always exact.
+With GAME_SHARDS the games tick in the shard processes, their tick metrics are not exported.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+TIME_BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .016, .025, .05, .1)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+BYTES_BUCKETS = (0, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+SYSTEM_SECONDS = Histogram('gameloop_system_seconds', 'Time of one System.execute() in a sampled tick', ['system'], buckets=TIME_BUCKETS)
+TICK_SECONDS = Histogram('gameloop_tick_seconds', 'Time of one sampled game tick: inputs, world update and frame encoding', buckets=TIME_BUCKETS)
+SENDS_PER_TICK = Histogram('gameloop_sends_per_tick', 'Websocket sends of a sampled tick', buckets=COUNT_BUCKETS)
+BYTES_PER_TICK = Histogram('gameloop_bytes_per_tick', 'Bytes sent to all clients in a sampled tick', buckets=BYTES_BUCKETS)
+MOVE_TASKS = Histogram('gameloop_move_tasks', 'Entities in move_tasks when the frame of a sampled tick is built', buckets=COUNT_BUCKETS)
+SEND_QUEUE_DEPTH = Histogram('gameloop_send_queue_depth', 'Messages waiting in the SendQueue of each client in a sampled tick', buckets=COUNT_BUCKETS)
+UNACKED_FRAMES = Histogram('gameloop_unacked_frames', 'Frames sent to a client that acks and not acknowledged yet, in a sampled tick', buckets=COUNT_BUCKETS)
+
+TICKS = Counter('gameloop_ticks', 'Game ticks simulated')
+OVERRUNS = Counter('gameloop_tick_overruns', 'Times a game fell too far behind and skipped its missed ticks')
+DROPPED_TICKS = Counter('gameloop_dropped_ticks', 'Ticks skipped because of overruns')
+DROPPED_FRAMES = Counter('gameloop_dropped_frames', 'Frames dropped because the SendQueue of a client was full or it did not ack, it got a keyframe instead')
+SLOW_CLIENTS = Counter('gameloop_slow_clients_closed', 'Connections closed because reliable messages piled up in their SendQueue')
+
+ACTIVE_GAMES = Gauge('gameloop_active_games', 'Games ticked by the GameScheduler of this process')
+ACTIVE_SESSIONS = Gauge('gameloop_active_sessions', 'Game sessions (GamesHandler) of this process')
+
+
+def profile_interval():
+	from django.conf import settings
+	return getattr(settings, 'GAME_PROFILE_INTERVAL', 10)
+
+def observe_system(system, seconds):
+	"""
+	World.profiler
+	"""
+	SYSTEM_SECONDS.labels(type(system).__name__).observe(seconds)
+
+def observe_queues(queues):
+	for queue in queues:
+		SEND_QUEUE_DEPTH.observe(len(queue.messages))
+		if queue.unacked is not None:
+			UNACKED_FRAMES.observe(len(queue.unacked))
+
+def observe_frames(frames, move_tasks):
+	"""
+	frames are the (frame, consumers) pairs of the tick
+	"""
+	SENDS_PER_TICK.observe(sum(len(consumers) for _, consumers in frames))
+	BYTES_PER_TICK.observe(sum(len(frame) * len(consumers) for frame, consumers in frames))
+	MOVE_TASKS.observe(move_tasks)
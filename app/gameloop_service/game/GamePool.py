@@ -0,0 +1,79 @@
+"""
+Warm pool of PongGames (settings.GAME_POOL_SIZE per player count, 0 turns it off).
+
+Building a game (world, field geometry of the N-gon, static world state) happens before anyone
+asks for it, a new session takes a ready game in O(1). Taken games are replaced on the event loop
+one game per loop iteration, so refilling after a tournament round started all its matches does
+not hold up the ticks of the running games for long.
+
+A finished game comes back through put() once the scheduler finished it and its session let go of
+it (PongGame.recycle). It keeps its world and field, only the match state is reset (PongGame.reuse),
+so a pool that got its games back does not build anything.
+"""
+import asyncio, collections
+
+# the player counts GamesHandler creates games for
+PLAYER_COUNTS = (2, 4)
+
+class GamePool:
+	instance: 'GamePool' = None
+
+	def __init__(self, size, event_loop):
+		self.size = size
+		self.event_loop = event_loop
+		# player count -> ready games
+		self.games: dict[int, collections.deque] = {}
+		self.filling = set()
+		for player_count in PLAYER_COUNTS:
+			self.refill(player_count)
+
+	@staticmethod
+	def get():
+		"""
+		None if the pool is turned off
+		"""
+		from django.conf import settings
+		size = getattr(settings, 'GAME_POOL_SIZE', 4)
+		if size <= 0:
+			return None
+		event_loop = asyncio.get_running_loop()
+		if GamePool.instance is None or GamePool.instance.event_loop is not event_loop:
+			GamePool.instance = GamePool(size, event_loop)
+		return GamePool.instance
+
+	def take(self, player_count):
+		games = self.games.get(player_count)
+		game = games.popleft() if games else build_game(player_count)
+		self.refill(player_count)
+		return game
+
+	def put(self, game):
+		"""
+		A finished game, reset and ready again unless the pool is full
+		"""
+		games = self.games.setdefault(game.playerCount, collections.deque())
+		if game.playerCount not in PLAYER_COUNTS or len(games) >= self.size:
+			return
+		game.reuse()
+		games.append(game)
+
+	def refill(self, player_count):
+		if player_count not in self.filling:
+			self.filling.add(player_count)
+			self.event_loop.call_soon(self.fill, player_count)
+
+	def fill(self, player_count):
+		games = self.games.setdefault(player_count, collections.deque())
+		if len(games) < self.size:
+			games.append(build_game(player_count))
+		if len(games) < self.size:
+			self.event_loop.call_soon(self.fill, player_count)
+		else:
+			self.filling.discard(player_count)
+
+
+def build_game(player_count):
+	from .Pong import PongGame
+	game = PongGame(player_count)
+	game.build_field()
+	return game
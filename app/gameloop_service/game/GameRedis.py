@@ -0,0 +1,26 @@
+import asyncio
+from redis import asyncio as aioredis
+
+class GameRedis:
+	"""
+	The redis.asyncio client of the gameloop app, shared by the consumers, GamesHandler, SessionRegistry
+	and MatchOutbox of one event loop. A connection storm (a tournament round starting) waits for one of
+	MAX_CONNECTIONS pooled connections instead of opening one per request.
+	"""
+	MAX_CONNECTIONS = 32
+	# seconds a command waits for a free connection
+	POOL_TIMEOUT = 5
+
+	instance: 'GameRedis' = None
+
+	def __init__(self, event_loop):
+		self.event_loop = event_loop
+		pool = aioredis.BlockingConnectionPool(host='redis', port=6379, db=0, max_connections=self.MAX_CONNECTIONS, timeout=self.POOL_TIMEOUT)
+		self.client = aioredis.Redis(connection_pool=pool)
+
+	@staticmethod
+	def get():
+		event_loop = asyncio.get_running_loop()
+		if GameRedis.instance is None or GameRedis.instance.event_loop is not event_loop:
+			GameRedis.instance = GameRedis(event_loop)
+		return GameRedis.instance.client
@@ -0,0 +1,201 @@
+import asyncio, math, time
+from . import GameMetrics
+from .MatchOutbox import MatchOutbox
+
+# the game rules (speeds per tick) are tuned for this tick length
+REFERENCE_TICK_INTERVAL = 0.016
+
+def tick_interval():
+	"""
+	Seconds per simulation tick, settings.GAME_TICK_RATE is in ticks per second
+	"""
+	from django.conf import settings
+	return 1 / getattr(settings, 'GAME_TICK_RATE', 1 / REFERENCE_TICK_INTERVAL)
+
+def idle_rate():
+	"""
+	Ticks per second of a game that can not change (PongGame.idle_ticks), settings.GAME_IDLE_RATE, 0 turns it off
+	"""
+	from django.conf import settings
+	return getattr(settings, 'GAME_IDLE_RATE', 4)
+
+class GameScheduler:
+	"""
+	Ticks every running PongGame of the process from one task on the daphne event loop,
+	so the thread count does not grow with the number of matches.
+	Every game has its own deadline (next_tick), the task sleeps until the earliest one.
+
+	Fixed timestep: deadlines advance by exactly tick_interval on the monotonic clock, so the
+	game speed does not depend on how long a tick or the sleep took. A game that fell behind
+	catches up with at most MAX_CATCH_UP_TICKS ticks per wake up, if that is not enough the
+	backlog gets dropped and counted as an overrun (the node is saturated).
+
+	Idle games (countdown, nobody pressing a key) skip the ticks that could not change anything and
+	only tick at idle_rate() or when their countdown ends. Input wakes them up at the next tick of their
+	grid, the skipped ticks still count for the game clock (PongGame.begin_tick).
+	"""
+	MAX_CATCH_UP_TICKS = 4
+	STATS_INTERVAL = 10
+
+	instance: 'GameScheduler' = None
+
+	def __init__(self, event_loop):
+		self.event_loop = event_loop
+		self.tick_interval = tick_interval()
+		rate = idle_rate()
+		# most ticks an idle game skips in a row
+		self.max_idle_ticks = max(0, int(1 / (rate * self.tick_interval)) - 1) if rate > 0 else 0
+		self.wakeup = asyncio.Event()
+		self.games = []
+		self.task = None
+		self.ticks = 0
+		self.overruns = 0
+		self.dropped_ticks = 0
+		self.last_stats = time.monotonic()
+		self.last_overruns = 0
+
+	@staticmethod
+	def get():
+		event_loop = asyncio.get_running_loop()
+		if GameScheduler.instance is None or GameScheduler.instance.event_loop is not event_loop:
+			GameScheduler.instance = GameScheduler(event_loop)
+			# results a crashed process left in redis go out even if no match ends here
+			MatchOutbox.get(event_loop)
+		return GameScheduler.instance
+
+	def add_game(self, game):
+		game.next_tick = self.now()
+		self.games.append(game)
+		if self.task is None or self.task.done():
+			self.task = self.event_loop.create_task(self.run())
+
+	async def run(self):
+		while self.games:
+			now = self.now()
+			self.catch_up(now)
+			self.report(now)
+			for game in [game for game in self.games if game.stopped]:
+				self.games.remove(game)
+				game.finish()
+			if not self.games:
+				break
+			next_tick = min(game.next_tick for game in self.games)
+			await self.sleep(max(0, next_tick - self.now()))
+		print('GameScheduler: no games left')
+
+	def catch_up(self, now):
+		"""
+		Ticks every game that is due up to MAX_CATCH_UP_TICKS times, the ones still behind overrun
+		"""
+		for _ in range(self.MAX_CATCH_UP_TICKS):
+			due = [game for game in self.games if game.next_tick <= now and not game.stopped]
+			if not due:
+				break
+			self.tick_all(due)
+			self.ticks += len(due)
+			for game in due:
+				self.advance(game)
+		for game in self.games:
+			if game.next_tick <= now and not game.stopped:
+				self.overrun(game, now)
+
+	async def sleep(self, seconds):
+		"""
+		wake() cuts the sleep short if an idle game gets input
+		"""
+		if not any(game.idle_since is not None for game in self.games):
+			await asyncio.sleep(seconds)
+			return
+		self.wakeup.clear()
+		try:
+			await asyncio.wait_for(self.wakeup.wait(), seconds)
+		except asyncio.TimeoutError:
+			pass
+
+	def now(self):
+		return time.monotonic()
+
+	def advance(self, game):
+		"""
+		Deadline of the next tick of a game that just ticked
+		"""
+		game.next_tick += self.tick_interval
+		if self.max_idle_ticks == 0:
+			return
+		skip = min(game.idle_ticks(), self.max_idle_ticks)
+		if skip > 0:
+			game.idle_since = game.next_tick
+			game.next_tick += skip * self.tick_interval
+
+	def wake(self, game):
+		"""
+		An idle game ticks again at the first tick of its grid that is not over yet
+		"""
+		if game.idle_since is None:
+			return
+		skipped = max(0, math.ceil((self.now() - game.idle_since) / self.tick_interval - 1e-6))
+		game.next_tick = min(game.next_tick, game.idle_since + skipped * self.tick_interval)
+		self.wakeup.set()
+
+	def tick_all(self, games):
+		"""
+		Games on the batch physics backend share one PhysicsBatch.update() call
+		"""
+		GameMetrics.TICKS.inc(len(games))
+		batches = {}
+		for game in games:
+			batch = getattr(game.world, 'batch', None)
+			if batch is None or len(game.players) == 0:
+				self.tick(game)
+			else:
+				batches.setdefault(batch, []).append(game)
+		for batch, batch_games in batches.items():
+			try:
+				for game in batch_games:
+					game.begin_tick()
+				batch.update([game.world for game in batch_games])
+				for game in batch_games:
+					game.enter()
+					game.flush()
+			except Exception as e:
+				print(f'Batch tick failed, stopping {len(batch_games)} games: {e}')
+				for game in batch_games:
+					game.stop()
+
+	def tick(self, game):
+		try:
+			game.tick()
+		except Exception as e:
+			print(f'Game tick failed, stopping the game: {e}')
+			game.stop()
+
+	def overrun(self, game, now):
+		"""
+		Catching up would only make the game fall further behind, skip the missed ticks
+		"""
+		dropped = int((now - game.next_tick) / self.tick_interval) + 1
+		game.overruns += 1
+		self.overruns += 1
+		self.dropped_ticks += dropped
+		GameMetrics.OVERRUNS.inc()
+		GameMetrics.DROPPED_TICKS.inc(dropped)
+		game.next_tick = now + self.tick_interval
+
+	def report(self, now):
+		if now - self.last_stats < self.STATS_INTERVAL:
+			return
+		if self.overruns != self.last_overruns:
+			print(f'GameScheduler overloaded: {self.overruns - self.last_overruns} overruns in the last {now - self.last_stats:.0f}s, {self.stats()}')
+		self.last_stats = now
+		self.last_overruns = self.overruns
+
+	def stats(self):
+		return {
+			'games': len(self.games),
+			'ticks': self.ticks,
+			'overruns': self.overruns,
+			'dropped_ticks': self.dropped_ticks,
+		}
+
+
+GameMetrics.ACTIVE_GAMES.set_function(lambda: len(GameScheduler.instance.games) if GameScheduler.instance is not None else 0)
@@ -0,0 +1,347 @@
+"""
+Worker pool mode (settings.GAME_SHARDS > 0).
+
+The daphne process keeps the consumers and GamesHandler, the PongGames run on GAME_SHARDS
+simulation processes. A game is placed by hashing its group_name, every shard ticks its games
+with its own GameScheduler. Both sides talk over a multiprocessing Pipe:
+
+	daphne -> shard		('batch', [message])
+						message is one of
+						('start', group_name, player_count, [seat info])
+						('input', group_name, seat, input)
+						('ack', group_name, seat, tick)
+						('resync', group_name, seat)
+						('left', group_name, seat)
+						('stop', group_name)
+	shard -> daphne		('batch', [(group_name, seat, method, payload)])
+						method is send, close or assign
+
+Events (scores, round start, game over, disconnect) go through the SendQueues of the shard
+like the frames, so every consumer call goes through the pipe. Calls of one event loop
+iteration are sent as one batch.
+
+A pipe write blocks once the shard stops reading, so daphne never writes on its event loop:
+messages wait in the outbox of the shard and one writer task sends them from an executor thread.
+Inputs and acks of a seat replace the ones still waiting (only the latest input is applied and
+an ack covers the ticks before it), so a saturated shard does not make the outbox grow with every key press.
+"""
+import asyncio, itertools, multiprocessing, os, zlib
+
+class RemotePlayer:
+	"""
+	consumer.player_c in the daphne process, inputs get forwarded to the shard
+	"""
+	def __init__(self, game: 'RemoteGame', seat, ent_id):
+		self.game = game
+		self.seat = seat
+		self.id = ent_id
+
+	def handle_remote_movement(self, input):
+		self.game.post(('input', self.game.group_name, self.seat, input))
+
+
+class RemoteGame:
+	"""
+	Stand in for a PongGame running on a shard, GamesHandler uses it like a PongGame
+	"""
+	def __init__(self, shards: 'GameShards', conn, playerCount, group_name):
+		self.shards = shards
+		self.conn = conn
+		self.playerCount = playerCount
+		self.group_name = group_name
+		self.players = None
+		self.stopped = False
+		# seat index -> consumer, does not shift when GamesHandler removes a consumer from players
+		self.seats = []
+		# seats the shard may still send to, the game is forgotten once all of them closed or left
+		self.open_seats = set()
+
+	def post(self, message):
+		self.shards.post(self.conn, message)
+
+	def set_players(self, group_name):
+		from .Pong import GamesHandler
+		self.players = GamesHandler.game_players(group_name)
+
+	def start_game(self):
+		print('Starting game on shard', self.shards.conns.index(self.conn))
+		self.seats = list(self.players)
+		self.open_seats = set(range(len(self.seats)))
+		seats = [{
+			'group_name': consumer.group_name,
+			'match_type': consumer.match_type,
+			'lobby_id': consumer.lobby_id,
+			'match_id': consumer.match_id,
+			'uid': consumer.user.id,
+			'username': consumer.user.username,
+		} for consumer in self.seats]
+		self.post(('start', self.group_name, self.playerCount, seats))
+
+	def stop(self):
+		self.stopped = True
+		if self.shards.games.get(self.group_name) is self:
+			self.shards.games.pop(self.group_name)
+			self.post(('stop', self.group_name))
+
+	async def send_current_state(self, consumer):
+		if consumer in self.seats:
+			self.post(('resync', self.group_name, self.seats.index(consumer)))
+
+	def ack(self, consumer, tick):
+		if consumer in self.seats:
+			self.post(('ack', self.group_name, self.seats.index(consumer), tick))
+
+	async def player_left(self, consumer):
+		"""
+		The shard sends the disconnect to the other seats and closes them
+		"""
+		if self.stopped:
+			return
+		self.stopped = True
+		seat = self.seats.index(consumer)
+		self.post(('left', self.group_name, seat))
+		self.seat_closed(seat)
+
+	def seat_closed(self, seat):
+		self.open_seats.discard(seat)
+		if len(self.open_seats) == 0 and self.shards.games.get(self.group_name) is self:
+			self.shards.games.pop(self.group_name)
+
+
+class GameShards:
+	"""
+	The shard processes, seen from the daphne process
+	"""
+	# messages a newer one of the same seat replaces while they wait in the outbox
+	COALESCED = ('input', 'ack')
+
+	instance: 'GameShards' = None
+
+	def __init__(self, count):
+		context = multiprocessing.get_context('spawn')
+		self.event_loop = asyncio.get_running_loop()
+		self.conns = []
+		self.games: dict[str, RemoteGame] = {}
+		# conn -> {key: message} waiting for the pipe, conn -> its writer task
+		self.outboxes = {}
+		self.writers = {}
+		self.sequence = itertools.count()
+		for index in range(count):
+			conn, child_conn = context.Pipe()
+			process = context.Process(target=run_shard, args=(index, child_conn), name=f'gameloop-shard-{index}', daemon=True)
+			process.start()
+			child_conn.close()
+			self.event_loop.add_reader(conn.fileno(), self.on_readable, conn)
+			self.conns.append(conn)
+		print(f'Started {count} game shards')
+
+	@staticmethod
+	def get():
+		"""
+		None if the games run in this process
+		"""
+		if GameShards.instance is None:
+			from django.conf import settings
+			count = getattr(settings, 'GAME_SHARDS', 0)
+			if count <= 0:
+				return None
+			GameShards.instance = GameShards(count)
+		return GameShards.instance
+
+	def shard_for(self, group_name):
+		# crc32 and not hash(), the placement has to be the same in every process
+		return self.conns[zlib.crc32(group_name.encode()) % len(self.conns)]
+
+	def create_game(self, playerCount, group_name):
+		game = RemoteGame(self, self.shard_for(group_name), playerCount, group_name)
+		self.games[group_name] = game
+		return game
+
+	def post(self, conn, message):
+		"""
+		Never blocks, the writer task of the shard sends the message
+		"""
+		outbox = self.outboxes.setdefault(conn, {})
+		key = message[:3] if message[0] in self.COALESCED else next(self.sequence)
+		outbox[key] = message
+		writer = self.writers.get(conn)
+		if writer is None or writer.done():
+			self.writers[conn] = self.event_loop.create_task(self.write(conn))
+
+	async def write(self, conn):
+		"""
+		Everything that was posted while the last batch was written goes out as the next batch
+		"""
+		outbox = self.outboxes[conn]
+		while len(outbox) != 0:
+			messages = list(outbox.values())
+			outbox.clear()
+			try:
+				await self.event_loop.run_in_executor(None, conn.send, ('batch', messages))
+			except (OSError, ValueError) as e:
+				print(f'Could not write to game shard {self.conns.index(conn)}: {e}')
+				outbox.clear()
+				return
+
+	def on_readable(self, conn):
+		try:
+			while conn.poll():
+				message = conn.recv()
+				if message[0] == 'batch':
+					self.event_loop.create_task(self.deliver(message[1]))
+		except (EOFError, OSError):
+			self.on_shard_lost(conn)
+
+	def on_shard_lost(self, conn):
+		print(f'Game shard {self.conns.index(conn)} died')
+		self.event_loop.remove_reader(conn.fileno())
+		for game in [game for game in self.games.values() if game.conn is conn]:
+			self.games.pop(game.group_name)
+			game.stopped = True
+			for consumer in game.seats:
+				self.event_loop.create_task(consumer.close())
+
+	async def deliver(self, calls):
+		"""
+		Calls of one batch run in order, so a consumer gets its frames in the order the shard sent them
+		"""
+		for group_name, seat, method, payload in calls:
+			game = self.games.get(group_name)
+			if game is None or seat >= len(game.seats):
+				continue
+			consumer = game.seats[seat]
+			try:
+				if method == 'send':
+					await consumer.send(text_data=payload[0], bytes_data=payload[1])
+				elif method == 'assign':
+					consumer.player_c = RemotePlayer(game, seat, payload)
+				elif method == 'close':
+					game.seat_closed(seat)
+					await consumer.close()
+			except Exception as e:
+				print(f'Shard call {method} for {group_name} failed: {e}')
+
+
+class RemoteUser:
+	def __init__(self, id, username):
+		self.id = id
+		self.username = username
+
+
+class RemoteSeat:
+	"""
+	Stand in for a consumer inside a shard, PongGame uses it like a MyConsumer
+	"""
+	def __init__(self, worker: 'ShardWorker', index, info):
+		self.worker = worker
+		self.index = index
+		self.group_name = info['group_name']
+		self.match_type = info['match_type']
+		self.lobby_id = info['lobby_id']
+		self.match_id = info['match_id']
+		self.user = RemoteUser(info['uid'], info['username'])
+		self.player_c = None
+
+	def post(self, method, payload=None):
+		self.worker.post((self.group_name, self.index, method, payload))
+
+	async def send(self, text_data=None, bytes_data=None):
+		self.post('send', (text_data, bytes_data))
+
+	async def close(self):
+		self.post('close')
+
+	async def assign_player(self, pong_player):
+		self.player_c = pong_player
+		self.post('assign', pong_player.id)
+
+
+class ShardWorker:
+	"""
+	Runs in the shard process, owns the PongGames placed on this shard. scheduler ticks them,
+	the GameScheduler of the event loop by default
+	"""
+	def __init__(self, index, conn, scheduler=None):
+		self.index = index
+		self.conn = conn
+		self.scheduler = scheduler
+		self.games = {}
+		self.outbox = []
+		self.event_loop = None
+		self.closed = None
+
+	async def run(self):
+		self.event_loop = asyncio.get_running_loop()
+		self.closed = self.event_loop.create_future()
+		self.event_loop.add_reader(self.conn.fileno(), self.on_readable)
+		print(f'Game shard {self.index} running')
+		await self.closed
+
+	def on_readable(self):
+		try:
+			while self.conn.poll():
+				_, messages = self.conn.recv()
+				for message in messages:
+					self.handle(message)
+		except (EOFError, OSError):
+			print(f'Game shard {self.index} lost the daphne process, stopping')
+			self.event_loop.remove_reader(self.conn.fileno())
+			for game in self.games.values():
+				game.stop()
+			if not self.closed.done():
+				self.closed.set_result(None)
+
+	def handle(self, message):
+		from .Pong import new_game
+		kind, group_name = message[0], message[1]
+		game = self.games.get(group_name)
+		if kind == 'start':
+			game = new_game(message[2])
+			game.players = [RemoteSeat(self, index, info) for index, info in enumerate(message[3])]
+			game.on_stop = self.forget
+			self.games[group_name] = game
+			game.start_game(self.scheduler)
+		elif game is None:
+			return
+		elif kind == 'input':
+			player = game.players[message[2]].player_c
+			if player is not None:
+				player.handle_remote_movement(message[3])
+		elif kind == 'ack':
+			game.ack(game.players[message[2]], message[3])
+		elif kind == 'resync':
+			game.schedule(game.send_current_state(game.players[message[2]]))
+		elif kind == 'left':
+			self.games.pop(group_name)
+			game.schedule(game.player_left(game.players[message[2]]))
+		elif kind == 'stop':
+			self.games.pop(group_name)
+			game.stop()
+
+	def forget(self, game):
+		"""
+		Called by a game once it stopped, after a left or stop message or at the end of the match
+		"""
+		for group_name in [group_name for group_name, other in self.games.items() if other is game]:
+			self.games.pop(group_name)
+		game.detach()
+
+	def post(self, call):
+		if len(self.outbox) == 0:
+			self.event_loop.call_soon(self.flush)
+		self.outbox.append(call)
+
+	def flush(self):
+		outbox = self.outbox
+		self.outbox = []
+		try:
+			self.conn.send(('batch', outbox))
+		except (OSError, ValueError) as e:
+			print(f'Game shard {self.index} could not reach daphne: {e}')
+
+
+def run_shard(index, conn):
+	os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gameloop_service.settings')
+	import django
+	django.setup()
+	asyncio.run(ShardWorker(index, conn).run())
@@ -1,8 +1,15 @@
-import math
+import math, time
 
 G_ID = 0
 
 class Vector:
+	"""
+	add/sub/dup return new vectors, everything else works in place and returns self.
+	The physics hot loop sticks to the in place versions (set, iadd, isub, imul)
+	on scratch vectors so a tick does not create garbage.
+	"""
+	__slots__ = ('x', 'y')
+
 	def __init__(self, x, y):
 		self.x = x
 		self.y = y
@@ -10,12 +17,37 @@ class Vector:
 	def dup(self):
 		return Vector(self.x, self.y)
 
+	def set(self, x, y):
+		self.x = x
+		self.y = y
+		return self
+
+	def set_v(self, other_vector):
+		self.x = other_vector.x
+		self.y = other_vector.y
+		return self
+
 	def add(self, other_vector):
 		return Vector(self.x + other_vector.x, self.y + other_vector.y)
 
 	def sub(self, other_vector):
 		return Vector(self.x - other_vector.x, self.y - other_vector.y)
 
+	def iadd(self, other_vector):
+		self.x += other_vector.x
+		self.y += other_vector.y
+		return self
+
+	def isub(self, other_vector):
+		self.x -= other_vector.x
+		self.y -= other_vector.y
+		return self
+
+	def imul(self, size):
+		self.x *= size
+		self.y *= size
+		return self
+
 	def normalize(self):
 		length = math.sqrt(self.x**2 + self.y**2)
 		if length != 0:
@@ -48,43 +80,78 @@ class Vector:
 		return math.sqrt(self.sqr_length())
 
 class Plane:
+	__slots__ = ('start', 'dir', 'norm_dir', 'length')
+
 	def __init__(self, start, dir):
 		self.start = start.dup()
 		self.dir = dir.dup()
+		self.norm_dir = Vector(0, 0)
+		self.update_direction()
+
+	def update_direction(self):
+		"""
+		Caches the normalized direction and the length, call it after changing dir
+		"""
+		self.norm_dir.set_v(self.dir).normalize()
+		self.length = self.dir.dot(self.norm_dir)
 
 	def rotate(self, deg):
 		self.dir.rotate(deg)
+		self.update_direction()
 		return self
 
 	def get_tangent(self):
 		return Plane(self.start, self.dir.dup().rotate(90))
 
-	def get_closest_point(self, point):
-		norm_dir = self.dir.dup().normalize()
-		v = point.sub(self.start)
-		t = v.dot(norm_dir)
-		t = max(0, min(t, self.dir.dot(norm_dir)))
-		cp = self.start.add(norm_dir.scale(t))
-		return cp
+	def get_closest_t(self, point):
+		"""
+		Distance along the plane from start to the point closest to point
+		"""
+		t = (point.x - self.start.x) * self.norm_dir.x + (point.y - self.start.y) * self.norm_dir.y
+		return max(0, min(t, self.length))
+
+	def get_closest_point(self, point, out=None):
+		t = self.get_closest_t(point)
+		if out is None:
+			out = Vector(0, 0)
+		return out.set(self.start.x + self.norm_dir.x * t, self.start.y + self.norm_dir.y * t)
 
 class Transform:
+	"""
+	version goes up whenever position or rotation change, so anything derived from
+	the transform can be cached until the version changes.
+	Change the position with move/set_pos or by assigning a new vector, not by writing into position.x/y
+	"""
 	def __init__(self, pos_x, pos_y, rotation=0):
-		self.position = Vector(pos_x, pos_y)
+		self.version = 0
+		self._position = Vector(pos_x, pos_y)
 		self.rotation = rotation
 		self.up = Vector(0, -1)
 		self.up.rotate(rotation)
 
+	@property
+	def position(self):
+		return self._position
+
+	@position.setter
+	def position(self, vec):
+		self._position = vec
+		self.version += 1
+
 	def rotate(self, deg):
 		self.up.rotate(deg - self.rotation)
 		self.rotation = deg
+		self.version += 1
 
 	def move(self, x_add, y_add):
-		self.position.x += x_add
-		self.position.y += y_add
+		self._position.x += x_add
+		self._position.y += y_add
+		self.version += 1
 	
 	def set_pos(self, x, y):
-		self.position.x = x
-		self.position.y = y
+		self._position.x = x
+		self._position.y = y
+		self.version += 1
 	
 	def serialize(self):
 		return ({
@@ -106,52 +173,135 @@ class Physics(Component):
 		self.has_gravity = has_gravity
 		self.is_static = is_static
 		self.velocity = Vector(x, y)
+		# optional leash, the body can not move further than max_distance away from anchor
+		self.anchor: Vector = None
+		self.max_distance = float('inf')
+
+	def can_reach(self, x, y):
+		if self.anchor is None:
+			return True
+		return math.sqrt((x - self.anchor.x)**2 + (y - self.anchor.y)**2) <= self.max_distance
 
 	def set_velocity(self, dx, dy):
 		self.velocity.x = dx
 		self.velocity.y = dy
 
 	def set_velocity_v(self, vec):
-		self.velocity = vec
+		"""
+		Copies vec, the velocity vector itself stays the same object
+		"""
+		self.velocity.set_v(vec)
 
 class Mesh(Component):
+	"""
+	The world space points, edges and bounds are cached for the last transform they got
+	requested with and only rebuilt once that transform moved or rotated (Transform.version).
+	The cached lists are shared, do not modify them.
+	"""
 	def __init__(self, is_trigger=False):
 		super().__init__()
 		self.is_trigger = is_trigger
 		self.points = []
-
-	def get_closest_point(self, transform: Transform, point: Vector):
-		closest_point = None
+		self.cached_transform = None
+		self.cached_version = -1
+		self.world_points: list[Vector] = []
+		self.world_edges: list[Plane] = []
+		self.world_normals: list[Vector] = []
+		self.world_bounds = None
+
+	def update_world_cache(self, transform: Transform):
+		if self.cached_transform is transform and self.cached_version == transform.version:
+			return
+		self.cached_transform = transform
+		self.cached_version = transform.version
+		count = len(self.points)
+		if len(self.world_points) != count:
+			self.world_points = [Vector(0, 0) for _ in range(count)]
+			self.world_edges = [Plane(Vector(0, 0), Vector(0, 0)) for _ in range(count)]
+			self.world_normals = [Vector(0, 0) for _ in range(count)]
+
+		# the cached vectors get overwritten in place, a moving mesh does not allocate
+		pos = transform.position
+		radians = transform.rotation * (math.pi / 180)
+		cos = math.cos(radians)
+		sin = math.sin(radians)
+		for point, world_point in zip(self.points, self.world_points):
+			world_point.set(point.x * cos - point.y * sin + pos.x, point.x * sin + point.y * cos + pos.y)
+		for i in range(count):
+			point_a = self.world_points[i]
+			point_b = self.world_points[(i + 1) % count]
+			edge = self.world_edges[i]
+			edge.start.set_v(point_a)
+			edge.dir.set(point_b.x - point_a.x, point_b.y - point_a.y)
+			edge.update_direction()
+			# outward normal, pointing away from the center of the mesh
+			normal = self.world_normals[i].set(-edge.norm_dir.y, edge.norm_dir.x)
+			if normal.x * (point_a.x - pos.x) + normal.y * (point_a.y - pos.y) < 0:
+				normal.scale(-1)
+		if self.world_points:
+			xs = [p.x for p in self.world_points]
+			ys = [p.y for p in self.world_points]
+			self.world_bounds = (min(xs), min(ys), max(xs), max(ys))
+		else:
+			self.world_bounds = None
+
+	def get_world_points(self, transform: Transform):
+		self.update_world_cache(transform)
+		return self.world_points
+
+	def get_world_edges(self, transform: Transform):
+		self.update_world_cache(transform)
+		return self.world_edges
+
+	def get_closest_point(self, transform: Transform, point: Vector, out=None):
+		"""
+		Closest point on the outline of the mesh, written into out if given
+		"""
+		closest_plane = None
+		closest_t = 0
 		smallest_dist = float('inf')
 
-		transformed_points = [p.dup().rotate(transform.rotation).add(transform.position) for p in self.points]
-		
-		for i in range(len(transformed_points)):
-			point_a = transformed_points[i]
-			point_b = transformed_points[(i + 1) % len(transformed_points)]
-
-			plane_ab = Plane(point_a, point_b.sub(point_a))
-
-			curr_point = plane_ab.get_closest_point(point)
-			line = curr_point.sub(point)
-			dist = line.sqr_length()
+		for plane_ab in self.get_world_edges(transform):
+			t = plane_ab.get_closest_t(point)
+			line_x = plane_ab.start.x + plane_ab.norm_dir.x * t - point.x
+			line_y = plane_ab.start.y + plane_ab.norm_dir.y * t - point.y
+			dist = line_x * line_x + line_y * line_y
 			
 			if dist < smallest_dist:
 				smallest_dist = dist
-				closest_point = curr_point
-		return closest_point
+				closest_plane = plane_ab
+				closest_t = t
+		if closest_plane is None:
+			return None
+		if out is None:
+			out = Vector(0, 0)
+		return out.set(closest_plane.start.x + closest_plane.norm_dir.x * closest_t, closest_plane.start.y + closest_plane.norm_dir.y * closest_t)
+
+	def get_bounds(self, transform: Transform):
+		"""
+		Axis aligned bounding box of the mesh in world space as (min_x, min_y, max_x, max_y)
+		"""
+		self.update_world_cache(transform)
+		return self.world_bounds
 
 class Circle(Mesh):
 	def __init__(self, width, is_trigger=False):
 		super().__init__(is_trigger)
 		self.width = self.height = width
 
-	def get_closest_point(self, transform, point):
-		closest_point = point.sub(transform.position)
-		closest_point.normalize()
-		closest_point.scale(self.width * 0.5)
-		closest_point = closest_point.add(transform.position)
-		return closest_point
+	def get_closest_point(self, transform, point, out=None):
+		if out is None:
+			out = Vector(0, 0)
+		pos = transform.position
+		out.set(point.x - pos.x, point.y - pos.y)
+		out.normalize()
+		out.scale(self.width * 0.5)
+		return out.iadd(pos)
+
+	def get_bounds(self, transform):
+		radius = self.width * 0.5
+		pos = transform.position
+		return (pos.x - radius, pos.y - radius, pos.x + radius, pos.y + radius)
 
 class Box(Mesh):
 	def __init__(self, w, h, is_trigger=False):
@@ -165,6 +315,44 @@ class Box(Mesh):
 			Vector(-(self.width * 0.5), -(self.height * 0.5))
 		])
 
+def time_of_impact(center: Vector, radius, displacement: Vector, edges: list[Plane], normals: list[Vector]):
+	"""
+	Earliest t in [0, 1] at which a circle moving from center to center + displacement
+	touches the convex polygon given by its world space edges and outward normals, None if it never does.
+	Sweeping a circle against a polygon is the same as casting a ray against the polygon
+	inflated by the radius: offset edges for the faces and circles around the corners.
+	"""
+	toi = None
+	move_x = displacement.x
+	move_y = displacement.y
+	for edge, normal in zip(edges, normals):
+		if edge.length == 0:
+			continue
+		offset_x = center.x - edge.start.x
+		offset_y = center.y - edge.start.y
+
+		# face of the edge, pushed out by the radius
+		speed = move_x * normal.x + move_y * normal.y
+		if speed < 0:
+			dist = offset_x * normal.x + offset_y * normal.y - radius
+			if dist >= 0 and dist <= -speed and (toi is None or dist / -speed < toi):
+				t = dist / -speed
+				along_edge = (offset_x + move_x * t) * edge.norm_dir.x + (offset_y + move_y * t) * edge.norm_dir.y
+				if 0 <= along_edge <= edge.length:
+					toi = t
+
+		# rounded corner at the start of the edge
+		a = move_x * move_x + move_y * move_y
+		b = offset_x * move_x + offset_y * move_y
+		c = offset_x * offset_x + offset_y * offset_y - radius * radius
+		if a > 0 and b < 0 and c >= 0:
+			discriminant = b * b - a * c
+			if discriminant >= 0:
+				t = (-b - math.sqrt(discriminant)) / a
+				if t <= 1 and (toi is None or t < toi):
+					toi = t
+	return toi
+
 class Entity(Transform):
 	def __init__(self, x, y):
 		super().__init__(x, y)
@@ -187,6 +375,12 @@ class Entity(Transform):
 
 	def has_component(self, component_type):
 		return component_type in self.components
+
+	def on_moved(self):
+		"""
+		Called by moving entities after their position changed, the batch backend calls it after its bulk move
+		"""
+		pass
 	
 	def update(self):
 		pass
@@ -205,51 +399,229 @@ class MovementSystem(System):
 				entity.move(phys.velocity.x, phys.velocity.y)
 
 class CollisionSystem(System):
+	"""
+	Broad phase: sweep and prune along the x axis over the world space AABBs of all meshes.
+	Meshes without Physics never move, so only pairs involving at least one moving
+	Physics body reach the narrow phase. Both bodies of a pair get tested as the
+	current entity if they have Physics, same as the full n² loop did.
+	"""
+	BOUNDS_MARGIN = 1
+	# overlap we accept while a circle is touching a box
+	CONTACT_SLOP = 0.01
+	# a bounce changes the path that the MovementSystem will take, so a circle sweeps its candidates again
+	MAX_SWEEP_PASSES = 3
+
+	def __init__(self):
+		# scratch space, only valid until the next narrow phase test
+		self.current_pos = Vector(0, 0)
+		self.displacement = Vector(0, 0)
+		self.closing = Vector(0, 0)
+		self.to_box = Vector(0, 0)
+		self.s_closest = Vector(0, 0)
+		self.o_closest = Vector(0, 0)
+		self.step_transform = Transform(0, 0)
+
 	def execute(self, entities):
-		for current_ent in entities:
+		self.collide(entities, self.broad_phase(entities))
+
+	def collide(self, entities, candidates):
+		for index, current_ent in enumerate(entities):
+			others = candidates.get(index)
+			if not others:
+				continue
 			ent_mesh = current_ent.get_component(Mesh)
 			ent_phys = current_ent.get_component(Physics)
-			if not ent_mesh or not ent_phys:
+			steps = max(1, math.ceil(ent_phys.velocity.length() / max(ent_mesh.width * 0.5, ent_mesh.height * 0.5)))
+			others.sort()
+			bounced = False
+			for other_index in others:
+				bounced |= self.narrow_phase(current_ent, ent_mesh, ent_phys, entities[other_index], steps)
+			passes = 1
+			while bounced and passes < self.MAX_SWEEP_PASSES and isinstance(ent_mesh, Circle):
+				bounced = False
+				for other_index in others:
+					other_ent = entities[other_index]
+					if self.is_swept_pair(ent_mesh, other_ent.get_component(Mesh)):
+						bounced |= self.narrow_phase(current_ent, ent_mesh, ent_phys, other_ent, steps)
+				passes += 1
+
+	def broad_phase(self, entities):
+		"""
+		Returns {entity index: [indices of possible colliders]} for every entity with Physics.
+		The AABB of a moving body grows by its speed for every sweep pass in every direction,
+		a body moves a full step again after each bounce, so this covers its path for this
+		tick and fast bodies can not tunnel past the culling.
+		"""
+		proxies = []
+		for index, ent in enumerate(entities):
+			mesh = ent.get_component(Mesh)
+			if not mesh:
 				continue
-			for other_ent in entities:
-				if current_ent != other_ent:
-					other_mesh = other_ent.get_component(Mesh)
-					if not other_mesh:
-						continue
-					steps = max(1, math.ceil(ent_phys.velocity.length() / max(ent_mesh.width * 0.5, ent_mesh.height * 0.5)))
-					for i in range(steps):
-						t = i / steps
-						current_pos = current_ent.position.add(ent_phys.velocity.dup().scale(t))
-						other_pos = other_ent.position
-						ab = other_pos.sub(current_pos)
-						threshold = max(ent_mesh.width, ent_mesh.height, other_mesh.width, other_mesh.height) * 0.5
-						if ab.length() < threshold:
-							step_transform = Transform(current_pos.x, current_pos.y, current_ent.rotation)
-							o_closest = other_mesh.get_closest_point(other_ent, current_pos)
-							s_closest = ent_mesh.get_closest_point(step_transform, o_closest)
-							diff = o_closest.sub(s_closest)
-							if diff.dot(ab) < 0:
-								if not ent_phys.is_static:
-									current_ent.set_pos(current_pos.x, current_pos.y)
-									current_ent.move(diff.x, diff.y)
-								o_phys = other_ent.get_component(Physics)
-								if o_phys and not o_phys.is_static:
-									other_ent.move(-diff.x, -diff.y)
-								if ent_mesh.is_trigger:
-									current_ent.on_trigger(other_ent, s_closest)
-								else:
-									current_ent.on_collision(other_ent, s_closest)
-								if other_mesh.is_trigger:
-									other_ent.on_trigger(current_ent, o_closest)
-								else:
-									other_ent.on_collision(current_ent, o_closest)
-								break
+			min_x, min_y, max_x, max_y = mesh.get_bounds(ent)
+			phys = ent.get_component(Physics)
+			has_phys = phys is not None
+			moving = has_phys and (phys.velocity.x != 0 or phys.velocity.y != 0)
+			if moving:
+				speed = phys.velocity.length() * self.MAX_SWEEP_PASSES
+				min_x -= speed
+				min_y -= speed
+				max_x += speed
+				max_y += speed
+			proxies.append((
+				min_x - self.BOUNDS_MARGIN, min_y - self.BOUNDS_MARGIN,
+				max_x + self.BOUNDS_MARGIN, max_y + self.BOUNDS_MARGIN,
+				index, has_phys, moving
+			))
+		proxies.sort(key=lambda proxy: proxy[0])
+
+		candidates: dict[int, list[int]] = {}
+		active = []
+		for proxy in proxies:
+			min_x, min_y, _, max_y, index, has_phys, moving = proxy
+			active = [other for other in active if other[2] >= min_x]
+			for other in active:
+				if not moving and not other[6]:
+					continue
+				if other[1] > max_y or other[3] < min_y:
+					continue
+				if has_phys:
+					candidates.setdefault(index, []).append(other[4])
+				if other[5]:
+					candidates.setdefault(other[4], []).append(index)
+			active.append(proxy)
+		return candidates
+
+	@staticmethod
+	def is_swept_pair(mesh, other_mesh):
+		return isinstance(mesh, Circle) and isinstance(other_mesh, Box) or isinstance(mesh, Box) and isinstance(other_mesh, Circle)
+
+	def narrow_phase(self, current_ent, ent_mesh, ent_phys, other_ent, steps):
+		"""
+		Returns True if a continuous collision got resolved
+		"""
+		other_mesh = other_ent.get_component(Mesh)
+		if self.is_swept_pair(ent_mesh, other_mesh):
+			return self.swept_narrow_phase(current_ent, ent_mesh, ent_phys, other_ent, other_mesh)
+		self.sampled_narrow_phase(current_ent, ent_mesh, ent_phys, other_ent, other_mesh, steps)
+		return False
+
+	def swept_narrow_phase(self, current_ent, ent_mesh, ent_phys, other_ent, other_mesh):
+		"""
+		Continuous Circle vs Box test, one time of impact calculation instead of sampling sub-steps.
+		Only the current entity moves during the pass, so if the box is the current entity
+		the circle moves against it with the inverted velocity.
+		A touching pair only collides while the bodies close in on each other.
+		"""
+		circle_is_current = isinstance(ent_mesh, Circle)
+		if circle_is_current:
+			circle_ent, circle_mesh, box_ent, box_mesh = current_ent, ent_mesh, other_ent, other_mesh
+			displacement = self.displacement.set_v(ent_phys.velocity)
+		else:
+			circle_ent, circle_mesh, box_ent, box_mesh = other_ent, other_mesh, current_ent, ent_mesh
+			displacement = self.displacement.set_v(ent_phys.velocity).imul(-1)
+		closing = self.closing.set(0, 0)
+		circle_phys = circle_ent.get_component(Physics)
+		if circle_phys:
+			closing.iadd(circle_phys.velocity)
+		box_phys = box_ent.get_component(Physics)
+		if box_phys:
+			closing.isub(box_phys.velocity)
+		radius = circle_mesh.width * 0.5
+		center = circle_ent.position
+
+		to_box = box_mesh.get_closest_point(box_ent, center, self.to_box).isub(center)
+		dist = to_box.length()
+		if dist < radius - self.CONTACT_SLOP:
+			t = 0
+		elif dist < radius:
+			if to_box.dot(closing) <= 0:
+				return False
+			t = 0
+		else:
+			# the slop keeps a circle that slides along a face from grazing the corner at its end
+			box_mesh.update_world_cache(box_ent)
+			t = time_of_impact(center, radius - self.CONTACT_SLOP, displacement, box_mesh.world_edges, box_mesh.world_normals)
+			if t is None:
+				return False
+
+		current_pos = self.current_pos.set(current_ent.position.x + ent_phys.velocity.x * t, current_ent.position.y + ent_phys.velocity.y * t)
+		if circle_is_current:
+			center = current_pos
+			box_transform = box_ent
+		elif t == 0:
+			box_transform = box_ent
+		else:
+			box_transform = self.step_transform
+			box_transform.set_pos(current_pos.x, current_pos.y)
+			if box_transform.rotation != current_ent.rotation:
+				box_transform.rotate(current_ent.rotation)
+		box_point = box_mesh.get_closest_point(box_transform, center, self.o_closest if circle_is_current else self.s_closest)
+		to_box.set(box_point.x - center.x, box_point.y - center.y)
+		if t > 0 and to_box.dot(closing) <= 0:
+			return False
+		circle_point = (self.s_closest if circle_is_current else self.o_closest).set_v(to_box).normalize().scale(radius).iadd(center)
+		if circle_is_current:
+			self.resolve(current_ent, ent_mesh, ent_phys, other_ent, other_mesh, current_pos, circle_point, box_point)
+		else:
+			self.resolve(current_ent, ent_mesh, ent_phys, other_ent, other_mesh, current_pos, box_point, circle_point)
+		return True
+
+	def sampled_narrow_phase(self, current_ent, ent_mesh, ent_phys, other_ent, other_mesh, steps):
+		"""
+		Fallback for mesh pairs without a continuous test, samples the path in steps
+		"""
+		threshold = max(ent_mesh.width, ent_mesh.height, other_mesh.width, other_mesh.height) * 0.5
+		current_pos = self.current_pos
+		other_pos = other_ent.position
+		for i in range(steps):
+			t = i / steps
+			current_pos.set(current_ent.position.x + ent_phys.velocity.x * t, current_ent.position.y + ent_phys.velocity.y * t)
+			ab_x = other_pos.x - current_pos.x
+			ab_y = other_pos.y - current_pos.y
+			if math.sqrt(ab_x * ab_x + ab_y * ab_y) < threshold:
+				# the first step is where the entity is, that way its mesh cache stays valid
+				if i == 0:
+					step_transform = current_ent
+				else:
+					step_transform = self.step_transform
+					step_transform.set_pos(current_pos.x, current_pos.y)
+					if step_transform.rotation != current_ent.rotation:
+						step_transform.rotate(current_ent.rotation)
+				o_closest = other_mesh.get_closest_point(other_ent, current_pos, self.o_closest)
+				s_closest = ent_mesh.get_closest_point(step_transform, o_closest, self.s_closest)
+				if (o_closest.x - s_closest.x) * ab_x + (o_closest.y - s_closest.y) * ab_y < 0:
+					self.resolve(current_ent, ent_mesh, ent_phys, other_ent, other_mesh, current_pos, s_closest, o_closest)
+					break
+
+	def resolve(self, current_ent, ent_mesh, ent_phys, other_ent, other_mesh, current_pos, s_closest, o_closest):
+		"""
+		Moves the current entity to where the collision happened, pushes the bodies apart and calls the callbacks.
+		The collision points are scratch vectors, callbacks must copy them if they want to keep them.
+		"""
+		diff_x = o_closest.x - s_closest.x
+		diff_y = o_closest.y - s_closest.y
+		if not ent_phys.is_static:
+			current_ent.set_pos(current_pos.x, current_pos.y)
+			current_ent.move(diff_x, diff_y)
+		o_phys = other_ent.get_component(Physics)
+		if o_phys and not o_phys.is_static:
+			other_ent.move(-diff_x, -diff_y)
+		if ent_mesh.is_trigger:
+			current_ent.on_trigger(other_ent, s_closest)
+		else:
+			current_ent.on_collision(other_ent, s_closest)
+		if other_mesh.is_trigger:
+			other_ent.on_trigger(current_ent, o_closest)
+		else:
+			other_ent.on_collision(current_ent, o_closest)
 
 
 class World:
 	def __init__(self):
 		self.entities: list[Entity] = []
 		self.systems: list[Entity] = []
+		# profiler(system, seconds) gets the time of every System.execute() while it is set
+		self.profiler = None
 
 	def addEntity(self, ent):
 		self.entities.append(ent)
@@ -261,8 +633,26 @@ class World:
 		self.systems.append(sys)
 
 	def update(self):
+		profiler = self.profiler
 		for sys in self.systems:
-			sys.execute(self.entities)
+			if profiler is None:
+				sys.execute(self.entities)
+			else:
+				start = time.perf_counter()
+				sys.execute(self.entities)
+				profiler(sys, time.perf_counter() - start)
 		
 		for ent in self.entities:
 			ent.update()
+
+	def release(self):
+		"""
+		Called once the world is not simulated anymore
+		"""
+		pass
+
+	def reuse(self):
+		"""
+		Called before a released world is simulated again
+		"""
+		pass
@@ -0,0 +1,191 @@
+"""
+Match results for gamehub, posted in the background so a slow or restarting gamehub never stalls a game.
+
+PongGame only calls put(), which replaces the pending result of the same match: the running score
+updates of a tournament match coalesce and only the latest one is sent. The worker task writes every
+pending result to the redis hash of its process (OUTBOX_KEY:<node>) before it posts it and removes it
+once gamehub accepted it. Failed posts are retried per result with a backoff of MIN_BACKOFF up to
+MAX_BACKOFF seconds and go to the back of the line, so one result gamehub chokes on does not hold up
+the others. Results gamehub rejects with a 4xx are dropped.
+
+While it has results the process keeps the lease OUTBOX_KEY:<node>:lease alive. The worker task starts
+with the outbox, which the GameScheduler creates when it starts, and first claims the hashes whose lease
+ran out (the old shared OUTBOX_KEY hash never has one) with CLAIM_SCRIPT, which takes and deletes a hash
+in one step, so results of a dead process are picked up by exactly one of the running replicas even if
+this one never finishes a match.
+
+Delivery is at least once: a result can be posted twice if the process dies right after the post.
+"""
+import asyncio, json, uuid
+import requests
+from .GameRedis import GameRedis
+
+GAMEHUB_MATCH_URL = 'http://gamehub-service:8003/match/'
+OUTBOX_KEY = 'gameloop_match_outbox'
+
+# only remove the result if it was not replaced by a newer one in the meantime
+ACK_SCRIPT = "if redis.call('hget', KEYS[1], ARGV[1]) == ARGV[2] then return redis.call('hdel', KEYS[1], ARGV[1]) else return 0 end"
+# KEYS[1] hash of a node, KEYS[2] its lease: the entries of a dead node, deleted in the same step
+CLAIM_SCRIPT = "if redis.call('exists', KEYS[2]) == 1 then return {} end local entries = redis.call('hgetall', KEYS[1]) redis.call('del', KEYS[1]) return entries"
+
+class PermanentError(Exception):
+	pass
+
+
+def match_key(data):
+	"""
+	Results with the same key replace each other, only tournament matches get updates before they end
+	"""
+	if data.get('type') == 'tournament':
+		return f"tournament_{data['lobby_id']}_{data['match_id']}"
+	return f"{data.get('type')}_{data.get('lobby_id')}_{uuid.uuid4().hex}"
+
+
+def post(payload):
+	response = requests.post(GAMEHUB_MATCH_URL, data=payload, headers={'Content-Type': 'application/json'}, timeout=MatchOutbox.POST_TIMEOUT)
+	if 400 <= response.status_code < 500:
+		raise PermanentError(f'{response.status_code} {response.text[:200]}')
+	response.raise_for_status()
+
+
+class MatchOutbox:
+	POST_TIMEOUT = 5
+	MIN_BACKOFF = 0.5
+	MAX_BACKOFF = 30
+	LEASE_MS = 60000
+
+	instance: 'MatchOutbox' = None
+
+	def __init__(self, event_loop, redis=None, post=post):
+		self.event_loop = event_loop
+		self.redis = redis
+		self.post = post
+		self.hash_key = f'{OUTBOX_KEY}:{uuid.uuid4().hex}'
+		self.lease_key = f'{self.hash_key}:lease'
+		self.renewed = None
+		# key -> json payload, in the order they are tried next
+		self.pending: dict[str, str] = {}
+		# keys whose latest payload is not in redis yet
+		self.dirty = set()
+		# key -> (event loop time of the next try, backoff) of results that failed
+		self.retry: dict[str, tuple] = {}
+		self.wake = asyncio.Event()
+		self.task = None
+
+	@staticmethod
+	def get(event_loop):
+		if MatchOutbox.instance is None or MatchOutbox.instance.event_loop is not event_loop:
+			MatchOutbox.instance = MatchOutbox(event_loop, GameRedis.get())
+			MatchOutbox.instance.start()
+		return MatchOutbox.instance
+
+	def start(self):
+		"""
+		The worker task, it recovers the results of dead processes before it sends anything
+		"""
+		if self.task is None or self.task.done():
+			self.task = self.event_loop.create_task(self.run())
+
+	def put(self, data):
+		"""
+		Never blocks, the result is sent by the worker task
+		"""
+		key = match_key(data)
+		self.pending[key] = json.dumps(data)
+		self.dirty.add(key)
+		self.wake.set()
+		self.start()
+
+	async def run(self):
+		await self.recover()
+		while True:
+			await self.persist()
+			key = self.next_due()
+			if key is None:
+				await self.sleep()
+				continue
+			payload = self.pending[key]
+			try:
+				await self.event_loop.run_in_executor(None, self.post, payload)
+			except PermanentError as e:
+				print(f'MatchOutbox: gamehub rejected {key}, dropping it: {e}')
+			except Exception as e:
+				_, backoff = self.retry.get(key, (0, self.MIN_BACKOFF / 2))
+				backoff = min(max(backoff * 2, self.MIN_BACKOFF), self.MAX_BACKOFF)
+				print(f'MatchOutbox: could not post {key}, retrying in {backoff}s: {e}')
+				self.retry[key] = (self.event_loop.time() + backoff, backoff)
+				# behind the other results
+				self.pending[key] = self.pending.pop(key)
+				continue
+			self.retry.pop(key, None)
+			await self.ack(key, payload)
+
+	def next_due(self):
+		now = self.event_loop.time()
+		for key in self.pending:
+			if key not in self.retry or self.retry[key][0] <= now:
+				return key
+		return None
+
+	async def sleep(self):
+		"""
+		Until put() or the next retry, at most a third of the lease while results are pending
+		"""
+		self.wake.clear()
+		timeout = None
+		if len(self.pending) != 0:
+			next_try = min(self.retry[key][0] for key in self.pending if key in self.retry)
+			timeout = min(max(next_try - self.event_loop.time(), 0), self.LEASE_MS / 3000)
+		try:
+			await asyncio.wait_for(self.wake.wait(), timeout)
+		except asyncio.TimeoutError:
+			pass
+
+	async def recover(self):
+		"""
+		Results of processes whose lease ran out
+		"""
+		if self.redis is None:
+			return
+		try:
+			keys = [key.decode() async for key in self.redis.scan_iter(match=f'{OUTBOX_KEY}*')]
+			for key in keys:
+				if key.endswith(':lease') or key == self.hash_key:
+					continue
+				entries = await self.redis.eval(CLAIM_SCRIPT, 2, key, f'{key}:lease')
+				for name, payload in zip(entries[::2], entries[1::2]):
+					name = name.decode()
+					if name not in self.pending:
+						self.pending[name] = payload.decode()
+						self.dirty.add(name)
+		except Exception as e:
+			print(f'MatchOutbox: could not recover results: {e}')
+
+	async def persist(self):
+		if self.redis is None:
+			self.dirty.clear()
+			return
+		mapping = {key: self.pending[key] for key in self.dirty if key in self.pending}
+		self.dirty.clear()
+		now = self.event_loop.time()
+		renew = len(self.pending) != 0 and (self.renewed is None or now - self.renewed >= self.LEASE_MS / 3000)
+		if len(mapping) == 0 and not renew:
+			return
+		try:
+			await self.redis.set(self.lease_key, 1, px=self.LEASE_MS)
+			self.renewed = now
+			if len(mapping) != 0:
+				await self.redis.hset(self.hash_key, mapping=mapping)
+		except Exception as e:
+			# still delivered from memory, only a restart would lose it
+			print(f'MatchOutbox: could not store results in redis: {e}')
+
+	async def ack(self, key, payload):
+		if self.pending.get(key) == payload:
+			del self.pending[key]
+		if self.redis is None:
+			return
+		try:
+			await self.redis.eval(ACK_SCRIPT, 1, self.hash_key, key, payload)
+		except Exception as e:
+			print(f'MatchOutbox: could not remove {key} from redis: {e}')
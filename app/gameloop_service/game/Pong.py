@@ -1,19 +1,38 @@
-import threading, time, asyncio
+import threading, time, asyncio, functools
 from .GameSystem import *
+from .BatchSystem import BatchWorld, BatchCollisionSystem, BatchMovementSystem
+from .GameScheduler import GameScheduler, REFERENCE_TICK_INTERVAL, tick_interval
+from .GameShards import GameShards
+from .SessionRegistry import SessionRegistry, ChannelSeat
+from .PongSnapshot import Snapshots
+from . import PongProtocol
+from .GameIO import GameIO
+from .SendQueue import SendQueue
+from .GamePool import GamePool
+from .PongReplay import Replay
+from . import GameMetrics
+from .GameRedis import GameRedis
 from .utils import tournament_string
-from asgiref.sync import async_to_sync
-import redis
 import json
-import requests
 
-# Constants
-PLAYER_MOVE_SPEED = 20
+# Constants, speeds are per tick and scaled from the REFERENCE_TICK_INTERVAL they are tuned for
+TICK_INTERVAL = tick_interval()
+TICK_SCALE = TICK_INTERVAL / REFERENCE_TICK_INTERVAL
+PLAYER_MOVE_SPEED = 20 * TICK_SCALE
 GAME_WINNING_SCORE = 2
-BALL_MOVE_SPEED = 20
+BALL_MOVE_SPEED = 20 * TICK_SCALE
+# stop, up, down
+PLAYER_INPUTS = (0, 1, 2)
+BALL_MAX_SPEED = 30 * TICK_SCALE
+BALL_ACCELERATION = pow(1.0002, TICK_SCALE)
+BALL_DRALL = 10 * TICK_SCALE
+# seconds between ball corrections while it is in flight (GAME_BALL_SYNC = 'events')
+BALL_SYNC_INTERVAL = 0.5
+# seconds between a reset of the ball and its launch
+ROUND_COUNTDOWN = 3.0
 CANVAS_WIDTH = 1280
 CANVAS_HEIGHT = 780
 VECTOR_CENTER = Vector(CANVAS_WIDTH * 0.5, CANVAS_HEIGHT * 0.5)
-redis = redis.Redis(host='redis', port=6379, db=0)
 
 
 class Ball(Entity):
@@ -24,31 +43,34 @@ class Ball(Entity):
 		self.add_component(Physics, self.physics)
 		self.last_hit = None
 		self.second_last_hit = None
-
-	def move(self, x_add, y_add):
-		new_pos = self.position.add(Vector(x_add, y_add))
-		self.position = new_pos
+		# scratch vectors for the collision response
+		self.normal = Vector(0, 0)
+		self.direction = Vector(0, 0)
 
 	def on_collision(self, other, collision_point=None):
+		thread_local.pong_game.send_ball_state(self)
 		if isinstance(other, Player):
 			self.second_last_hit = self.last_hit if self.last_hit != other else self.second_last_hit
 			self.last_hit = other
 		if collision_point is None:
 			return
-		ba = self.position.sub(collision_point)
-		ba.normalize()
-		tangent = Plane(collision_point, ba)
-		velocity_normalized = self.physics.velocity.dup().normalize()
-		dot_product = tangent.dir.dot(velocity_normalized)
-		reflection = velocity_normalized.dup().sub(ba.scale(2 * dot_product))
-		reflection.scale(self.physics.velocity.length())
-		self.physics.set_velocity_v(reflection)
+		# reflect the velocity on the tangent at the collision point
+		ba = self.normal.set_v(self.position).isub(collision_point).normalize()
+		velocity = self.physics.velocity
+		speed = velocity.length()
+		velocity_normalized = self.direction.set_v(velocity).normalize()
+		dot_product = ba.dot(velocity_normalized)
+		velocity.set_v(velocity_normalized).isub(ba.scale(2 * dot_product)).scale(speed)
 
 	def move(self, x_add, y_add):
-		new_pos = Vector(self.position.x + x_add, self.position.y + y_add)
-		if self.position.x != new_pos.x or self.position.y != new_pos.y:
-			self.position = new_pos
-			thread_local.pong_game.send_entity_move(self)
+		new_x = self.position.x + x_add
+		new_y = self.position.y + y_add
+		if self.position.x != new_x or self.position.y != new_y:
+			self.set_pos(new_x, new_y)
+			self.on_moved()
+
+	def on_moved(self):
+		thread_local.pong_game.send_ball_move(self)
 		
 class Player(Entity):
 	def __init__(self, x, y, height=250):
@@ -59,21 +81,22 @@ class Player(Entity):
 		self.add_component(Mesh, self.mesh)
 		self.add_component(Physics, self.physics)
 		self.score = 0
+		# latest input of the client (PLAYER_INPUTS), applied at the start of the next tick,
+		# on_input wakes the game up if it is idle
+		self.next_input = None
+		self.on_input = None
 		self.start_pos: Vector = None
 		self.goal_height = 0
+		# scratch vector for the ball deflection
+		self.drall = Vector(0, 0)
 
 	def move(self, x_add, y_add):
-		new_pos = self.position.add(Vector(x_add, y_add))
+		new_x = self.position.x + x_add
+		new_y = self.position.y + y_add
 
 		# Check if the new player position is still in range of its goal
-		if self.start_pos is not None:
-			ab = new_pos.sub(self.start_pos)
-			len = ab.length()
-			if (len == 0):
-				len = 0.00001
-			ab.scale((len + self.mesh.height * 0.5) / len)
-			if len > self.goal_height * 0.5 - self.mesh.height * 0.5:
-				return
+		if not self.physics.can_reach(new_x, new_y):
+			return
 
 		# # Check if the mesh is still inside the canvas
 		# transformed_points = [p.dup().rotate(self.rotation).add(new_pos) for p in self.mesh.points]
@@ -82,39 +105,55 @@ class Player(Entity):
 		# 		return
 		# 	if point.y < 0 or point.y > CANVAS_HEIGHT:
 		# 		return
-		if self.position.x != new_pos.x or self.position.y != new_pos.y:
-			self.position = new_pos
-			#send new position to everyone
-			thread_local.pong_game.send_entity_move(self)
+		if self.position.x != new_x or self.position.y != new_y:
+			self.set_pos(new_x, new_y)
+			self.on_moved()
+
+	def on_moved(self):
+		#send new position to everyone
+		thread_local.pong_game.send_entity_move(self)
 			
 	def increase_score(self):
 		print('Player', self.id, 'Scored')
 		self.score += 1
-		asyncio.run_coroutine_threadsafe(thread_local.host.channel_layer.group_send(
-			thread_local.host.group_name,
-			{
-				'type': 'player_score',
-				'id': self.id,
-				'score': self.score
-			}
-		), thread_local.event_loop)
+		thread_local.pong_game.io.group_send({
+			'type': 'player_score',
+			'id': self.id,
+			'score': self.score
+		})
 
 	def handle_remote_movement(self, input):
+		"""
+		Called by the consumer between ticks, only the latest input is kept until the next tick applies it
+		"""
+		if input in PLAYER_INPUTS:
+			self.next_input = input
+			if self.on_input is not None:
+				self.on_input()
+
+	def apply_input(self):
+		"""
+		Called by the game at the start of a tick
+		"""
+		input = self.next_input
+		if input is None:
+			return
+		self.next_input = None
 		if input == 1:
-			self.physics.velocity = self.up.dup().scale(PLAYER_MOVE_SPEED)
+			self.physics.velocity.set_v(self.up).scale(PLAYER_MOVE_SPEED)
 		elif input == 2:
-			self.physics.velocity = self.up.dup().scale(-PLAYER_MOVE_SPEED)
+			self.physics.velocity.set_v(self.up).scale(-PLAYER_MOVE_SPEED)
 		elif input == 0:
 			self.physics.set_velocity(0, 0)
 
 	def on_collision(self, other, collision_point=None):
 		ophys = other.get_component(Physics)
 		if ophys and collision_point and isinstance(other, Ball):
-			drall = collision_point.sub(self.position)
+			drall = self.drall.set_v(collision_point).isub(self.position)
 			prev_scale = ophys.velocity.length()
 			drall.normalize()
-			drall.scale(10)
-			ophys.velocity = ophys.velocity.add(drall)
+			drall.scale(BALL_DRALL)
+			ophys.velocity.iadd(drall)
 			ophys.velocity.normalize()
 			ophys.velocity.scale(prev_scale)
 
@@ -133,7 +172,7 @@ class PlayerSection:
 		self.bind_player()
 
 	def bind_player(self):
-		self.player.position = self.goal.position
+		self.player.set_pos(self.goal.position.x, self.goal.position.y)
 		self.player.rotate(self.goal.rotation)
 		if self.player.up.dot(Vector(0, -1)) < 0:
 			self.player.rotate(self.player.rotation + 180)
@@ -141,10 +180,14 @@ class PlayerSection:
 		forward = VECTOR_CENTER.sub(self.player.position)
 		forward.normalize()
 		forward.scale(75)
-		forward = forward.add(self.player.position)
-		self.player.position = forward
+		forward.iadd(self.player.position)
+		# the player moves its position in place, the start position needs its own vector
+		self.player.set_pos(forward.x, forward.y)
 		self.player.start_pos = forward
 		self.player.goal_height = self.goal.height
+		# the player can only move along its goal
+		self.player.physics.anchor = forward
+		self.player.physics.max_distance = self.player.goal_height * 0.5 - self.player.mesh.height * 0.5
 
 class GameLogicManager(Entity):
 	def __init__(self):
@@ -153,8 +196,11 @@ class GameLogicManager(Entity):
 		self.ball = Ball()
 		self.round_running = False
 		self.winner = None
-		self.counter = time.time()
+		# game time (PongGame.game_time) the countdown of the round started
+		self.counter = 0
 		self.starter: Player = None
+		# scratch vector for placing and launching the ball
+		self.forward = Vector(0, 0)
 	
 	def buildDynamicField(self, world: World, playerCount):
 		if playerCount == 2:
@@ -187,6 +233,26 @@ class GameLogicManager(Entity):
 
 		self.starter = self.sections[0].player
 
+	def reset(self):
+		"""
+		Back to the start of the first round, scores and inputs cleared
+		"""
+		self.round_running = False
+		self.winner = None
+		self.counter = 0
+		self.starter = self.sections[0].player
+		self.ball.physics.set_velocity(0, 0)
+		self.ball.last_hit = None
+		self.ball.second_last_hit = None
+		self.ball.set_pos(CANVAS_WIDTH // 2, CANVAS_HEIGHT // 2)
+		for section in self.sections:
+			player = section.player
+			player.score = 0
+			player.next_input = None
+			player.on_input = None
+			player.physics.set_velocity(0, 0)
+			player.set_pos(player.start_pos.x, player.start_pos.y)
+
 	def create_goal_function(self, section):
 		def goal_function(other, collision_point=None):
 			if isinstance(other, Ball):
@@ -208,19 +274,17 @@ class GameLogicManager(Entity):
 		self.ball.set_pos(CANVAS_WIDTH // 2, CANVAS_HEIGHT // 2)
 
 		thread_local.pong_game.send_entity_set_pos(self.ball)
+		thread_local.pong_game.send_ball_state(self.ball)
 		
 		self.winner = self.player_has_won()
 		if self.winner is not None:
 			thread_local.pong_game.game_complete()
 			return
-		asyncio.run_coroutine_threadsafe(thread_local.host.channel_layer.group_send(
-			thread_local.host.group_name,
-			{
-				'type': 'round_start',
-			}
-		), thread_local.event_loop)
+		thread_local.pong_game.io.group_send({
+			'type': 'round_start',
+		})
 		self.round_running = False
-		self.counter = time.time()
+		self.counter = thread_local.pong_game.game_time()
 
 	def player_has_won(self):
 		for section in self.sections:
@@ -235,101 +299,289 @@ class GameLogicManager(Entity):
 					return section.player
 		return None
 	
+	def launch_tick(self, ticks):
+		"""
+		First tick from ticks on that ends the countdown and launches the ball, None if no countdown is running
+		"""
+		if self.round_running or self.winner is not None or not self.starter:
+			return None
+		# same comparison as update(), so float rounding can not make them disagree
+		tick = max(ticks, int((self.counter + ROUND_COUNTDOWN) / TICK_INTERVAL) - 1)
+		while tick * TICK_INTERVAL - self.counter < ROUND_COUNTDOWN:
+			tick += 1
+		return tick
+
 	def update(self):
 		if self.winner is not None:
 			return
 		if not self.round_running:
-			if time.time() - self.counter >= 3.0:
+			if thread_local.pong_game.game_time() - self.counter >= ROUND_COUNTDOWN:
 				if self.starter:
 					# rework this so it works with player in any orientation
-					dir = VECTOR_CENTER.sub(self.starter.start_pos)
+					dir = self.forward.set_v(VECTOR_CENTER).isub(self.starter.start_pos)
 					dir.normalize()
 					dir.scale(BALL_MOVE_SPEED)
 					self.ball.physics.set_velocity_v(dir)
 				else:
-					self.ball.physics.set_velocity(15, 0)
+					self.ball.physics.set_velocity(15 * TICK_SCALE, 0)
 				self.ball.last_hit = self.starter
 				self.round_running = True
+				thread_local.pong_game.send_ball_state(self.ball)
 			elif self.starter:
-				forward = VECTOR_CENTER.sub(self.starter.start_pos)
+				forward = self.forward.set_v(VECTOR_CENTER).isub(self.starter.start_pos)
 				forward.normalize()
 				forward.scale(50)
-				forward = forward.add(self.starter.position)
+				forward.iadd(self.starter.position)
 				if self.ball.position.x != forward.x or self.ball.position.y != forward.y:
 					self.ball.set_pos(forward.x, forward.y)
 					thread_local.pong_game.send_entity_move(self.ball)
-		if self.ball.physics.velocity.sqr_length() < pow(30, 2):
-			self.ball.physics.velocity.scale(1.0002)
+		if self.ball.physics.velocity.sqr_length() < pow(BALL_MAX_SPEED, 2):
+			self.ball.physics.velocity.scale(BALL_ACCELERATION)
 		#this check is to reset the round when the ball somehow escapes the play area
-		if self.ball.position.sub(VECTOR_CENTER).sqr_length() > (CANVAS_WIDTH*1.5)**2:
+		if (self.ball.position.x - VECTOR_CENTER.x)**2 + (self.ball.position.y - VECTOR_CENTER.y)**2 > (CANVAS_WIDTH*1.5)**2:
 			self.reset_ball()
 
 
-async def getCurrentState(world: World, consumer):
-	for ent in world.entities:
-		print('Sending ent id:', ent.id)
-		await consumer.client_create_entity(
-			{
-				'id': ent.id,
-				'entType': type(ent).__name__,
-				'transform': ent.serialize(),
-				'height': 0 if not hasattr(ent, 'height') else ent.height
-			}
-		)
-	await consumer.client_create_entity(
-		{
-			'id': -1,
-			'entType': 'complete',
-			'transform': Transform(0, 0, 0).serialize(),
-			'heigth': 0
-		}
-	)
+# entities that move during the game, the rest of the field never changes after buildDynamicField
+DYNAMIC_ENTITIES = (Player, Ball)
+
+def new_entity_record(ent):
+	height = 0 if not hasattr(ent, 'height') else ent.height
+	return f"ne;{ent.id};{type(ent).__name__};{ent.position.x};{ent.position.y};{ent.rotation};{height}"
+
+def set_pos_record(ent):
+	return f"sp;{ent.id};{ent.position.x};{ent.position.y};{ent.rotation}"
 
 thread_local = threading.local()
 
+def create_world(backend=None):
+	"""
+	World with the physics backend from settings.GAME_PHYSICS_BACKEND ('python' or 'numpy')
+	"""
+	if backend is None:
+		from django.conf import settings
+		backend = getattr(settings, 'GAME_PHYSICS_BACKEND', 'python')
+	if backend == 'numpy':
+		world = BatchWorld()
+		world.addSystem(BatchCollisionSystem())
+		world.addSystem(BatchMovementSystem())
+		return world
+	world = World()
+	world.addSystem(CollisionSystem())
+	world.addSystem(MovementSystem())
+	return world
+
+def ball_sync_mode():
+	"""
+	settings.GAME_BALL_SYNC, 'ticks' sends the ball position every tick, 'events' sends position and velocity
+	on launch, collision, reset and every BALL_SYNC_INTERVAL seconds, the clients extrapolate in between
+	"""
+	from django.conf import settings
+	return getattr(settings, 'GAME_BALL_SYNC', 'ticks')
+
+def send_interval():
+	"""
+	Ticks per sent frame, settings.GAME_SEND_RATE frames per second, 0 sends a frame every tick
+	"""
+	from django.conf import settings
+	send_rate = getattr(settings, 'GAME_SEND_RATE', 0)
+	if send_rate <= 0:
+		return 1
+	return max(1, round(1 / (send_rate * TICK_INTERVAL)))
+
+def spectator_interval(send_every):
+	"""
+	Ticks per spectator frame, settings.GAME_SPECTATOR_RATE frames per second.
+	A multiple of send_every, spectators only get what the players got too
+	"""
+	from django.conf import settings
+	rate = getattr(settings, 'GAME_SPECTATOR_RATE', 20)
+	if rate <= 0:
+		return send_every
+	return max(1, round(1 / (rate * TICK_INTERVAL * send_every))) * send_every
+
+def create_game(playerCount, group_name):
+	"""
+	PongGame in this process, or a stand in for one on a shard process if settings.GAME_SHARDS is set
+	"""
+	shards = GameShards.get()
+	if shards is not None:
+		return shards.create_game(playerCount, group_name)
+	return new_game(playerCount)
+
+def new_game(playerCount):
+	"""
+	PongGame with its field built, a ready one from the GamePool if settings.GAME_POOL_SIZE is set
+	"""
+	pool = GamePool.get()
+	if pool is None:
+		game = PongGame(playerCount)
+		game.build_field()
+		return game
+	return pool.take(playerCount)
+
 #all the stuff for one pong game
 class PongGame:
-	def __init__(self, playerCount):
+	def __init__(self, playerCount, io=None, backend=None):
+		"""
+		io is the GameIO for group events and match results, backend the physics backend (create_world)
+		"""
 		self.playerCount = playerCount
-		self.stop_thread = False
-		self.world = World()
-		self.world.addSystem(CollisionSystem())
-		self.world.addSystem(MovementSystem())
+		self.io = io if io is not None else GameIO(self)
+		self.world = create_world(backend)
 		self.gameLogic = GameLogicManager()
-		self.players = None
+		self.world.addEntity(self.gameLogic)
+		# ne records of every entity as the field was built, see world_state()
+		self.static_state = None
+		self.reset()
 		print(f'Got Players: {self.players}')
 
-		self.world.addEntity(self.gameLogic)
+	def reset(self):
+		"""
+		Everything of one match, the world and the field stay. A finished game from the GamePool starts over with it
+		"""
+		self.stopped = False
+		self.players = None
 		self.event_loop = None
-		self.asyncio_thread = None
-		self.game_thread = None
+		# deadline of the next tick and ticks it could not catch up on, owned by the GameScheduler
+		self.next_tick = 0
+		self.overruns = 0
+		self.tasks = set()
+
+		# simulation step and its deadline when the game started, they go into the frame header.
+		# Game logic only uses the simulation step (game_time), never a clock, so a replay plays the same match
+		self.ticks = 0
+		self.started = 0
+		self.replay = Replay(self.playerCount, 'numpy' if isinstance(self.world, BatchWorld) else 'python', TICK_INTERVAL)
+		# a frame goes out every send_every ticks, one tick in profile_every is measured (GameMetrics)
+		self.send_every = send_interval()
+		self.profile_every = GameMetrics.profile_interval()
 
-		self.move_tasks = []
+		# entity id -> [entity, snap], what moved since the last frame
+		self.move_tasks: dict[int, list] = {}
+		self.snapshots = Snapshots()
+		# consumer -> SendQueue, frames and the world state go through it
+		self.queues: dict = {}
+		# read only consumers, they share one frame every spectator_every ticks with their own baseline.
+		# spectator_moves and spectator_balls collect what moved since their last frame
+		self.spectators = []
+		self.spectator_every = spectator_interval(self.send_every)
+		self.spectator_snapshots = Snapshots()
+		self.spectator_moves: dict[int, list] = {}
+		self.spectator_balls: dict[int, Ball] = {}
+		# ball id -> ball, balls whose position and velocity go out with the next frame (GAME_BALL_SYNC = 'events')
+		self.ball_events = ball_sync_mode() == 'events'
+		self.ball_states: dict[int, Ball] = {}
+		self.ball_synced = 0
+		# deadline of the first tick the scheduler skipped because nothing could change (idle_ticks),
+		# None while the game ticks at the full rate. world_version tells if anything moved in the last tick
+		self.scheduler = None
+		self.idle_since = None
+		self.world_version = 0
+		# called with the game when it stops, the ShardWorker forgets the game then
+		self.on_stop = None
+		# the game goes back to the GamePool once the scheduler finished it and nothing routes consumers to it (detach)
+		self.finished = False
+		self.detached = False
 
 	def set_players(self, group_name):
 		self.players = GamesHandler.game_players(group_name)
 
-	def start_game(self):
+	def start_game(self, scheduler=None):
+		"""
+		scheduler ticks the game, the GameScheduler of the running event loop by default
+		"""
+		print('Starting game!')
+
+		if self.static_state is None:
+			self.build_field()
 
-		print('Starting threads and game!')
+		self.event_loop = asyncio.get_running_loop()
+		if isinstance(self.world, BatchWorld):
+			self.world.on_enter = self.enter
 
+		for i, player in enumerate(self.players):
+			self.schedule(player.assign_player(self.gameLogic.sections[i].player))
+		# every player has its paddle before the first state names them
+		for player in self.players:
+			self.schedule(self.send_current_state(player))
+		for section in self.gameLogic.sections:
+			section.player.on_input = self.wake
+		for spectator in self.spectators:
+			self.schedule(self.send_current_state(spectator))
+
+		if scheduler is None:
+			scheduler = GameScheduler.get()
+		self.scheduler = scheduler
+		scheduler.add_game(self)
+		self.started = self.next_tick
+
+	def build_field(self):
+		"""
+		Walls, goals, paddles and ball of the field, done by the GamePool before anyone joins
+		"""
 		self.gameLogic.buildDynamicField(self.world, self.playerCount)
+		self.static_state = '\n'.join([new_entity_record(ent) for ent in self.world.entities] + ['ne;-1;complete;0;0;0;0'])
 
-		self.event_loop = asyncio.new_event_loop()
-		self.asyncio_thread = threading.Thread(target=self.asyncio_tasks_thread)
-		self.asyncio_thread.start()
+	def stop(self):
+		self.stopped = True
+		print(f'stopped set to {self.stopped}')
+		if self.on_stop is not None:
+			self.on_stop(self)
 
-		self.game_thread = threading.Thread(target=self.game_loop)
-		self.game_thread.start()
+	async def send_current_state(self, consumer):
+		"""
+		Join and the 'incomplete' resend: the field, the names and scores of the players,
+		the client gets a keyframe with the next frame
+		"""
+		if consumer in self.spectators:
+			self.spectator_snapshots.request_keyframe(consumer)
+		else:
+			self.snapshots.request_keyframe(consumer)
+		self.wake()
+		queue = self.queue(consumer)
+		queue.put(text_data=self.world_state())
+		scores = []
+		for player in self.players:
+			if player.player_c is not None:
+				queue.put(text_data=f"ip;{player.player_c.id};{player.user.id};{player.user.username};{consumer.user.id}")
+				scores.append(PongProtocol.encode_set_score(player.player_c.id, player.player_c.score))
+		queue.put(bytes_data=PongProtocol.encode_frame(scores))
 
-		for i, player in enumerate(self.players):
-			asyncio.run_coroutine_threadsafe(player.assign_player(self.gameLogic.sections[i].player), self.event_loop)
-			asyncio.run_coroutine_threadsafe(getCurrentState(self.world, player), self.event_loop)
+	def add_spectator(self, consumer):
+		self.spectators.append(consumer)
+		if self.event_loop is not None:
+			self.wake()
+			self.schedule(self.send_current_state(consumer))
 
+	def remove_spectator(self, consumer):
+		if consumer in self.spectators:
+			self.spectators.remove(consumer)
+		self.queues.pop(consumer, None)
+		self.spectator_snapshots.keyframe_pending.discard(consumer)
 
-	def stop(self):
-		self.stop_thread = True
-		print(f'stop_thread set to {self.stop_thread}')
+	def world_state(self):
+		"""
+		The whole field in one text message, one record per line: the cached ne records and the
+		complete marker, then an sp record with the current transform of everything that moves
+		"""
+		dynamic = [set_pos_record(ent) for ent in self.world.entities if isinstance(ent, DYNAMIC_ENTITIES)]
+		return '\n'.join([self.static_state] + dynamic)
+
+	def schedule(self, coro):
+		"""
+		Runs coro on the event loop of the game without waiting for it
+		"""
+		task = self.event_loop.create_task(coro)
+		self.tasks.add(task)
+		task.add_done_callback(self.tasks.discard)
+		return task
+
+	def run_blocking(self, func, *args, **kwargs):
+		"""
+		Blocking calls (http requests) would stall every game of the process, they run in the default executor
+		"""
+		return self.event_loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
 
 	def update_tournament_gamestate(self):
 		if self.players[0].match_type == 'tournament':
@@ -340,16 +592,13 @@ class PongGame:
 			data['home_score'] = self.players[0].player_c.score
 			data['away_score'] = self.players[1].player_c.score
 			data['status'] = 'running'
-			requests.post('http://gamehub-service:8003/match/', json=data)
+			self.io.post_match(data)
 
 	def game_complete(self):
-		asyncio.run_coroutine_threadsafe(thread_local.host.channel_layer.group_send(
-				thread_local.host.group_name,
-				{
-					'type': 'game_over',
-				}
-			), self.event_loop)
-		print('We have a winner! Stop game thread, and asyncio thread')
+		self.io.group_send({
+			'type': 'game_over',
+		})
+		print('We have a winner! Stop game')
 		self.stop()
 		data = {}
 		data['lobby_id'] = self.players[0].lobby_id
@@ -372,82 +621,356 @@ class PongGame:
 			data['type'] = 'multiple'
 			if consumer is not None:
 				data['winner_username'] = consumer.user.username
-		requests.post('http://gamehub-service:8003/match/', json=data)
+		self.io.post_match(data)
+		# the winning goal is scored during the current tick
+		self.replay.finish(self.ticks + 1, [section.player.score for section in self.gameLogic.sections])
+		self.io.save_replay(self.players[0].group_name, self.replay)
 
-	def game_loop(self):
+	def enter(self):
+		"""
+		Entities reach their game through thread_local, it has to point to this game while it ticks
+		"""
 		thread_local.pong_game = self
-		thread_local.asyncio_thread = self.asyncio_thread
-		thread_local.game_thread = self.game_thread
 		thread_local.event_loop = self.event_loop
-		thread_local.host = self.players[0]
 		thread_local.world = self.world
 
-		while not self.stop_thread:
-			self.world.update()
-			asyncio.run_coroutine_threadsafe(self.send_move_tasks(), self.event_loop)
-			time.sleep(0.016)
-			
-		print('game loop stopped of group', self.players[0].group_name if len(self.players) != 0 else '[Removed]')
-		self.event_loop.call_soon_threadsafe(self.event_loop.stop)
-		print('asyncio event_loop ordered to stop')
-		for player in self.players:
-			(async_to_sync)(player.close)()
-	
-	async def send_move_tasks(self):
+	def tick(self):
+		"""
+		One step of the game, called by the GameScheduler
+		"""
+		if len(self.players) == 0:
+			self.stop()
+			return
+		start = time.perf_counter()
+		self.begin_tick()
+		profiled = self.world.profiler is not None
+		self.world.update()
+		self.flush()
+		if profiled:
+			GameMetrics.TICK_SECONDS.observe(time.perf_counter() - start)
+
+	def begin_tick(self):
+		"""
+		Start of a tick: the ticks skipped while idle, thread_local, the inputs and the profiler of the world if the tick is sampled
+		"""
+		if self.idle_since is not None:
+			self.ticks += round((self.next_tick - self.idle_since) / TICK_INTERVAL)
+			self.idle_since = None
+		self.enter()
+		self.apply_inputs()
+		if self.profile_every > 0 and self.ticks % self.profile_every == 0:
+			self.world.profiler = GameMetrics.observe_system
+
+	def apply_inputs(self):
+		"""
+		Inputs only change the world at tick boundaries, in the order of the sections.
+		Every applied input goes into the replay.
+		"""
+		for seat, section in enumerate(self.gameLogic.sections):
+			if section.player.next_input is not None:
+				self.replay.record(self.ticks, seat, section.player.next_input)
+				section.player.apply_input()
+
+	def wake(self):
+		if self.scheduler is not None:
+			self.scheduler.wake(self)
+
+	def idle_ticks(self):
+		"""
+		Called by the scheduler after a tick: how many of the next ticks can not change anything.
+		That is the case if nothing moved in this tick, no body has a velocity or gravity, no input
+		is waiting and every client got what changed, until the countdown of the round ends.
+		0 if the game has to keep ticking
+		"""
+		version = sum(ent.version for ent in self.world.entities)
+		moved = version != self.world_version
+		self.world_version = version
+		if moved or len(self.move_tasks) != 0 or len(self.ball_states) != 0:
+			return 0
+		# spectator frames only go out every spectator_every ticks, keyframes with the next frame
+		if len(self.spectator_moves) != 0 or len(self.spectator_balls) != 0:
+			return 0
+		if len(self.snapshots.keyframe_pending) != 0 or len(self.spectator_snapshots.keyframe_pending) != 0:
+			return 0
+		for ent in self.world.entities:
+			physics = ent.get_component(Physics)
+			if physics is not None and (physics.has_gravity or physics.velocity.x != 0 or physics.velocity.y != 0):
+				return 0
+		for section in self.gameLogic.sections:
+			if section.player.next_input is not None:
+				return 0
+		launch = self.gameLogic.launch_tick(self.ticks)
+		if launch is None:
+			return 0
+		return launch - self.ticks
+
+	def game_time(self):
+		"""
+		Seconds of simulated time, ticks the scheduler had to drop do not count
+		"""
+		return self.ticks * TICK_INTERVAL
+
+	def flush(self):
 		"""
-		Instead of trying to send moves instantly we save the moves we want to send and then send them in a batch
+		Called after every tick. Every send_every ticks everything that moved since the last frame goes out
+		as one delta frame (PongSnapshot) stamped with the tick and game time, nothing is sent if nothing moved
 		"""
-		gather = [consumer.send(move) for consumer in self.players for move in self.move_tasks]
+		profiled = self.world.profiler is not None
+		self.world.profiler = None
+		self.ticks += 1
+		if self.ticks % self.send_every != 0:
+			if profiled:
+				GameMetrics.observe_frames([], len(self.move_tasks))
+			return
+		time_ms = (self.next_tick - self.started) * 1000
+		states = []
+		if self.ball_events:
+			if self.snapshots.keyframe_due():
+				self.send_ball_state(self.gameLogic.ball)
+			if len(self.ball_states) != 0:
+				self.ball_synced = self.next_tick
+			for ball in self.ball_states.values():
+				velocity = ball.physics.velocity
+				states.append(self.snapshots.encode_ball_state(ball, velocity.x / TICK_INTERVAL, velocity.y / TICK_INTERVAL))
+			if len(self.spectators) != 0:
+				self.spectator_balls.update(self.ball_states)
+			self.ball_states.clear()
+		frames = self.snapshots.frames(self.move_tasks.values(), self.world.entities, self.players, states, self.ticks, time_ms)
+		if profiled:
+			GameMetrics.observe_frames(frames, len(self.move_tasks))
+			GameMetrics.observe_queues(self.queues.values())
+		if len(self.spectators) != 0:
+			self.collect_spectator_moves()
 		self.move_tasks.clear()
-		if len(gather) == 0:
+		if len(frames) != 0:
+			self.send_frames(frames)
+		if len(self.spectators) != 0 and self.ticks % self.spectator_every == 0:
+			self.flush_spectators(time_ms)
+
+	def collect_spectator_moves(self):
+		"""
+		A set pos stays a set pos until the next spectator frame, like in move_tasks
+		"""
+		for id, (entity, snap) in self.move_tasks.items():
+			move = self.spectator_moves.get(id)
+			if move is None:
+				self.spectator_moves[id] = [entity, snap]
+			else:
+				move[1] |= snap
+
+	def flush_spectators(self, time_ms):
+		"""
+		One frame for all spectators, encoded once against their own baseline and shared by their SendQueues
+		"""
+		if self.ball_events and self.spectator_snapshots.keyframe_due():
+			self.spectator_balls[self.gameLogic.ball.id] = self.gameLogic.ball
+		states = []
+		for ball in self.spectator_balls.values():
+			velocity = ball.physics.velocity
+			states.append(self.spectator_snapshots.encode_ball_state(ball, velocity.x / TICK_INTERVAL, velocity.y / TICK_INTERVAL))
+		self.spectator_balls.clear()
+		frames = self.spectator_snapshots.frames(self.spectator_moves.values(), self.world.entities, self.spectators, states, self.ticks, time_ms)
+		self.spectator_moves.clear()
+		self.send_frames(frames)
+
+	def finish(self):
+		"""
+		Called by the GameScheduler once the game stopped
+		"""
+		self.world.release()
+		print('game loop stopped of group', self.players[0].group_name if len(self.players) != 0 else '[Removed]')
+		for consumer in self.players + self.spectators:
+			self.queue(consumer).end()
+		self.finished = True
+		self.recycle()
+
+	def detach(self):
+		"""
+		Called once the GamesHandler or the ShardWorker let go of the game, no consumer reaches it anymore
+		"""
+		self.detached = True
+		self.recycle()
+
+	def recycle(self):
+		"""
+		Back to the GamePool if both happened, a game that still has tasks running is left alone
+		"""
+		if not self.finished or not self.detached or len(self.tasks) != 0:
 			return
-		await asyncio.gather(*gather)
+		pool = GamePool.get()
+		if pool is not None:
+			pool.put(self)
+
+	def reuse(self):
+		"""
+		Back to the state build_field() left the game in, without building the field again
+		"""
+		self.gameLogic.reset()
+		self.world.reuse()
+		self.reset()
 	
-	def asyncio_tasks_thread(self):
-		asyncio.set_event_loop(self.event_loop)
-		self.event_loop.run_forever()
-		print('asyncio event_loop stopped')
+	def send_frames(self, frames):
+		"""
+		Instead of trying to send moves instantly we collect the moves until the next frame and send them together,
+		frames are (frame, consumers) pairs. A client that can not keep up gets a keyframe instead of its old frames
+		"""
+		for frame, consumers in frames:
+			for consumer in consumers:
+				self.queue(consumer).put_frame(frame, self.ticks)
+
+	def broadcast(self, text_data=None, bytes_data=None):
+		"""
+		Reliable message to every player and spectator, behind the frames already queued for them
+		"""
+		for consumer in self.players + self.spectators:
+			self.queue(consumer).put(text_data=text_data, bytes_data=bytes_data)
+
+	def ack(self, consumer, tick):
+		queue = self.queues.get(consumer)
+		if queue is not None:
+			queue.ack(tick)
+
+	async def player_left(self, consumer):
+		"""
+		The others get a disconnect behind what is queued for them, then their connections close
+		"""
+		self.stop()
+		others = [other for other in self.players + self.spectators if other is not consumer]
+		if consumer.player_c is not None:
+			for other in others:
+				self.queue(other).put(bytes_data=PongProtocol.encode_frame([PongProtocol.encode_disconnect(consumer.player_c.id)]))
+		for other in others:
+			self.queue(other).end()
+
+	def queue(self, consumer):
+		queue = self.queues.get(consumer)
+		if queue is None:
+			snapshots = self.spectator_snapshots if consumer in self.spectators else self.snapshots
+			queue = self.queues[consumer] = SendQueue(consumer, self.event_loop, snapshots.request_keyframe)
+		return queue
 
 	"""
-	Some big and commonly used sends defined here to make code more readable
+	Some big and commonly used sends defined here to make code more readable.
+	Only the last position of an entity since the last frame is sent, a set pos (snap) stays a set pos
+	if the entity moves again before the frame goes out.
 	"""
 	def send_entity_move(self, entity: Entity):
-		self.move_tasks.append(f"up;{entity.id};{entity.position.x};{entity.position.y};{entity.rotation}")
+		if entity.id not in self.move_tasks:
+			self.move_tasks[entity.id] = [entity, False]
 		
 	def send_entity_set_pos(self, entity: Entity):
-		self.move_tasks.append(f"sp;{entity.id};{entity.position.x};{entity.position.y};{entity.rotation}")
+		self.move_tasks[entity.id] = [entity, True]
+
+	def send_ball_move(self, ball: Ball):
+		if not self.ball_events:
+			self.send_entity_move(ball)
+		elif self.next_tick - self.ball_synced >= BALL_SYNC_INTERVAL:
+			self.send_ball_state(ball)
+
+	def send_ball_state(self, ball: Ball):
+		"""
+		The ball changed its course, position and velocity go out with the next frame
+		"""
+		if self.ball_events:
+			self.ball_states[ball.id] = ball
 
 
 class GamesHandler:
 	
 	game_sessions: dict[str, 'GamesHandler'] = {}
+	# seconds a spectator waits for a game that did not start yet
+	SPECTATOR_TIMEOUT = 60
 
 	def __init__(self, group_name):
 		print('GamesHandler() called')
 		self.group_name = group_name
 		self.players = []
 		self.game: PongGame = None
+		self.started = False
 
 	@staticmethod
 	async def add_consumer_to_game(consumer, group_name):
+		registry = await SessionRegistry.get()
+		if registry is not None and group_name not in GamesHandler.game_sessions:
+			owner = await registry.claim(group_name)
+			if owner != registry.channel_name:
+				if isinstance(consumer, ChannelSeat):
+					print('Session moved to another node, dropping the seat')
+					await consumer.close()
+					return
+				print('Game runs on another node, we forward the player')
+				await registry.join_remote(owner, consumer)
+				return
 		if group_name in GamesHandler.game_sessions:
 			print('Group exists in handler, we push the player')
 			await GamesHandler.game_sessions[group_name].add_consumer(consumer)
 			return
 		print('First player of group we create a new GamesHandler')
 		new_handler = GamesHandler(group_name=group_name)
-		await new_handler.add_consumer(consumer)
 		GamesHandler.game_sessions[group_name] = new_handler
+		await new_handler.add_consumer(consumer)
 
 	@staticmethod
 	async def disconnect_consumer_from_game(consumer, group_name):
+		if getattr(consumer, 'session_owner', None) is not None:
+			SessionRegistry.instance.forward(consumer, 'seat.leave')
+			return
 		if group_name in GamesHandler.game_sessions:
 			print('Group exists in handler, we remove the player')
 			await GamesHandler.game_sessions[group_name].remove_consumer(consumer)
 			if GamesHandler.game_sessions[group_name].players.__len__() == 0:
-				GamesHandler.game_sessions.pop(group_name)
+				handler = GamesHandler.game_sessions.pop(group_name)
+				if isinstance(handler.game, PongGame):
+					handler.game.detach()
+				if SessionRegistry.instance is not None:
+					await SessionRegistry.instance.release(group_name)
 		print('Number of handlers:', len(GamesHandler.game_sessions))
 
+	@staticmethod
+	async def send_current_state(consumer):
+		if getattr(consumer, 'session_owner', None) is not None:
+			SessionRegistry.instance.forward(consumer, 'seat.resync')
+			return
+		handler = GamesHandler.game_sessions.get(consumer.group_name)
+		if handler is not None and handler.game is not None:
+			await handler.game.send_current_state(consumer)
+
+	@staticmethod
+	def ack(consumer, tick):
+		if getattr(consumer, 'session_owner', None) is not None:
+			SessionRegistry.instance.forward(consumer, 'seat.ack', tick=tick)
+			return
+		handler = GamesHandler.game_sessions.get(consumer.group_name)
+		if handler is not None and handler.game is not None:
+			handler.game.ack(consumer, tick)
+
+	@staticmethod
+	async def add_spectator(consumer, group_name):
+		"""
+		Spectators can only watch games of this process, not the ones on shards or other nodes
+		"""
+		handler = GamesHandler.game_sessions.get(group_name)
+		if handler is None or not isinstance(handler.game, PongGame) or handler.game.stopped:
+			print('No game to watch, disconnect spectator')
+			await consumer.close()
+			return
+		handler.game.add_spectator(consumer)
+		if not handler.started:
+			asyncio.get_running_loop().call_later(GamesHandler.SPECTATOR_TIMEOUT, GamesHandler.spectator_timeout, handler, consumer)
+
+	@staticmethod
+	def spectator_timeout(handler, consumer):
+		if not handler.started and consumer in handler.game.spectators:
+			print('Game did not start, disconnect spectator')
+			handler.game.remove_spectator(consumer)
+			asyncio.get_running_loop().create_task(consumer.close())
+
+	@staticmethod
+	def remove_spectator(consumer, group_name):
+		handler = GamesHandler.game_sessions.get(group_name)
+		if handler is not None and isinstance(handler.game, PongGame):
+			handler.game.remove_spectator(consumer)
+
 	@staticmethod
 	def game_players(group_name):
 		if group_name in GamesHandler.game_sessions:
@@ -461,9 +984,9 @@ class GamesHandler:
 		if self.game and self.players.__len__() < self.game.playerCount or self.players.__len__() < 2:
 			if self.players.__len__() == 0:
 				if consumer.match_type == 'multiple':
-					self.game = PongGame(4)
+					self.game = create_game(4, self.group_name)
 				else:
-					self.game = PongGame(2)
+					self.game = create_game(2, self.group_name)
 			self.players.append(consumer)
 		else:
 			print('too many players!!! disconnect consumer')
@@ -472,7 +995,10 @@ class GamesHandler:
 		if self.players.__len__() == self.game.playerCount:
 			print('init PongGame class!')
 			if self.players[0].match_type == 'tournament':
-				tournament_matches = redis.get(tournament_string(self.players[0].lobby_id))
+				tournament_matches = await GameRedis.get().get(tournament_string(self.players[0].lobby_id))
+				# a player may have left while we waited for redis
+				if self.game.stopped or self.players.__len__() != self.game.playerCount:
+					return
 				if tournament_matches:
 					tournament_matches_json = json.loads(tournament_matches)
 					match = tournament_matches_json['matches'][self.players[0].match_id - 1]
@@ -482,6 +1008,7 @@ class GamesHandler:
 						self.players[1] = temp
 			self.game.set_players(self.group_name)
 			self.game.start_game()
+			self.started = True
 	
 	async def remove_consumer(self, consumer):
 		print('GamesHandler.remove_consumer() called')
@@ -493,15 +1020,13 @@ class GamesHandler:
 			print('no consumers in this lobby?')
 		if self.game is not None and self.players.__len__() < self.game.playerCount:
 			print('Stopping Game!')
-			self.game.stop()
-			for player in self.players:
-				if player.channel_layer.valid_channel_name(player.channel_name):
-					print('Closing consumer!!')
-					try:
-						await player.disconnectedMsg({'id': consumer.player_c.id, 'uid': consumer.user.id})
-					except Exception as e:
-						print(f'Error sending disconnect message: {e}')
-				else:
-					print('Player already disconnected!')
-				await player.close()
+			if self.started:
+				await self.game.player_left(consumer)
+			else:
+				self.game.stop()
+				for player in self.players + getattr(self.game, 'spectators', []):
+					await player.close()
 			self.players.clear()
+
+
+GameMetrics.ACTIVE_SESSIONS.set_function(lambda: len(GamesHandler.game_sessions))
@@ -1,12 +1,26 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from .Pong import *
+from .GameRedis import GameRedis
 from .utils import match_lobby_string, tournament_string, multiple_lobby_string
 
 class MyConsumer(AsyncWebsocketConsumer):
-	
+	# status a tournament match needs to be joined
+	MATCH_STATUSES = ('pending',)
+
 	async def connect(self):
+		self.read_group_name()
+		if not await self.validate():
+			await self.close()
+			return
+
+		await self.accept()
+		await GamesHandler.add_consumer_to_game(self, self.group_name)
+
+	def read_group_name(self):
 		self.player_c = None
+		# node channel of the gameloop running our game, None if it runs in this process
+		self.session_owner = None
 		# User = get_user_model()
 		self.group_name = self.scope['url_route']['kwargs']['group_name']
 		self.user = self.scope["user"]
@@ -15,67 +29,46 @@ class MyConsumer(AsyncWebsocketConsumer):
 		self.lobby_id = split[1] if len(split) > 1 else None
 		self.match_id = int(split[-1]) if len(split) > 3 else -1
 
+	async def validate(self):
+		"""
+		The lobby of the group has to exist and a tournament match has to be pending,
+		one read on the async client so it does not block the event loop
+		"""
+		if self.lobby_id is None or self.match_type not in ('tournament', 'match', 'multiple'):
+			return False
+		redis = GameRedis.get()
 		if self.match_type == 'tournament':
-			data = redis.get(tournament_string(self.lobby_id))
-			if not data:
-				await self.close()
-				return
-			json_data = json.loads(data)
-			if self.match_id < 1 or len(json_data['matches']) < self.match_id or json_data['matches'][self.match_id - 1]['status'] != 'pending':
-				await self.close()
-				return
+			result = await redis.get(tournament_string(self.lobby_id))
 		elif self.match_type == 'match':
-			if self.lobby_id is None or not redis.exists(match_lobby_string(self.lobby_id)):
-				await self.close()
-				return
-		elif self.match_type == 'multiple':
-			if self.lobby_id is None or not redis.exists(multiple_lobby_string(self.lobby_id)):
-				await self.close()
-				return
+			result = await redis.exists(match_lobby_string(self.lobby_id))
 		else:
-			await self.close()
-			return
-
-		await self.channel_layer.group_add(
-			self.group_name,
-			self.channel_name
-		)
-		await self.accept()
-		await GamesHandler.add_consumer_to_game(self, self.group_name)
-
-	#Send table
+			result = await redis.exists(multiple_lobby_string(self.lobby_id))
+		if self.match_type != 'tournament':
+			return bool(result)
+		if not result:
+			return False
+		json_data = json.loads(result)
+		return 1 <= self.match_id <= len(json_data['matches']) and json_data['matches'][self.match_id - 1]['status'] in self.MATCH_STATUSES
+
+	#Send table, the PongGame sends everything through the SendQueue of the consumer (PongGame.queue)
+	#text messages
+	#world			records of the whole field separated by newlines (PongGame.world_state)
 	#newEntity		ne;id;type;xpos;ypos;rotation;?.height
-	#updatePos		up;id;xpos;ypos;rot
-	#setPos 		sp;id;xpos;ypos;rot
-	#roundStart 	rs
-	#setScore 		ss;id;score
+	#setPos			sp;id;xpos;ypos;rot
 	#initPlayer 	ip;entid;uid;uname;sender_uid
-	#disconnect 	dc;id
-	#gameOver 		go
 	#drawDot 		dd;x;y
 	#drawLine 		dl;x1;y1;x2;y2
+	#binary frames (PongProtocol)
+	#delta, keyframe, ballState, updatePos, setPos, setScore, roundStart, gameOver, disconnect
 
 	async def assign_player(self, pong_player):
 		print('consumer gets PongPlayer assigned')
+		# the PongGame sends the ip records of all players with the field (send_current_state)
 		self.player_c = pong_player
-		await self.channel_layer.group_send(
-			self.group_name,
-			{
-				'type': "init_players",
-				'ent_id': pong_player.id,
-				'uid': self.user.id,
-				'uname': self.user.username
-			}
-		)
-		# here send the assign local stuff maybe?
 
 
 	async def disconnect(self, close_code):
 		print('disconnected() called')
-		await self.channel_layer.group_discard(
-			self.group_name,
-			self.channel_name
-		)
 		await GamesHandler.disconnect_consumer_from_game(self, self.group_name)
 
 
@@ -86,53 +79,58 @@ class MyConsumer(AsyncWebsocketConsumer):
 				if self.player_c is not None:
 					self.player_c.handle_remote_movement(text_data_json)
 				return
+			if text_data_json['type'] == 'ack':
+				GamesHandler.ack(self, int(text_data_json['tick']))
+				return
 			if text_data_json['type'] == 'incomplete':
-				await getCurrentState(thread_local.world, self)
+				await GamesHandler.send_current_state(self)
 			print(f"text:data: {text_data}")
 		except Exception as e:
 			print(f'text_data:', text_data, 'eception:', e)
 
-	#initPlayer 	ip;entid;uid;uname
-	async def init_players(self, event):
-		print('We send what player has wich uid and uname')
-		await self.send(text_data=f"ip;{event.get('ent_id')};{event.get('uid')};{event.get('uname')};{self.user.id}")
-		
-	#newEntity		ne;id;type;xpos;ypos;rotation;?.height
-	async def client_create_entity(self, event):
-		print('client_create_entity event sent:', event)
-		transform = event.get('transform')
-		await self.send(text_data=f"ne;{event.get('id')};{event.get('entType')};{transform['position']['x']};{transform['position']['y']};{transform['rotation']};{event.get('height')}")
-		print('client_create_entity event processed')
-
 	"""
-	This is to indicate an entity moved, client side will smooth out rough movements
+	Sent by the gameloop node that owns our game if it runs on another node (SessionRegistry)
 	"""
-	#updatePos		up;id;xpos;ypos;rot
-	async def move_entity(self, event):
-		transform = event.get('transform')
-		await self.send(text_data=f"up;{event.get('id')};{transform['position']['x']};{transform['position']['y']};{transform['rotation']}")
+	async def game_frame(self, event):
+		await self.send(text_data=event.get('text_data'), bytes_data=event.get('bytes_data'))
+
+	async def game_close(self, event):
+		await self.close()
+	
 
+
+class SpectatorConsumer(MyConsumer):
 	"""
-	This is to set the pos aka so for ball reset
+	Read only connection to a game of this process (ws/game/watch/<group_name>/). It gets the events
+	and the shared spectator frames of the PongGame through its SendQueue, its inputs are ignored
 	"""
-	#setPos 		sp;id;xpos;ypos;rot
-	async def set_entity_pos(self, event):
-		transform = event.get('transform')
-		await self.send(text_data=f"sp;{event.get('id')};{transform['position']['x']};{transform['position']['y']};{transform['rotation']}")
-
-	#roundStart 	rs
-	async def round_start(self, event):
-		await self.send(text_data='rs')
-
-	#gameOver 		go
-	async def game_over(self, event):
-		await self.send(text_data='go')
-
-	#setScore 		ss;id;score
-	async def player_score(self, event):
-		await self.send(text_data=f"ss;{event.get('id')};{event.get('score')}")
-
-	#disconnect 	dc;id
-	async def disconnectedMsg(self, event):
-		await self.send(text_data=f"dc;{event.get('id')}")
-	
\ No newline at end of file
+	MATCH_STATUSES = ('pending', 'running')
+
+	async def connect(self):
+		self.read_group_name()
+		if not await self.validate():
+			await self.close()
+			return
+		await self.accept()
+		await GamesHandler.add_spectator(self, self.group_name)
+
+	async def validate(self):
+		"""
+		Signed in users only, a tournament match can be watched once it runs
+		"""
+		if not self.user.is_authenticated:
+			return False
+		return await super().validate()
+
+	async def disconnect(self, close_code):
+		GamesHandler.remove_spectator(self, self.group_name)
+
+	async def receive(self, text_data):
+		try:
+			message = json.loads(text_data)
+			if message == {'type': 'incomplete'}:
+				await GamesHandler.send_current_state(self)
+			elif isinstance(message, dict) and message.get('type') == 'ack':
+				GamesHandler.ack(self, int(message['tick']))
+		except Exception as e:
+			print('text_data:', text_data, 'exception:', e)
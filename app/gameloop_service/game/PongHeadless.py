@@ -0,0 +1,164 @@
+"""
+Runs PongGames without websockets, channel layer, redis or gamehub.
+
+HeadlessClient stands in for MyConsumer and counts what it gets sent, HeadlessIO records the group
+events and match results, HeadlessScheduler ticks the games as fast as possible on a virtual clock.
+Game time only advances with the ticks, so a run with the same inputs plays the same match.
+
+	async def main():
+		match = HeadlessMatch(2, script=alternating_inputs)
+		await match.start()
+		for _ in range(600):
+			await match.step()
+
+Used by the pongbench and pongreplay management commands.
+"""
+import asyncio
+from .GameScheduler import GameScheduler
+from .Pong import PongGame, PLAYER_INPUTS, TICK_INTERVAL
+from .PongReplay import ReplayError
+
+class HeadlessUser:
+	def __init__(self, id, username):
+		self.id = id
+		self.username = username
+
+
+class HeadlessClient:
+	"""
+	The part of MyConsumer a PongGame uses
+	"""
+	def __init__(self, index, match_type):
+		self.user = HeadlessUser(index + 1, f'player{index + 1}')
+		self.match_type = match_type
+		self.lobby_id = 'headless'
+		self.match_id = -1
+		self.group_name = f'{match_type}_headless'
+		self.player_c = None
+		self.frames = 0
+		self.bytes = 0
+		self.closed = False
+
+	async def send(self, text_data=None, bytes_data=None):
+		self.frames += 1
+		self.bytes += len(bytes_data) if bytes_data is not None else len(text_data)
+
+	async def close(self):
+		self.closed = True
+
+	async def assign_player(self, pong_player):
+		self.player_c = pong_player
+
+
+class HeadlessIO:
+	def __init__(self):
+		self.events = []
+		self.matches = []
+		self.replays = []
+
+	def group_send(self, event):
+		self.events.append(event)
+
+	def post_match(self, data):
+		self.matches.append(data)
+
+	def save_replay(self, name, replay):
+		self.replays.append(replay)
+
+
+class HeadlessScheduler(GameScheduler):
+	"""
+	Ticks every game that is due once per step(), next_tick is game time starting at 0
+	"""
+	def __init__(self, event_loop):
+		super().__init__(event_loop)
+		self.time = 0.0
+		self.steps = 0
+
+	def add_game(self, game):
+		game.next_tick = self.time
+		self.games.append(game)
+
+	def now(self):
+		return self.time
+
+	def step(self):
+		# deadlines of idle games are added up differently than time, they are only equal up to rounding
+		due = [game for game in self.games if not game.stopped and game.next_tick <= self.time + self.tick_interval * 0.5]
+		self.tick_all(due)
+		self.ticks += len(due)
+		for game in due:
+			self.advance(game)
+		self.time += self.tick_interval
+		self.steps += 1
+		for game in [game for game in self.games if game.stopped]:
+			self.games.remove(game)
+			game.finish()
+		return len(due)
+
+
+def alternating_inputs(tick, seat):
+	"""
+	Every paddle goes up and down for a second each, offset by its seat
+	"""
+	phase = (tick + seat * 20) % 120
+	if phase == 0:
+		return 1
+	if phase == 60:
+		return 2
+	return None
+
+
+class HeadlessMatch:
+	"""
+	One PongGame with HeadlessClients, script(tick, seat) returns the input of a seat for a tick or None
+	"""
+	def __init__(self, player_count, script=None, scheduler=None, backend=None, match_type='match'):
+		self.io = HeadlessIO()
+		self.game = PongGame(player_count, io=self.io, backend=backend)
+		self.game.players = [HeadlessClient(index, match_type) for index in range(player_count)]
+		self.clients = list(self.game.players)
+		self.script = script
+		self.scheduler = scheduler
+
+	async def start(self):
+		if self.scheduler is None:
+			self.scheduler = HeadlessScheduler(asyncio.get_running_loop())
+		self.game.start_game(self.scheduler)
+		# lets assign_player and the entity messages run
+		await asyncio.sleep(0)
+
+	def scores(self):
+		return [section.player.score for section in self.game.gameLogic.sections]
+
+	def feed_inputs(self, tick):
+		if self.script is None:
+			return
+		for seat, client in enumerate(self.clients):
+			input = self.script(tick, seat)
+			if input in PLAYER_INPUTS and client.player_c is not None:
+				client.player_c.handle_remote_movement(input)
+
+	async def step(self):
+		"""
+		One tick of every game of the scheduler, call feed_inputs() of the other matches first if it is shared
+		"""
+		self.feed_inputs(self.scheduler.steps)
+		self.scheduler.step()
+		await asyncio.sleep(0)
+
+
+async def play_replay(replay, max_ticks=None):
+	"""
+	Simulates a Replay again, returns the HeadlessMatch once the game is over or max_ticks
+	(replay.ticks by default) are done. Compare its scores() with replay.scores.
+	"""
+	if abs(replay.tick_interval - TICK_INTERVAL) > 1e-9:
+		raise ReplayError(f'replay was recorded at a tick interval of {replay.tick_interval}s, this game runs at {TICK_INTERVAL}s')
+	match = HeadlessMatch(replay.player_count, script=replay.script(), backend=replay.backend)
+	await match.start()
+	if max_ticks is None:
+		max_ticks = replay.ticks
+	while not match.game.stopped and match.scheduler.steps < max_ticks:
+		await match.step()
+	return match
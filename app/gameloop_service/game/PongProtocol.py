@@ -0,0 +1,211 @@
+"""
+Binary wire protocol of the gameloop, frames go to the client as websocket bytes_data.
+
+A frame is the protocol version followed by one or more messages, all little endian:
+
+	frame			u8 version, u32 tick, u32 time, message*
+	updatePos		u8 OP_UPDATE_POS, u32 id, i16 x, i16 y, u16 rotation
+	setPos			u8 OP_SET_POS, u32 id, i16 x, i16 y, u16 rotation
+	setScore		u8 OP_SET_SCORE, u32 id, u16 score
+	roundStart		u8 OP_ROUND_START
+	gameOver		u8 OP_GAME_OVER
+	disconnect		u8 OP_DISCONNECT, u32 id
+	delta			u8 OP_DELTA, u32 id, u8 mask, [i16 x], [i16 y], [u16 rotation]
+	keyframe		u8 OP_KEYFRAME
+	ballState		u8 OP_BALL_STATE, u32 id, i16 x, i16 y, i16 vx, i16 vy
+
+tick and time (ms since the start of the game) tell the client which simulation step a frame
+shows, it interpolates between them. Frames outside of the tick stream (events, the scores
+sent with the field) have tick 0. The client acks the tick of every frame that has one, see SendQueue.
+Positions are quantized to 1 / POSITION_SCALE px, rotations to 1 / ROTATION_SCALE degree.
+A delta only carries the fields set in its mask (DELTA_X, DELTA_Y, DELTA_ROTATION), the client
+keeps the others from the last transform it got for the entity. DELTA_SNAP makes it a setPos.
+A keyframe marks a frame that carries the full transform of every entity (PongSnapshot).
+ballState carries the velocity in 1 / VELOCITY_SCALE px per second, the client extrapolates
+the ball from it and the frame time until the next ballState (GAME_BALL_SYNC = 'events').
+Entity ids are process wide (G_ID) and keep growing, so they get 32 bits.
+newEntity and initPlayer carry strings and are rare, they stay text messages.
+src/js/pong_protocol.js is the client side of this file, keep both in sync.
+"""
+import struct
+
+PROTOCOL_VERSION = 3
+
+OP_UPDATE_POS = 1
+OP_SET_POS = 2
+OP_SET_SCORE = 3
+OP_ROUND_START = 4
+OP_GAME_OVER = 5
+OP_DISCONNECT = 6
+OP_DELTA = 7
+OP_KEYFRAME = 8
+OP_BALL_STATE = 9
+
+DELTA_X = 1
+DELTA_Y = 2
+DELTA_ROTATION = 4
+DELTA_SNAP = 8
+
+POSITION_SCALE = 8
+ROTATION_SCALE = 100
+VELOCITY_SCALE = 4
+
+HEADER = struct.Struct('<BII')
+TRANSFORM = struct.Struct('<BIhhH')
+SCORE = struct.Struct('<BIH')
+OPCODE = struct.Struct('<B')
+ENTITY = struct.Struct('<BI')
+DELTA = struct.Struct('<BIB')
+FIELD = struct.Struct('<h')
+ROTATION = struct.Struct('<H')
+BALL_STATE = struct.Struct('<BIhhhh')
+
+POSITION_MIN = -32768 / POSITION_SCALE
+POSITION_MAX = 32767 / POSITION_SCALE
+
+class ProtocolError(ValueError):
+	pass
+
+
+def quantize_position(value):
+	return round(min(max(value, POSITION_MIN), POSITION_MAX) * POSITION_SCALE)
+
+def quantize_rotation(degree):
+	return round((degree % 360) * ROTATION_SCALE) % (360 * ROTATION_SCALE)
+
+def quantize_velocity(value):
+	return round(min(max(value * VELOCITY_SCALE, -32768), 32767))
+
+def quantize_transform(x, y, rotation):
+	return (quantize_position(x), quantize_position(y), quantize_rotation(rotation))
+
+def encode_transform(opcode, id, x, y, rotation):
+	return TRANSFORM.pack(opcode, id, quantize_position(x), quantize_position(y), quantize_rotation(rotation))
+
+def encode_update_pos(id, x, y, rotation):
+	return encode_transform(OP_UPDATE_POS, id, x, y, rotation)
+
+def encode_set_pos(id, x, y, rotation):
+	return encode_transform(OP_SET_POS, id, x, y, rotation)
+
+def encode_set_score(id, score):
+	return SCORE.pack(OP_SET_SCORE, id, score)
+
+def encode_round_start():
+	return OPCODE.pack(OP_ROUND_START)
+
+def encode_game_over():
+	return OPCODE.pack(OP_GAME_OVER)
+
+def encode_disconnect(id):
+	return ENTITY.pack(OP_DISCONNECT, id)
+
+def encode_delta(id, previous, current, snap=False):
+	"""
+	previous and current are quantized transforms (quantize_transform), previous None sends every field.
+	Returns b'' if nothing changed on the grid.
+	"""
+	mask = 0
+	fields = []
+	if previous is None or previous[0] != current[0]:
+		mask |= DELTA_X
+		fields.append(FIELD.pack(current[0]))
+	if previous is None or previous[1] != current[1]:
+		mask |= DELTA_Y
+		fields.append(FIELD.pack(current[1]))
+	if previous is None or previous[2] != current[2]:
+		mask |= DELTA_ROTATION
+		fields.append(ROTATION.pack(current[2]))
+	if mask == 0:
+		return b''
+	if snap:
+		mask |= DELTA_SNAP
+	return DELTA.pack(OP_DELTA, id, mask) + b''.join(fields)
+
+def encode_ball_state(id, x, y, velocity_x, velocity_y):
+	"""
+	velocity in px per second
+	"""
+	return BALL_STATE.pack(OP_BALL_STATE, id, quantize_position(x), quantize_position(y),
+		quantize_velocity(velocity_x), quantize_velocity(velocity_y))
+
+def encode_keyframe():
+	return OPCODE.pack(OP_KEYFRAME)
+
+def encode_frame(messages, tick=0, time=0):
+	"""
+	messages are the encoded messages (bytes) that go into one frame,
+	tick and time (ms since the start of the game) the simulation step they show
+	"""
+	return HEADER.pack(PROTOCOL_VERSION, tick & 0xffffffff, int(time) & 0xffffffff) + b''.join(messages)
+
+
+def decode_header(data):
+	"""
+	Returns (tick, time) of a frame
+	"""
+	if len(data) < HEADER.size:
+		raise ProtocolError('empty frame')
+	version, tick, time = HEADER.unpack_from(data, 0)
+	if version != PROTOCOL_VERSION:
+		raise ProtocolError(f'unsupported protocol version {version}')
+	return tick, time
+
+
+def decode_frame(data):
+	"""
+	Returns the messages of a frame as tuples, named after the old text protocol:
+	('up', id, x, y, rotation), ('sp', id, x, y, rotation), ('ss', id, score), ('rs',), ('go',), ('dc', id),
+	('dt', id, x, y, rotation, snap) with None for the fields a delta does not carry, ('kf',),
+	('bs', id, x, y, velocity_x, velocity_y)
+	"""
+	decode_header(data)
+	messages = []
+	offset = HEADER.size
+	try:
+		while offset < len(data):
+			opcode = data[offset]
+			if opcode == OP_UPDATE_POS or opcode == OP_SET_POS:
+				_, id, x, y, rotation = TRANSFORM.unpack_from(data, offset)
+				messages.append(('up' if opcode == OP_UPDATE_POS else 'sp', id, x / POSITION_SCALE, y / POSITION_SCALE, rotation / ROTATION_SCALE))
+				offset += TRANSFORM.size
+			elif opcode == OP_SET_SCORE:
+				_, id, score = SCORE.unpack_from(data, offset)
+				messages.append(('ss', id, score))
+				offset += SCORE.size
+			elif opcode == OP_ROUND_START:
+				messages.append(('rs',))
+				offset += OPCODE.size
+			elif opcode == OP_GAME_OVER:
+				messages.append(('go',))
+				offset += OPCODE.size
+			elif opcode == OP_DISCONNECT:
+				_, id = ENTITY.unpack_from(data, offset)
+				messages.append(('dc', id))
+				offset += ENTITY.size
+			elif opcode == OP_DELTA:
+				_, id, mask = DELTA.unpack_from(data, offset)
+				offset += DELTA.size
+				x = y = rotation = None
+				if mask & DELTA_X:
+					x = FIELD.unpack_from(data, offset)[0] / POSITION_SCALE
+					offset += FIELD.size
+				if mask & DELTA_Y:
+					y = FIELD.unpack_from(data, offset)[0] / POSITION_SCALE
+					offset += FIELD.size
+				if mask & DELTA_ROTATION:
+					rotation = ROTATION.unpack_from(data, offset)[0] / ROTATION_SCALE
+					offset += ROTATION.size
+				messages.append(('dt', id, x, y, rotation, bool(mask & DELTA_SNAP)))
+			elif opcode == OP_BALL_STATE:
+				_, id, x, y, velocity_x, velocity_y = BALL_STATE.unpack_from(data, offset)
+				messages.append(('bs', id, x / POSITION_SCALE, y / POSITION_SCALE, velocity_x / VELOCITY_SCALE, velocity_y / VELOCITY_SCALE))
+				offset += BALL_STATE.size
+			elif opcode == OP_KEYFRAME:
+				messages.append(('kf',))
+				offset += OPCODE.size
+			else:
+				raise ProtocolError(f'unknown opcode {opcode} at {offset}')
+	except struct.error as e:
+		raise ProtocolError(f'truncated frame: {e}')
+	return messages
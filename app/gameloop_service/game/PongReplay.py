@@ -0,0 +1,120 @@
+"""
+Match replays, a match is stored as its inputs instead of its frames.
+
+The simulation only depends on the player count, the physics backend, the tick length and the
+inputs applied at the start of each tick (PongGame.apply_inputs), so these are all a replay holds.
+PongHeadless.play_replay() simulates it again, the final scores tell if the engine still plays
+the same match. File layout, little endian:
+
+	header		4s MAGIC, u8 version, u8 backend, u8 player count, u32 seed, f64 tick interval, u32 ticks
+	scores		u16 per seat
+	inputs		u32 count, (varint ticks since the previous input, u8 seat << 2 | input)*
+
+The game has no randomness yet, seed is stored so a random serve can be replayed later.
+"""
+import struct
+
+MAGIC = b'PRPL'
+REPLAY_VERSION = 1
+BACKENDS = ('python', 'numpy')
+
+HEADER = struct.Struct('<4sBBBIdI')
+SCORE = struct.Struct('<H')
+COUNT = struct.Struct('<I')
+
+class ReplayError(ValueError):
+	pass
+
+
+def encode_varint(value):
+	out = bytearray()
+	while value >= 0x80:
+		out.append((value & 0x7f) | 0x80)
+		value >>= 7
+	out.append(value)
+	return bytes(out)
+
+def decode_varint(data, offset):
+	value = 0
+	shift = 0
+	while True:
+		if offset >= len(data):
+			raise ReplayError('truncated varint')
+		byte = data[offset]
+		offset += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return value, offset
+		shift += 7
+
+
+class Replay:
+	def __init__(self, player_count, backend='python', tick_interval=0.016, seed=0):
+		self.player_count = player_count
+		self.backend = backend
+		self.tick_interval = tick_interval
+		self.seed = seed
+		# (tick, seat, input) in the order they were applied
+		self.inputs: list[tuple] = []
+		# ticks simulated until the match ended and the final score of every seat
+		self.ticks = 0
+		self.scores: list[int] = []
+
+	def record(self, tick, seat, input):
+		self.inputs.append((tick, seat, input))
+
+	def finish(self, ticks, scores):
+		self.ticks = ticks
+		self.scores = list(scores)
+
+	def script(self):
+		"""
+		The inputs as a HeadlessMatch script
+		"""
+		inputs = {(tick, seat): input for tick, seat, input in self.inputs}
+		return lambda tick, seat: inputs.get((tick, seat))
+
+	def encode(self):
+		parts = [
+			HEADER.pack(MAGIC, REPLAY_VERSION, BACKENDS.index(self.backend), self.player_count, self.seed, self.tick_interval, self.ticks),
+			# a replay of a match that did not finish has no scores yet
+			b''.join(SCORE.pack(score) for score in (self.scores or [0] * self.player_count)),
+			COUNT.pack(len(self.inputs)),
+		]
+		previous = 0
+		for tick, seat, input in self.inputs:
+			parts.append(encode_varint(tick - previous))
+			parts.append(bytes([seat << 2 | input]))
+			previous = tick
+		return b''.join(parts)
+
+	@staticmethod
+	def decode(data):
+		if len(data) < HEADER.size:
+			raise ReplayError('truncated header')
+		magic, version, backend, player_count, seed, tick_interval, ticks = HEADER.unpack_from(data, 0)
+		if magic != MAGIC:
+			raise ReplayError('not a pong replay')
+		if version != REPLAY_VERSION:
+			raise ReplayError(f'unsupported replay version {version}')
+		if backend >= len(BACKENDS):
+			raise ReplayError(f'unknown backend {backend}')
+		replay = Replay(player_count, BACKENDS[backend], tick_interval, seed)
+		offset = HEADER.size
+		try:
+			scores = [SCORE.unpack_from(data, offset + i * SCORE.size)[0] for i in range(player_count)]
+			offset += player_count * SCORE.size
+			count, = COUNT.unpack_from(data, offset)
+			offset += COUNT.size
+		except struct.error as e:
+			raise ReplayError(f'truncated replay: {e}')
+		replay.finish(ticks, scores)
+		tick = 0
+		for _ in range(count):
+			delta, offset = decode_varint(data, offset)
+			if offset >= len(data):
+				raise ReplayError('truncated input')
+			tick += delta
+			replay.record(tick, data[offset] >> 2, data[offset] & 3)
+			offset += 1
+		return replay
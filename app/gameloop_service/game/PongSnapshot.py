@@ -0,0 +1,85 @@
+from .GameSystem import Mesh
+from . import PongProtocol
+
+class Snapshots:
+	"""
+	Delta compressed transforms of one PongGame.
+	Transforms are compared on the grid of the wire protocol, an entity only goes out if it moved
+	by at least one grid step and only with the fields that changed (paddles and walls never rotate).
+
+	The websocket is ordered and reliable, so every client that got the last frame knows the
+	baseline: the last transform that was sent of each entity. Clients share it and the delta frame
+	is encoded once per tick. A client that lost track (joined, asked for the entities again with
+	'incomplete') gets a keyframe with the full transform of every entity instead of the delta,
+	after that it is on the baseline again. Everyone gets a keyframe every KEYFRAME_INTERVAL frames.
+	"""
+	KEYFRAME_INTERVAL = 60
+
+	def __init__(self):
+		# entity id -> quantized transform the clients got last
+		self.baseline: dict[int, tuple] = {}
+		self.keyframe_pending = set()
+		self.ticks = 0
+
+	def request_keyframe(self, consumer):
+		self.keyframe_pending.add(consumer)
+
+	def keyframe_due(self):
+		"""
+		True if the next frames() call sends a keyframe to at least one client
+		"""
+		return len(self.keyframe_pending) != 0 or (self.ticks + 1) % self.KEYFRAME_INTERVAL == 0
+
+	def encode_ball_state(self, ball, velocity_x, velocity_y):
+		"""
+		Full position and velocity of the ball for the client side extrapolation, goes out with the next frames() call
+		"""
+		self.baseline[ball.id] = PongProtocol.quantize_transform(ball.position.x, ball.position.y, ball.rotation)
+		return PongProtocol.encode_ball_state(ball.id, ball.position.x, ball.position.y, velocity_x, velocity_y)
+
+	def frames(self, moves, entities, consumers, states=(), tick=0, time=0):
+		"""
+		moves are the (entity, snap) pairs that moved since the last frame, entities all entities of the world,
+		states encoded ball states (encode_ball_state) that go to every client, tick and time go into the frame header.
+		Called once per sent frame, KEYFRAME_INTERVAL counts these calls.
+		Returns (frame, consumers) pairs, nothing if no client has to get anything this tick.
+		"""
+		self.ticks += 1
+		deltas = []
+		for entity, snap in moves:
+			current = PongProtocol.quantize_transform(entity.position.x, entity.position.y, entity.rotation)
+			delta = PongProtocol.encode_delta(entity.id, self.baseline.get(entity.id), current, snap)
+			if delta:
+				self.baseline[entity.id] = current
+				deltas.append(delta)
+		deltas.extend(states)
+
+		if self.ticks % self.KEYFRAME_INTERVAL == 0:
+			keyframe_consumers = list(consumers)
+			delta_consumers = []
+		else:
+			keyframe_consumers = [consumer for consumer in consumers if consumer in self.keyframe_pending]
+			delta_consumers = [consumer for consumer in consumers if consumer not in self.keyframe_pending] if deltas else []
+		self.keyframe_pending.clear()
+
+		frames = []
+		if delta_consumers:
+			frames.append((PongProtocol.encode_frame(deltas, tick, time), delta_consumers))
+		if keyframe_consumers:
+			frames.append((PongProtocol.encode_frame(self.keyframe(moves, entities, states), tick, time), keyframe_consumers))
+		return frames
+
+	def keyframe(self, moves, entities, states=()):
+		"""
+		Messages of a keyframe, the full transform of every entity with a mesh
+		"""
+		snapped = {entity.id for entity, snap in moves if snap}
+		messages = [PongProtocol.encode_keyframe()]
+		for entity in entities:
+			if entity.get_component(Mesh) is None:
+				continue
+			encode = PongProtocol.encode_set_pos if entity.id in snapped else PongProtocol.encode_update_pos
+			messages.append(encode(entity.id, entity.position.x, entity.position.y, entity.rotation))
+			self.baseline[entity.id] = PongProtocol.quantize_transform(entity.position.x, entity.position.y, entity.rotation)
+		messages.extend(states)
+		return messages
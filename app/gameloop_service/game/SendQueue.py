@@ -0,0 +1,109 @@
+import collections
+from . import GameMetrics
+
+class SendQueue:
+	"""
+	Everything a PongGame sends to one consumer, sent in order by a task of its own, so a consumer whose
+	send stalls (channel layer of a remote seat, shard pipe) only delays itself.
+
+	Frames are position updates and can be replaced: if FRAME_LIMIT of them are still waiting, they
+	are all dropped together with the new one and on_drop(consumer) asks for a keyframe, which holds
+	the full state again. Reliable messages are never dropped, a consumer that does not take LIMIT
+	of them gets closed.
+
+	An awaited send only tells that daphne or the channel layer took the message, not that the client
+	got it. A client that acks the ticks of its frames (ack()) may have ACK_WINDOW of them unacknowledged,
+	further frames are dropped like the ones of a full queue. Until the first ack only the queue counts,
+	so clients that never ack (remote seats of old clients, PongHeadless) are not held back.
+	"""
+	FRAME_LIMIT = 8
+	LIMIT = 64
+	ACK_WINDOW = 16
+
+	def __init__(self, consumer, event_loop, on_drop):
+		self.consumer = consumer
+		self.event_loop = event_loop
+		self.on_drop = on_drop
+		# (reliable, text_data, bytes_data)
+		self.messages = collections.deque()
+		self.frames = 0
+		# ticks of the frames put since the last ack, None until the client acks
+		self.unacked = None
+		self.task = None
+		self.closed = False
+		self.closing = None
+
+	def put_frame(self, frame, tick=0):
+		if self.closed:
+			return
+		if self.frames >= self.FRAME_LIMIT or self.unacked is not None and len(self.unacked) >= self.ACK_WINDOW:
+			self.drop_frames()
+			return
+		self.frames += 1
+		if self.unacked is not None:
+			self.unacked.append(tick)
+		self.append((False, None, frame))
+
+	def ack(self, tick):
+		"""
+		The client got every frame up to tick
+		"""
+		if self.unacked is None:
+			self.unacked = collections.deque()
+		while self.unacked and self.unacked[0] <= tick:
+			self.unacked.popleft()
+
+	def put(self, text_data=None, bytes_data=None):
+		if self.closed:
+			return
+		if len(self.messages) >= self.LIMIT:
+			print(f'SendQueue: {len(self.messages)} messages waiting, closing the connection of {self.consumer.user.username}')
+			GameMetrics.SLOW_CLIENTS.inc()
+			self.close()
+			return
+		self.append((True, text_data, bytes_data))
+
+	def drop_frames(self):
+		GameMetrics.DROPPED_FRAMES.inc(self.frames + 1)
+		self.messages = collections.deque(message for message in self.messages if message[0])
+		# the dropped frames were the newest ones
+		if self.unacked is not None:
+			for _ in range(min(self.frames, len(self.unacked))):
+				self.unacked.pop()
+		self.frames = 0
+		self.on_drop(self.consumer)
+
+	def append(self, message):
+		self.messages.append(message)
+		if self.task is None:
+			self.task = self.event_loop.create_task(self.run())
+
+	async def run(self):
+		while self.messages:
+			reliable, text_data, bytes_data = self.messages.popleft()
+			if not reliable:
+				self.frames -= 1
+			try:
+				await self.consumer.send(text_data=text_data, bytes_data=bytes_data)
+			except Exception as e:
+				print(f'SendQueue: send failed, closing the connection: {e}')
+				self.close()
+		self.task = None
+		if self.closed and self.closing is None:
+			self.closing = self.event_loop.create_task(self.consumer.close())
+
+	def end(self):
+		"""
+		Sends what is queued, then closes the consumer
+		"""
+		if self.closed:
+			return
+		self.closed = True
+		if self.task is None:
+			self.closing = self.event_loop.create_task(self.consumer.close())
+
+	def close(self):
+		self.closed = True
+		self.messages.clear()
+		self.frames = 0
+		self.closing = self.event_loop.create_task(self.consumer.close())
@@ -0,0 +1,228 @@
+"""
+Cluster wide game session registry (settings.GAME_SESSION_REGISTRY).
+
+The gameloop process running a game owns it: redis key session_owner_string(group_name) holds the
+node channel of the owner with a lease of LEASE_MS that the owner keeps renewing. If the lease ran
+out (redis failover, a stalled process) the owner claims it again, or stops the session if another
+node took it in the meantime, so a game never runs on two nodes for long. A consumer
+connecting to another process does not get a GamesHandler there, it joins the game on the owner
+as a ChannelSeat instead:
+
+	consumer node -> owner		seat.join, seat.input, seat.ack, seat.resync, seat.leave (to the node channel)
+	owner -> consumer			game.frame, game.close (to the consumer channel)
+
+Group events are reliable messages in the SendQueue of the seat, they reach the consumer as game.frame.
+"""
+import asyncio
+from channels.layers import get_channel_layer
+from .GameShards import RemoteUser
+from .GameRedis import GameRedis
+from .utils import session_owner_string
+
+# only touch the lease if we still own it
+RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+class ForwardedPlayer:
+	"""
+	consumer.player_c on a node that does not own the game, inputs go to the owner
+	"""
+	def __init__(self, registry: 'SessionRegistry', consumer):
+		self.registry = registry
+		self.consumer = consumer
+		self.id = None
+
+	def handle_remote_movement(self, input):
+		self.registry.forward(self.consumer, 'seat.input', input=input)
+
+
+class ChannelSeat:
+	"""
+	Stand in for a consumer of another node on the owner, GamesHandler and PongGame use it like a MyConsumer
+	"""
+	def __init__(self, registry: 'SessionRegistry', message):
+		self.registry = registry
+		self.channel_layer = registry.channel_layer
+		self.channel_name = message['channel']
+		self.group_name = message['group_name']
+		self.match_type = message['match_type']
+		self.lobby_id = message['lobby_id']
+		self.match_id = message['match_id']
+		self.user = RemoteUser(message['uid'], message['username'])
+		self.player_c = None
+
+	async def send(self, text_data=None, bytes_data=None):
+		await self.channel_layer.send(self.channel_name, {'type': 'game.frame', 'text_data': text_data, 'bytes_data': bytes_data})
+
+	async def close(self):
+		await self.channel_layer.send(self.channel_name, {'type': 'game.close'})
+
+	async def assign_player(self, pong_player):
+		self.player_c = pong_player
+
+
+class SessionRegistry:
+	LEASE_MS = 10000
+
+	instance: 'SessionRegistry' = None
+
+	def __init__(self):
+		self.redis = GameRedis.get()
+		self.channel_layer = get_channel_layer()
+		self.channel_name = None
+		self.started = None
+		# sessions this node owns
+		self.owned = set()
+		# (group_name, consumer channel) -> ChannelSeat of consumers on other nodes
+		self.seats: dict[tuple, ChannelSeat] = {}
+		self.tasks = set()
+
+	@staticmethod
+	async def get():
+		"""
+		None if the registry is turned off and every process only serves its own consumers
+		"""
+		if SessionRegistry.instance is None:
+			from django.conf import settings
+			if not getattr(settings, 'GAME_SESSION_REGISTRY', False):
+				return None
+			SessionRegistry.instance = SessionRegistry()
+		registry = SessionRegistry.instance
+		if registry.started is None:
+			registry.started = asyncio.get_running_loop().create_task(registry.start())
+		await registry.started
+		return registry
+
+	async def start(self):
+		self.channel_name = await self.channel_layer.new_channel('gameloop')
+		self.spawn(self.receive_loop())
+		self.spawn(self.renew_loop())
+		print('SessionRegistry node channel:', self.channel_name)
+
+	def spawn(self, coro):
+		task = asyncio.get_running_loop().create_task(coro)
+		self.tasks.add(task)
+		task.add_done_callback(self.tasks.discard)
+		return task
+
+	async def claim(self, group_name):
+		"""
+		Returns the node channel of the owner of the session, claims it if it has no owner
+		"""
+		key = session_owner_string(group_name)
+		while True:
+			if await self.redis.set(key, self.channel_name, nx=True, px=self.LEASE_MS):
+				self.owned.add(group_name)
+				return self.channel_name
+			owner = await self.redis.get(key)
+			# the lease ran out between SET and GET, try again
+			if owner is not None:
+				return owner.decode()
+
+	async def release(self, group_name):
+		if group_name in self.owned:
+			self.owned.discard(group_name)
+			await self.redis.eval(RELEASE_SCRIPT, 1, session_owner_string(group_name), self.channel_name)
+
+	async def renew_loop(self):
+		while True:
+			await asyncio.sleep(self.LEASE_MS / 3000)
+			try:
+				await self.renew()
+			except Exception as e:
+				print(f'SessionRegistry could not renew leases: {e}')
+
+	async def renew(self):
+		groups = list(self.owned)
+		if len(groups) == 0:
+			return
+		async with self.redis.pipeline(transaction=False) as pipe:
+			for group_name in groups:
+				pipe.eval(RENEW_SCRIPT, 1, session_owner_string(group_name), self.channel_name, self.LEASE_MS)
+			renewed = await pipe.execute()
+		for group_name, ok in zip(groups, renewed):
+			if not ok:
+				await self.lease_lost(group_name)
+
+	async def lease_lost(self, group_name):
+		"""
+		Claimed again if nobody took the session in the meantime. Otherwise another node owns it now,
+		the session stops here and its consumers reconnect to the new owner
+		"""
+		from .Pong import GamesHandler, PongGame
+		if await self.redis.set(session_owner_string(group_name), self.channel_name, nx=True, px=self.LEASE_MS):
+			print(f'SessionRegistry claimed {group_name} again after its lease ran out')
+			return
+		print(f'SessionRegistry lost the lease of {group_name}, stopping the session')
+		self.owned.discard(group_name)
+		for key in [key for key in self.seats if key[0] == group_name]:
+			self.seats.pop(key)
+		handler = GamesHandler.game_sessions.pop(group_name, None)
+		if handler is None:
+			return
+		consumers = list(handler.players)
+		handler.players.clear()
+		if handler.game is not None:
+			handler.game.stop()
+			for spectator in list(getattr(handler.game, 'spectators', [])):
+				handler.game.remove_spectator(spectator)
+				consumers.append(spectator)
+		for consumer in consumers:
+			await consumer.close()
+		if isinstance(handler.game, PongGame):
+			handler.game.detach()
+
+	"""
+	Consumer node side
+	"""
+	async def join_remote(self, owner, consumer):
+		consumer.session_owner = owner
+		consumer.player_c = ForwardedPlayer(self, consumer)
+		await self.channel_layer.send(owner, {
+			'type': 'seat.join',
+			'group_name': consumer.group_name,
+			'channel': consumer.channel_name,
+			'match_type': consumer.match_type,
+			'lobby_id': consumer.lobby_id,
+			'match_id': consumer.match_id,
+			'uid': consumer.user.id,
+			'username': consumer.user.username,
+		})
+
+	def forward(self, consumer, type, **fields):
+		message = dict(fields, type=type, group_name=consumer.group_name, channel=consumer.channel_name)
+		self.spawn(self.channel_layer.send(consumer.session_owner, message))
+
+	"""
+	Owner side
+	"""
+	async def receive_loop(self):
+		while True:
+			message = await self.channel_layer.receive(self.channel_name)
+			try:
+				await self.dispatch(message)
+			except Exception as e:
+				print(f'SessionRegistry failed to handle {message.get("type")}: {e}')
+
+	async def dispatch(self, message):
+		from .Pong import GamesHandler
+		key = (message['group_name'], message['channel'])
+		kind = message['type']
+		if kind == 'seat.join':
+			seat = ChannelSeat(self, message)
+			self.seats[key] = seat
+			await GamesHandler.add_consumer_to_game(seat, seat.group_name)
+			return
+		seat = self.seats.get(key)
+		if seat is None:
+			return
+		if kind == 'seat.input':
+			if seat.player_c is not None:
+				seat.player_c.handle_remote_movement(message['input'])
+		elif kind == 'seat.ack':
+			GamesHandler.ack(seat, message['tick'])
+		elif kind == 'seat.resync':
+			await GamesHandler.send_current_state(seat)
+		elif kind == 'seat.leave':
+			self.seats.pop(key)
+			await GamesHandler.disconnect_consumer_from_game(seat, seat.group_name)
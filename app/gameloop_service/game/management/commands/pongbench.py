@@ -0,0 +1,82 @@
+import asyncio, contextlib, io, time, tracemalloc
+from django.core.management.base import BaseCommand
+from game.PongHeadless import HeadlessMatch, HeadlessScheduler, alternating_inputs
+
+def int_list(value):
+	return [int(v) for v in value.split(',') if v]
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+	help = 'Ticks headless PongGames as fast as possible and reports ticks/s, tick times and allocations'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--games', type=int_list, default=[1, 10, 100, 1000], help='concurrent games, comma separated')
+		parser.add_argument('--players', type=int_list, default=[2, 4, 6], help='players per game, comma separated')
+		parser.add_argument('--ticks', type=int, default=600, help='ticks per run')
+		parser.add_argument('--backend', default=None, help="'python' or 'numpy', settings.GAME_PHYSICS_BACKEND by default")
+		parser.add_argument('--alloc-ticks', type=int, default=50, help='ticks traced with tracemalloc after the timed run, 0 disables it')
+
+	def handle(self, *args, **options):
+		self.stdout.write(f"{'players':>7} {'games':>6} {'ticks/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'alloc KiB/tick':>14} {'KiB sent/game/s':>15}")
+		for players in options['players']:
+			for games in options['games']:
+				result = asyncio.run(self.run(players, games, options['ticks'], options['backend'], options['alloc_ticks']))
+				self.stdout.write(
+					f"{players:>7} {games:>6} {result['ticks_per_second']:>10.0f} {result['p50'] * 1000:>8.3f} {result['p99'] * 1000:>8.3f}"
+					f" {result['alloc'] / 1024:>14.1f} {result['sent'] / 1024:>15.1f}"
+				)
+
+	async def run(self, players, games, ticks, backend, alloc_ticks):
+		"""
+		One tick of the scheduler ticks every game once, p50/p99 are the times of these steps
+		"""
+		scheduler = HeadlessScheduler(asyncio.get_running_loop())
+		match_type = 'match' if players == 2 else 'multiple'
+		# the games print a lot while they start
+		with contextlib.redirect_stdout(io.StringIO()):
+			matches = [HeadlessMatch(players, alternating_inputs, scheduler, backend, match_type) for _ in range(games)]
+			for match in matches:
+				await match.start()
+
+		step_times = []
+		game_ticks = 0
+		with contextlib.redirect_stdout(io.StringIO()):
+			start = time.perf_counter()
+			for tick in range(ticks):
+				step_start = time.perf_counter()
+				for match in matches:
+					match.feed_inputs(tick)
+				game_ticks += scheduler.step()
+				step_times.append(time.perf_counter() - step_start)
+				await asyncio.sleep(0)
+			elapsed = time.perf_counter() - start
+
+			alloc = 0
+			if alloc_ticks > 0:
+				tracemalloc.start()
+				peaks = []
+				for tick in range(ticks, ticks + alloc_ticks):
+					before = tracemalloc.get_traced_memory()[0]
+					tracemalloc.reset_peak()
+					for match in matches:
+						match.feed_inputs(tick)
+					ticked = scheduler.step()
+					if ticked:
+						peaks.append((tracemalloc.get_traced_memory()[1] - before) / ticked)
+					await asyncio.sleep(0)
+				tracemalloc.stop()
+				alloc = sum(peaks) / len(peaks) if peaks else 0
+
+		sent = sum(client.bytes for match in matches for client in match.clients)
+		game_seconds = ticks * scheduler.tick_interval
+		return {
+			'ticks_per_second': game_ticks / elapsed if elapsed else 0,
+			'p50': percentile(step_times, 0.5),
+			'p99': percentile(step_times, 0.99),
+			'alloc': alloc,
+			'sent': sent / games / (game_seconds + alloc_ticks * scheduler.tick_interval),
+		}
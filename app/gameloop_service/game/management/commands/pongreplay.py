@@ -0,0 +1,35 @@
+import asyncio, contextlib, io, time
+from django.core.management.base import BaseCommand, CommandError
+from game.PongHeadless import play_replay
+from game.PongReplay import Replay, ReplayError
+
+
+class Command(BaseCommand):
+	help = 'Simulates recorded matches again and checks that they end with the recorded scores'
+
+	def add_arguments(self, parser):
+		parser.add_argument('replays', nargs='+', help='.pongreplay files')
+
+	def handle(self, *args, **options):
+		mismatches = 0
+		for path in options['replays']:
+			try:
+				with open(path, 'rb') as file:
+					replay = Replay.decode(file.read())
+				start = time.perf_counter()
+				with contextlib.redirect_stdout(io.StringIO()):
+					match = asyncio.run(play_replay(replay))
+				elapsed = time.perf_counter() - start
+			except (OSError, ReplayError) as e:
+				raise CommandError(f'{path}: {e}')
+			ticks = match.scheduler.steps
+			scores = match.scores()
+			status = 'ok' if scores == replay.scores and ticks == replay.ticks else 'MISMATCH'
+			if status != 'ok':
+				mismatches += 1
+			self.stdout.write(
+				f'{path}: {status}, {replay.player_count} players, {len(replay.inputs)} inputs, '
+				f'{ticks}/{replay.ticks} ticks, scores {scores} (recorded {replay.scores}), {ticks / elapsed if elapsed else 0:.0f} ticks/s'
+			)
+		if mismatches:
+			raise CommandError(f'{mismatches} of {len(options["replays"])} replays did not play the recorded match')
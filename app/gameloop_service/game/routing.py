@@ -4,4 +4,5 @@ from . import PongConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/game/pong/(?P<group_name>\w+)/$', PongConsumer.MyConsumer.as_asgi()),
+    re_path(r'ws/game/watch/(?P<group_name>\w+)/$', PongConsumer.SpectatorConsumer.as_asgi()),
 ]
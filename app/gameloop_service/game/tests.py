@@ -1,3 +1,1515 @@
-from django.test import TestCase
+import asyncio, contextlib, fnmatch, io, itertools, json, math, random
+from unittest import mock
+from django.test import SimpleTestCase
+from . import PongProtocol
+from .GameSystem import Entity, Mesh, Box, Circle, Physics, CollisionSystem, Vector, time_of_impact
+from .PongSnapshot import Snapshots
+from .PongReplay import Replay, ReplayError
+from .MatchOutbox import MatchOutbox
+from .SendQueue import SendQueue
 
-# Create your tests here.
+def body(x, y, mesh, velocity=None):
+	"""
+	Entity with a mesh, velocity None leaves it without Physics
+	"""
+	ent = Entity(x, y)
+	ent.add_component(Mesh, mesh)
+	if velocity is not None:
+		ent.add_component(Physics, Physics(velocity[0], velocity[1], has_gravity=False))
+	return ent
+
+
+class FakeRedis:
+	"""
+	The few commands of the redis.asyncio client the gameloop uses, on a dict
+	"""
+	def __init__(self, data=None):
+		self.data = dict(data or {})
+		# called with the key before a get returns, lets a test interleave with the await
+		self.on_get = None
+
+	async def get(self, key):
+		if self.on_get is not None:
+			await self.on_get(key)
+		value = self.data.get(key)
+		return value.encode() if isinstance(value, str) else value
+
+	async def set(self, key, value, nx=False, px=None):
+		if nx and key in self.data:
+			return None
+		self.data[key] = value
+		return True
+
+	async def exists(self, key):
+		return int(key in self.data)
+
+	async def hset(self, key, mapping):
+		self.data.setdefault(key, {}).update(mapping)
+		return len(mapping)
+
+	async def scan_iter(self, match):
+		for key in list(self.data):
+			if fnmatch.fnmatchcase(key, match):
+				yield key.encode()
+
+	async def eval(self, script, numkeys, *args):
+		"""
+		The lua scripts of the gameloop, run as python
+		"""
+		from .MatchOutbox import ACK_SCRIPT, CLAIM_SCRIPT
+		from .SessionRegistry import RENEW_SCRIPT, RELEASE_SCRIPT
+		keys, argv = args[:numkeys], args[numkeys:]
+		if script in (RENEW_SCRIPT, RELEASE_SCRIPT):
+			if self.data.get(keys[0]) != argv[0]:
+				return 0
+			if script == RELEASE_SCRIPT:
+				del self.data[keys[0]]
+			return 1
+		if script == ACK_SCRIPT:
+			entries = self.data.get(keys[0], {})
+			if entries.get(argv[0]) == argv[1]:
+				del entries[argv[0]]
+				return 1
+			return 0
+		if script == CLAIM_SCRIPT:
+			if keys[1] in self.data:
+				return []
+			entries = self.data.pop(keys[0], {})
+			return [item.encode() for pair in entries.items() for item in pair]
+		raise NotImplementedError(script)
+
+	def pipeline(self, transaction=True):
+		return FakePipeline(self)
+
+
+class FakePipeline:
+	def __init__(self, redis):
+		self.redis = redis
+		self.calls = []
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		return False
+
+	def __getattr__(self, name):
+		return lambda *args, **kwargs: self.calls.append(getattr(self.redis, name)(*args, **kwargs))
+
+	async def execute(self):
+		return [await call for call in self.calls]
+
+
+@contextlib.contextmanager
+def fake_redis(client):
+	"""
+	GameRedis.get() returns client on the running event loop
+	"""
+	from types import SimpleNamespace
+	from .GameRedis import GameRedis
+	saved = GameRedis.instance
+	GameRedis.instance = SimpleNamespace(event_loop=asyncio.get_running_loop(), client=client)
+	try:
+		yield client
+	finally:
+		GameRedis.instance = saved
+
+
+class FakeConsumer:
+	"""
+	MyConsumer as GamesHandler sees it
+	"""
+	def __init__(self, uid, group_name):
+		from .GameShards import RemoteUser
+		self.user = RemoteUser(uid, f'user{uid}')
+		self.group_name = group_name
+		split = group_name.split('_')
+		self.match_type = split[0]
+		self.lobby_id = split[1]
+		self.match_id = int(split[-1]) if len(split) > 3 else -1
+		self.player_c = None
+		self.sent = []
+		self.closed = False
+
+	async def send(self, text_data=None, bytes_data=None):
+		self.sent.append(text_data if text_data is not None else PongProtocol.decode_frame(bytes_data))
+
+	async def close(self):
+		self.closed = True
+
+
+class VectorTests(SimpleTestCase):
+
+	def test_in_place_ops_return_self(self):
+		vector = Vector(1, 2)
+		self.assertIs(vector.set(3, 4), vector)
+		self.assertIs(vector.set_v(Vector(5, 6)), vector)
+		self.assertIs(vector.iadd(Vector(1, 1)), vector)
+		self.assertIs(vector.isub(Vector(2, 2)), vector)
+		self.assertIs(vector.imul(3), vector)
+		self.assertEqual((vector.x, vector.y), (12, 15))
+
+	def test_set_v_copies(self):
+		source = Vector(1, 2)
+		vector = Vector(0, 0).set_v(source)
+		source.set(7, 8)
+		self.assertEqual((vector.x, vector.y), (1, 2))
+
+	def test_aliasing(self):
+		vector = Vector(3, 4)
+		self.assertEqual((vector.iadd(vector).x, vector.y), (6, 8))
+		self.assertEqual((vector.isub(vector).x, vector.y), (0, 0))
+		vector.set(3, 4)
+		self.assertEqual((vector.set_v(vector).x, vector.y), (3, 4))
+
+	def test_new_vectors(self):
+		a = Vector(1, 2)
+		b = Vector(3, 5)
+		for result in (a.add(b), a.sub(b), a.dup()):
+			self.assertIsNot(result, a)
+			self.assertIsNot(result, b)
+		self.assertEqual((a.add(b).x, a.add(b).y), (4, 7))
+		self.assertEqual((a.sub(b).x, a.sub(b).y), (-2, -3))
+		self.assertEqual((a.x, a.y, b.x, b.y), (1, 2, 3, 5))
+
+	def test_slots(self):
+		with self.assertRaises(AttributeError):
+			Vector(0, 0).z = 1
+
+	def test_physics_keeps_its_velocity(self):
+		phys = Physics(1, 2)
+		velocity = phys.velocity
+		other = Vector(5, 6)
+		phys.set_velocity_v(other)
+		other.set(0, 0)
+		self.assertIs(phys.velocity, velocity)
+		self.assertEqual((velocity.x, velocity.y), (5, 6))
+
+
+class BroadPhaseTests(SimpleTestCase):
+
+	def brute_force(self, entities):
+		"""
+		Every pair whose AABBs overlap once the moving ones grew by their path, tested one by one
+		"""
+		bounds = []
+		for ent in entities:
+			min_x, min_y, max_x, max_y = ent.get_component(Mesh).get_bounds(ent)
+			phys = ent.get_component(Physics)
+			moving = phys is not None and phys.velocity.sqr_length() != 0
+			grow = CollisionSystem.BOUNDS_MARGIN
+			if moving:
+				grow += phys.velocity.length() * CollisionSystem.MAX_SWEEP_PASSES
+			bounds.append((min_x - grow, min_y - grow, max_x + grow, max_y + grow, phys is not None, moving))
+		candidates = {}
+		for index, other in itertools.permutations(range(len(entities)), 2):
+			a, b = bounds[index], bounds[other]
+			if not a[4] or not (a[5] or b[5]):
+				continue
+			if a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]:
+				candidates.setdefault(index, []).append(other)
+		return candidates
+
+	def broad_phase(self, entities):
+		candidates = CollisionSystem().broad_phase(entities)
+		return {index: sorted(others) for index, others in candidates.items()}
+
+	def test_matches_all_pairs(self):
+		rng = random.Random(42)
+		for _ in range(20):
+			entities = []
+			for _ in range(30):
+				mesh = Box(rng.uniform(5, 100), rng.uniform(5, 100)) if rng.random() < 0.5 else Circle(rng.uniform(5, 60))
+				kind = rng.random()
+				if kind < 0.3:
+					velocity = None
+				elif kind < 0.5:
+					velocity = (0, 0)
+				elif kind < 0.9:
+					velocity = (rng.uniform(-20, 20), rng.uniform(-20, 20))
+				else:
+					# faster than any mesh is wide
+					velocity = (rng.uniform(-400, 400), rng.uniform(-400, 400))
+				ent = body(rng.uniform(0, 1000), rng.uniform(0, 1000), mesh, velocity)
+				ent.rotate(rng.choice((0, 45, 90)))
+				entities.append(ent)
+			self.assertEqual(self.broad_phase(entities), self.brute_force(entities))
+
+	def test_fast_mover(self):
+		ball = body(0, 0, Circle(20), (300, 0))
+		paddle = body(800, 0, Box(10, 100))
+		far = body(2000, 0, Box(10, 100))
+		self.assertEqual(self.broad_phase([ball, paddle, far]), {0: [1]})
+
+	def test_touching_boxes(self):
+		left = body(0, 0, Box(10, 10), (0, 0.001))
+		right = body(10, 0, Box(10, 10))
+		corner = body(10, 10, Box(10, 10))
+		self.assertEqual(self.broad_phase([left, right, corner]), {0: [1, 2]})
+
+	def test_resting_bodies_skipped(self):
+		still = body(0, 0, Box(10, 10), (0, 0))
+		wall = body(5, 0, Box(10, 10))
+		self.assertEqual(self.broad_phase([still, wall]), {})
+		moving = body(5, 0, Box(10, 10), (1, 0))
+		# the moving one collides with the resting one and the other way round
+		self.assertEqual(self.broad_phase([still, wall, moving]), {0: [2], 2: [0, 1]})
+
+
+class MeshCacheTests(SimpleTestCase):
+
+	def setUp(self):
+		self.ent = body(0, 0, Box(20, 10))
+		self.mesh = self.ent.get_component(Mesh)
+
+	def points(self):
+		return [(round(p.x, 6), round(p.y, 6)) for p in self.mesh.get_world_points(self.ent)]
+
+	def assertRebuilt(self, mutate, expected):
+		self.points()
+		version = self.ent.version
+		mutate()
+		self.assertGreater(self.ent.version, version)
+		self.assertEqual(self.points(), expected)
+		bounds = tuple(round(bound, 6) for bound in self.mesh.get_bounds(self.ent))
+		self.assertEqual(bounds, (min(x for x, _ in expected), min(y for _, y in expected), max(x for x, _ in expected), max(y for _, y in expected)))
+
+	def test_position_setter(self):
+		def mutate():
+			self.ent.position = Vector(5, 5)
+		self.assertRebuilt(mutate, [(-5, 10), (15, 10), (15, 0), (-5, 0)])
+
+	def test_move(self):
+		self.assertRebuilt(lambda: self.ent.move(1, 2), [(-9, 7), (11, 7), (11, -3), (-9, -3)])
+
+	def test_set_pos(self):
+		self.assertRebuilt(lambda: self.ent.set_pos(100, 0), [(90, 5), (110, 5), (110, -5), (90, -5)])
+
+	def test_rotate(self):
+		self.assertRebuilt(lambda: self.ent.rotate(90), [(-5, -10), (-5, 10), (5, 10), (5, -10)])
+		edges = self.mesh.get_world_edges(self.ent)
+		self.assertEqual([(round(edge.dir.x, 6), round(edge.dir.y, 6)) for edge in edges], [(0, 20), (10, 0), (0, -20), (-10, 0)])
+
+	def test_cached_until_changed(self):
+		points = self.mesh.get_world_points(self.ent)
+		first = points[0]
+		self.assertIs(self.mesh.get_world_points(self.ent)[0], first)
+		self.assertEqual(self.mesh.cached_version, self.ent.version)
+		# another transform with the same version is not mistaken for the cached one
+		other = Entity(50, 0)
+		other.version = self.ent.version
+		self.assertEqual(self.mesh.get_world_points(other)[0].x, 40)
+
+
+class TimeOfImpactTests(SimpleTestCase):
+
+	def toi(self, box, center, radius, displacement):
+		mesh = box.get_component(Mesh)
+		mesh.update_world_cache(box)
+		return time_of_impact(Vector(*center), radius, Vector(*displacement), mesh.world_edges, mesh.world_normals)
+
+	def collide(self, ball, box):
+		hits = []
+		def bounce(other, point=None):
+			hits.append(other)
+			ball.get_component(Physics).velocity.x *= -1
+		ball.on_collision = bounce
+		CollisionSystem().execute([ball, box])
+		return hits
+
+	def test_head_on(self):
+		box = body(100, 0, Box(20, 100))
+		self.assertAlmostEqual(self.toi(box, (0, 0), 10, (200, 0)), 0.4)
+		self.assertIsNone(self.toi(box, (0, 0), 10, (-200, 0)))
+		self.assertIsNone(self.toi(box, (0, 0), 10, (50, 0)))
+
+	def test_corner(self):
+		box = body(0, 0, Box(20, 20))
+		# the face of the left edge is reached first, but beside the edge, the corner gets hit later
+		expected = (20 * math.sqrt(2) - 5) / (30 * math.sqrt(2))
+		self.assertAlmostEqual(self.toi(box, (-30, -30), 5, (30, 30)), expected)
+
+	def test_grazing_miss(self):
+		box = body(0, 0, Box(20, 20))
+		self.assertIsNone(self.toi(box, (-50, -15.5), 5, (100, 0)))
+		self.assertIsNotNone(self.toi(box, (-50, -14.5), 5, (100, 0)))
+
+	def test_starting_in_contact(self):
+		box = body(0, 0, Box(20, 20))
+		# overlapping by less than CONTACT_SLOP: only a collision while closing in
+		touching_x = -15 + CollisionSystem.CONTACT_SLOP / 2
+		self.assertEqual(self.collide(body(touching_x, 0, Circle(10), (1, 0)), box), [box])
+		self.assertEqual(self.collide(body(touching_x, 0, Circle(10), (-1, 0)), box), [])
+		# deeper than that it is pushed out whichever way it moves
+		ball = body(-14, 0, Circle(10), (-1, 0))
+		self.assertIn(box, self.collide(ball, box))
+		self.assertLessEqual(ball.position.x, -15 + CollisionSystem.CONTACT_SLOP)
+
+	def test_no_tunnelling(self):
+		paddle = body(100, 0, Box(10, 100))
+		ball = body(0, 0, Circle(20), (500, 0))
+		self.assertAlmostEqual(self.toi(paddle, (0, 0), 10, (500, 0)), 85 / 500)
+		self.assertEqual(self.collide(ball, paddle), [paddle])
+		self.assertAlmostEqual(ball.position.x, 85, delta=CollisionSystem.CONTACT_SLOP * 2)
+		self.assertEqual(ball.position.y, 0)
+
+
+class PongProtocolTests(SimpleTestCase):
+
+	def round_trip(self, *messages):
+		return PongProtocol.decode_frame(PongProtocol.encode_frame(messages))
+
+	def test_update_and_set_pos(self):
+		decoded = self.round_trip(
+			PongProtocol.encode_update_pos(7, 640.0, 390.0, 0),
+			PongProtocol.encode_set_pos(70000, 12.3456, -20.3, 22.5),
+		)
+		self.assertEqual(decoded[0], ('up', 7, 640.0, 390.0, 0.0))
+		kind, id, x, y, rotation = decoded[1]
+		self.assertEqual((kind, id, rotation), ('sp', 70000, 22.5))
+		self.assertAlmostEqual(x, 12.3456, delta=0.5 / PongProtocol.POSITION_SCALE)
+		self.assertAlmostEqual(y, -20.3, delta=0.5 / PongProtocol.POSITION_SCALE)
+
+	def test_events(self):
+		decoded = self.round_trip(
+			PongProtocol.encode_set_score(3, 11),
+			PongProtocol.encode_round_start(),
+			PongProtocol.encode_game_over(),
+			PongProtocol.encode_disconnect(4),
+		)
+		self.assertEqual(decoded, [('ss', 3, 11), ('rs',), ('go',), ('dc', 4)])
+
+	def test_rotation_wraps(self):
+		decoded = self.round_trip(PongProtocol.encode_update_pos(1, 0, 0, -90))
+		self.assertEqual(decoded[0][4], 270.0)
+		decoded = self.round_trip(PongProtocol.encode_update_pos(1, 0, 0, 359.999))
+		self.assertEqual(decoded[0][4], 0.0)
+
+	def test_positions_are_clamped(self):
+		decoded = self.round_trip(PongProtocol.encode_update_pos(1, 1e6, -1e6, 0))
+		self.assertEqual(decoded[0][2:4], (PongProtocol.POSITION_MAX, PongProtocol.POSITION_MIN))
+
+	def test_frame_size(self):
+		frame = PongProtocol.encode_frame([PongProtocol.encode_update_pos(1, 640.123456789, 390.987654321, 0)])
+		self.assertEqual(len(frame), 20)
+
+	def test_header(self):
+		frame = PongProtocol.encode_frame([PongProtocol.encode_round_start()], 120, 1920.4)
+		self.assertEqual(PongProtocol.decode_header(frame), (120, 1920))
+		self.assertEqual(PongProtocol.decode_frame(frame), [('rs',)])
+		self.assertEqual(PongProtocol.decode_header(PongProtocol.encode_frame([])), (0, 0))
+
+	def test_delta(self):
+		previous = PongProtocol.quantize_transform(25, 390, 0)
+		current = PongProtocol.quantize_transform(25, 410.5, 0)
+		delta = PongProtocol.encode_delta(9, previous, current)
+		self.assertEqual(len(delta), 8)
+		self.assertEqual(self.round_trip(delta), [('dt', 9, None, 410.5, None, False)])
+		full = PongProtocol.encode_delta(9, None, current, snap=True)
+		self.assertEqual(self.round_trip(full), [('dt', 9, 25.0, 410.5, 0.0, True)])
+
+	def test_delta_below_grid_is_empty(self):
+		previous = PongProtocol.quantize_transform(100, 100, 90)
+		current = PongProtocol.quantize_transform(100.01, 100, 90.001)
+		self.assertEqual(PongProtocol.encode_delta(1, previous, current), b'')
+
+	def test_ball_state(self):
+		decoded = self.round_trip(PongProtocol.encode_ball_state(5, 640, 390, -1250.1, 312.5))
+		self.assertEqual(decoded, [('bs', 5, 640.0, 390.0, -1250.0, 312.5)])
+
+	def test_invalid_frames(self):
+		with self.assertRaises(PongProtocol.ProtocolError):
+			PongProtocol.decode_frame(b'')
+		with self.assertRaises(PongProtocol.ProtocolError):
+			PongProtocol.decode_frame(bytes([PongProtocol.PROTOCOL_VERSION + 1]) + PongProtocol.encode_frame([])[1:])
+		with self.assertRaises(PongProtocol.ProtocolError):
+			PongProtocol.decode_frame(PongProtocol.encode_frame([]) + bytes([255]))
+		truncated = PongProtocol.encode_frame([PongProtocol.encode_update_pos(1, 2, 3, 4)])[:-1]
+		with self.assertRaises(PongProtocol.ProtocolError):
+			PongProtocol.decode_frame(truncated)
+
+
+class SnapshotsTests(SimpleTestCase):
+
+	def setUp(self):
+		self.snapshots = Snapshots()
+		self.paddle = Entity(25, 390)
+		self.paddle.add_component(Mesh, Box(25, 250))
+		self.paddle.rotate(90)
+		self.clients = ['a', 'b']
+
+	def decode(self, frames):
+		return [(PongProtocol.decode_frame(frame), consumers) for frame, consumers in frames]
+
+	def test_only_changed_fields(self):
+		self.snapshots.frames([(self.paddle, False)], [self.paddle], self.clients)
+		self.paddle.set_pos(25, 400)
+		frames = self.decode(self.snapshots.frames([(self.paddle, False)], [self.paddle], self.clients))
+		self.assertEqual(frames, [([('dt', self.paddle.id, None, 400.0, None, False)], self.clients)])
+
+	def test_nothing_sent_without_change(self):
+		self.snapshots.frames([(self.paddle, False)], [self.paddle], self.clients)
+		self.assertEqual(self.snapshots.frames([(self.paddle, False)], [self.paddle], self.clients), [])
+		self.assertEqual(self.snapshots.frames([], [self.paddle], self.clients), [])
+
+	def test_requested_keyframe(self):
+		self.snapshots.frames([(self.paddle, False)], [self.paddle], self.clients)
+		self.snapshots.request_keyframe('b')
+		self.paddle.set_pos(25, 400)
+		frames = self.decode(self.snapshots.frames([(self.paddle, True)], [self.paddle], self.clients))
+		self.assertEqual(frames, [
+			([('dt', self.paddle.id, None, 400.0, None, True)], ['a']),
+			([('kf',), ('sp', self.paddle.id, 25.0, 400.0, 90.0)], ['b']),
+		])
+		self.assertEqual(self.snapshots.frames([], [self.paddle], self.clients), [])
+
+	def test_ball_state_moves_baseline(self):
+		self.snapshots.frames([(self.paddle, False)], [self.paddle], self.clients)
+		self.paddle.set_pos(30, 400)
+		state = self.snapshots.encode_ball_state(self.paddle, 100, 0)
+		frames = self.decode(self.snapshots.frames([], [self.paddle], self.clients, [state]))
+		self.assertEqual(frames, [([('bs', self.paddle.id, 30.0, 400.0, 100.0, 0.0)], self.clients)])
+		self.paddle.set_pos(30, 410)
+		frames = self.decode(self.snapshots.frames([(self.paddle, False)], [self.paddle], self.clients))
+		self.assertEqual(frames, [([('dt', self.paddle.id, None, 410.0, None, False)], self.clients)])
+
+	def test_periodic_keyframe(self):
+		for _ in range(Snapshots.KEYFRAME_INTERVAL - 1):
+			self.snapshots.frames([], [self.paddle], self.clients)
+		frames = self.decode(self.snapshots.frames([], [self.paddle], self.clients))
+		self.assertEqual(frames, [([('kf',), ('up', self.paddle.id, 25.0, 390.0, 90.0)], self.clients)])
+
+
+class ReplayTests(SimpleTestCase):
+
+	def test_round_trip(self):
+		replay = Replay(4, 'numpy', 0.008, seed=7)
+		replay.record(0, 0, 1)
+		replay.record(0, 3, 2)
+		replay.record(200, 1, 0)
+		replay.record(70000, 2, 1)
+		replay.finish(70001, [2, 0, 0, 1])
+		data = replay.encode()
+		decoded = Replay.decode(data)
+		self.assertEqual(decoded.inputs, replay.inputs)
+		self.assertEqual((decoded.player_count, decoded.backend, decoded.tick_interval, decoded.seed), (4, 'numpy', 0.008, 7))
+		self.assertEqual((decoded.ticks, decoded.scores), (70001, [2, 0, 0, 1]))
+		self.assertEqual(len(data), 23 + 8 + 4 + 2 + 2 + 3 + 4)
+
+	def test_invalid(self):
+		with self.assertRaises(ReplayError):
+			Replay.decode(b'nope')
+		data = Replay(2).encode()
+		with self.assertRaises(ReplayError):
+			Replay.decode(b'XXXX' + data[4:])
+		replay = Replay(2)
+		replay.record(5, 1, 2)
+		with self.assertRaises(ReplayError):
+			Replay.decode(replay.encode()[:-1])
+
+
+class MatchOutboxTests(SimpleTestCase):
+
+	def deliver(self, results, failures=0, failing=None, redis=None):
+		"""
+		Puts results into an outbox, returns the payloads gamehub got. The first failures posts fail,
+		or the first failures posts of the result failing if it is set
+		"""
+		posted = []
+		failed = []
+		def post(payload):
+			data = json.loads(payload)
+			if len(failed) < failures and (failing is None or data == failing):
+				failed.append(data)
+				raise ConnectionError('gamehub is down')
+			posted.append(data)
+
+		async def run():
+			outbox = MatchOutbox(asyncio.get_running_loop(), redis=redis, post=post)
+			outbox.MIN_BACKOFF = 0
+			for data in results:
+				outbox.put(data)
+			while outbox.pending:
+				await asyncio.sleep(0.001)
+			outbox.task.cancel()
+			return outbox
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.outbox = asyncio.run(run())
+		return posted
+
+	def tournament(self, home, away, status='running'):
+		return {'lobby_id': 1, 'type': 'tournament', 'match_id': 2, 'home_score': home, 'away_score': away, 'status': status}
+
+	def test_running_scores_coalesce(self):
+		posted = self.deliver([self.tournament(1, 0), self.tournament(2, 0), self.tournament(3, 1, 'finished')])
+		self.assertEqual(posted, [self.tournament(3, 1, 'finished')])
+
+	def test_matches_do_not_coalesce(self):
+		match = {'lobby_id': 1, 'type': 'match', 'home_username': 'a', 'away_username': 'b', 'home_score': 3, 'away_score': 0}
+		self.assertEqual(self.deliver([match, match]), [match, match])
+
+	def test_retry(self):
+		self.assertEqual(self.deliver([self.tournament(3, 1, 'finished')], failures=2), [self.tournament(3, 1, 'finished')])
+
+	def test_failed_result_does_not_block(self):
+		stuck = self.tournament(3, 1, 'finished')
+		match = {'lobby_id': 4, 'type': 'match', 'home_username': 'a', 'away_username': 'b', 'home_score': 3, 'away_score': 0}
+		self.assertEqual(self.deliver([stuck, match], failures=3, failing=stuck), [match, stuck])
+
+	def test_acked_results_leave_redis(self):
+		redis = FakeRedis()
+		self.deliver([self.tournament(3, 1, 'finished')], redis=redis)
+		self.assertEqual(redis.data[self.outbox.hash_key], {})
+		self.assertIn(self.outbox.lease_key, redis.data)
+
+	def test_recover_claims_once(self):
+		from .MatchOutbox import OUTBOX_KEY
+		dead = self.tournament(1, 0)
+		alive = self.tournament(2, 0)
+		alive['lobby_id'] = 9
+		redis = FakeRedis({
+			f'{OUTBOX_KEY}:dead': {'tournament_1_2': json.dumps(dead)},
+			f'{OUTBOX_KEY}:alive': {'tournament_9_2': json.dumps(alive)},
+			f'{OUTBOX_KEY}:alive:lease': 1,
+		})
+
+		async def run():
+			outboxes = [MatchOutbox(asyncio.get_running_loop(), redis=redis) for _ in range(2)]
+			await asyncio.gather(*(outbox.recover() for outbox in outboxes))
+			return [outbox.pending for outbox in outboxes]
+		pending = asyncio.run(run())
+		self.assertEqual(sorted(len(claimed) for claimed in pending), [0, 1])
+		self.assertIn({'tournament_1_2': json.dumps(dead)}, pending)
+		self.assertNotIn(f'{OUTBOX_KEY}:dead', redis.data)
+		self.assertIn(f'{OUTBOX_KEY}:alive', redis.data)
+
+	def test_recover_when_the_scheduler_starts(self):
+		from .GameScheduler import GameScheduler
+		from .MatchOutbox import OUTBOX_KEY
+		dead = self.tournament(3, 1, 'finished')
+		redis = FakeRedis({f'{OUTBOX_KEY}:dead': {'tournament_1_2': json.dumps(dead)}})
+		posted = []
+
+		async def run():
+			saved = GameScheduler.instance, MatchOutbox.instance
+			try:
+				with fake_redis(redis):
+					GameScheduler.get()
+				outbox = MatchOutbox.instance
+				outbox.post = posted.append
+				for _ in range(1000):
+					if posted:
+						break
+					await asyncio.sleep(0.001)
+				outbox.task.cancel()
+			finally:
+				GameScheduler.instance, MatchOutbox.instance = saved
+		with contextlib.redirect_stdout(io.StringIO()):
+			asyncio.run(run())
+		self.assertEqual([json.loads(payload) for payload in posted], [dead])
+
+
+class StalledClient:
+	"""
+	Consumer whose sends wait until release is set
+	"""
+	def __init__(self):
+		self.user = type('User', (), {'username': 'stalled'})
+		self.release = asyncio.Event()
+		self.sent = []
+		self.closed = False
+
+	async def send(self, text_data=None, bytes_data=None):
+		await self.release.wait()
+		self.sent.append(text_data if text_data is not None else bytes_data)
+
+	async def close(self):
+		self.closed = True
+
+
+class SendQueueTests(SimpleTestCase):
+
+	def run_queue(self, fill):
+		async def run():
+			client = StalledClient()
+			dropped = []
+			queue = SendQueue(client, asyncio.get_running_loop(), dropped.append)
+			fill(queue)
+			await asyncio.sleep(0)
+			client.release.set()
+			while queue.task is not None:
+				await asyncio.sleep(0)
+			await asyncio.sleep(0)
+			return client, dropped
+		with contextlib.redirect_stdout(io.StringIO()):
+			return asyncio.run(run())
+
+	def test_in_order(self):
+		def fill(queue):
+			queue.put(text_data='world')
+			for i in range(3):
+				queue.put_frame(bytes([i]))
+		client, dropped = self.run_queue(fill)
+		self.assertEqual(client.sent, ['world', b'\x00', b'\x01', b'\x02'])
+		self.assertEqual(dropped, [])
+
+	def test_stale_frames_dropped(self):
+		def fill(queue):
+			for i in range(SendQueue.FRAME_LIMIT + 1):
+				queue.put_frame(bytes([i]))
+				if i == 3:
+					queue.put(text_data='score')
+			queue.put_frame(b'after')
+		client, dropped = self.run_queue(fill)
+		self.assertEqual(client.sent, ['score', b'after'])
+		self.assertEqual(dropped, [client])
+
+	def test_stalled_client_closed(self):
+		def fill(queue):
+			for i in range(SendQueue.LIMIT + 1):
+				queue.put(text_data=str(i))
+		client, dropped = self.run_queue(fill)
+		self.assertTrue(client.closed)
+		self.assertEqual(client.sent, [])
+
+	def run_acked(self, fill):
+		"""
+		fill(queue, drain) with a client that takes every message, drain() waits until the queue is empty
+		"""
+		async def run():
+			client = StalledClient()
+			client.release.set()
+			dropped = []
+			queue = SendQueue(client, asyncio.get_running_loop(), dropped.append)
+
+			async def drain():
+				while queue.task is not None:
+					await asyncio.sleep(0)
+			await fill(queue, drain)
+			await drain()
+			return client, dropped
+		with contextlib.redirect_stdout(io.StringIO()):
+			return asyncio.run(run())
+
+	def test_unacked_frames_dropped(self):
+		async def fill(queue, drain):
+			# frames before the first ack are not counted
+			queue.put_frame(b'first', 1)
+			queue.ack(1)
+			for tick in range(2, SendQueue.ACK_WINDOW + 2):
+				queue.put_frame(bytes([tick]), tick)
+				await drain()
+			queue.put(text_data='score')
+			queue.put_frame(b'late', 100)
+		client, dropped = self.run_acked(fill)
+		self.assertEqual(len(client.sent), SendQueue.ACK_WINDOW + 2)
+		self.assertEqual(client.sent[-1], 'score')
+		self.assertEqual(dropped, [client])
+
+	def test_ack_opens_window(self):
+		async def fill(queue, drain):
+			queue.ack(0)
+			for tick in range(1, SendQueue.ACK_WINDOW + 1):
+				queue.put_frame(bytes([tick]), tick)
+				await drain()
+			queue.ack(4)
+			self.assertEqual(len(queue.unacked), SendQueue.ACK_WINDOW - 4)
+			queue.put_frame(b'more', 17)
+		client, dropped = self.run_acked(fill)
+		self.assertEqual(dropped, [])
+		self.assertEqual(client.sent[-1], b'more')
+
+	def test_end_sends_queued(self):
+		def fill(queue):
+			queue.put_frame(b'frame')
+			queue.put(text_data='game over')
+			queue.end()
+			queue.put(text_data='ignored')
+		client, dropped = self.run_queue(fill)
+		self.assertEqual(client.sent, [b'frame', 'game over'])
+		self.assertTrue(client.closed)
+
+
+class HeadlessMatchTests(SimpleTestCase):
+
+	def play(self, ticks, script=None, idle=True, players=2, backend='python'):
+		from .PongHeadless import HeadlessMatch, HeadlessScheduler, alternating_inputs
+
+		async def run():
+			scheduler = HeadlessScheduler(asyncio.get_running_loop())
+			if not idle:
+				scheduler.max_idle_ticks = 0
+			match_type = 'match' if players == 2 else 'multiple'
+			match = HeadlessMatch(players, script=script or alternating_inputs, scheduler=scheduler, backend=backend, match_type=match_type)
+			with contextlib.redirect_stdout(io.StringIO()):
+				await match.start()
+				for _ in range(ticks):
+					await match.step()
+			return match
+		return asyncio.run(run())
+
+	def state(self, match):
+		return [(type(ent).__name__, ent.position.x, ent.position.y, ent.rotation) for ent in match.game.world.entities]
+
+	def test_deterministic(self):
+		first = self.play(400)
+		second = self.play(400)
+		self.assertEqual(self.state(first), self.state(second))
+		self.assertEqual([event['type'] for event in first.io.events], [event['type'] for event in second.io.events])
+		# entity ids are counted per process, so only the number of messages has to match
+		self.assertEqual([client.frames for client in first.clients], [client.frames for client in second.clients])
+
+	def test_backends_agree(self):
+		for players in (2, 4):
+			python = self.play(600, players=players)
+			batch = self.play(600, players=players, backend='numpy')
+			self.assertEqual([event['type'] for event in python.io.events], [event['type'] for event in batch.io.events])
+			for (kind, x, y, rotation), other in zip(self.state(python), self.state(batch)):
+				self.assertEqual(kind, other[0])
+				self.assertAlmostEqual(x, other[1], places=6)
+				self.assertAlmostEqual(y, other[2], places=6)
+				self.assertAlmostEqual(rotation, other[3], places=6)
+
+	def test_replay(self):
+		from .PongHeadless import play_replay
+		match = self.play(400)
+		self.assertGreater(len(match.game.replay.inputs), 0)
+		replay = Replay.decode(match.game.replay.encode())
+		with contextlib.redirect_stdout(io.StringIO()):
+			replayed = asyncio.run(play_replay(replay, 400))
+		self.assertEqual(self.state(replayed), self.state(match))
+
+	def test_inputs_move_paddles(self):
+		match = self.play(30)
+		player = match.clients[0].player_c
+		self.assertNotEqual(player.position.y, player.start_pos.y)
+		self.assertGreater(match.clients[0].frames, 0)
+
+	def test_sampled_metrics(self):
+		from prometheus_client import REGISTRY
+
+		def sample(name, labels=None):
+			return REGISTRY.get_sample_value(name, labels) or 0
+		ticks = sample('gameloop_ticks_total')
+		sampled = sample('gameloop_tick_seconds_count')
+		movement = sample('gameloop_system_seconds_count', {'system': 'MovementSystem'})
+		with self.settings(GAME_PROFILE_INTERVAL=10):
+			match = self.play(30)
+		self.assertEqual(sample('gameloop_ticks_total') - ticks, 30)
+		# one tick in GAME_PROFILE_INTERVAL is measured
+		self.assertEqual(sample('gameloop_tick_seconds_count') - sampled, 3)
+		self.assertEqual(sample('gameloop_system_seconds_count', {'system': 'MovementSystem'}) - movement, 3)
+		self.assertIsNone(match.game.world.profiler)
+
+	def test_world_state(self):
+		match = self.play(60)
+		game = match.game
+		records = game.world_state().split('\n')
+		entities = game.world.entities
+		self.assertEqual(records[len(entities)], 'ne;-1;complete;0;0;0;0')
+		self.assertEqual([record.split(';')[1] for record in records[:len(entities)]], [str(ent.id) for ent in entities])
+		moved = {record.split(';')[1]: record.split(';')[2:] for record in records[len(entities) + 1:]}
+		player = match.clients[0].player_c
+		self.assertEqual(moved[str(player.id)], [str(player.position.x), str(player.position.y), str(player.rotation)])
+		self.assertTrue(game.world_state().startswith(game.static_state))
+
+	def test_idle_ticks_change_nothing(self):
+		# short key presses with long pauses, so the game is idle in most countdowns
+		def taps(tick, seat):
+			return {10: 1, 25: 0, 400: 2, 410: 0}.get((tick + seat * 300) % 600)
+		idle = self.play(1500, taps)
+		full = self.play(1500, taps, idle=False)
+		self.assertLess(idle.scheduler.ticks, full.scheduler.ticks)
+		self.assertEqual(self.state(idle), self.state(full))
+		self.assertEqual(idle.game.replay.inputs, full.game.replay.inputs)
+		self.assertEqual(idle.scores(), full.scores())
+
+	def test_spectators_share_frames(self):
+		from .PongHeadless import HeadlessMatch, HeadlessClient, HeadlessScheduler, alternating_inputs
+
+		class Spectator(HeadlessClient):
+			async def send(self, text_data=None, bytes_data=None):
+				await super().send(text_data, bytes_data)
+				if bytes_data is not None:
+					self.sent.append(bytes_data)
+
+		async def run():
+			match = HeadlessMatch(2, script=alternating_inputs, scheduler=HeadlessScheduler(asyncio.get_running_loop()))
+			spectators = [Spectator(index, 'match') for index in (10, 11)]
+			for spectator in spectators:
+				spectator.sent = []
+			with contextlib.redirect_stdout(io.StringIO()):
+				await match.start()
+				for spectator in spectators:
+					match.game.add_spectator(spectator)
+				for _ in range(200):
+					await match.step()
+				await asyncio.sleep(0)
+			return match, spectators
+		with self.settings(GAME_SPECTATOR_RATE=10):
+			match, spectators = asyncio.run(run())
+		game = match.game
+		self.assertGreater(game.spectator_every, game.send_every)
+		self.assertEqual(game.spectator_every % game.send_every, 0)
+		first, second = spectators
+		# the score frame each spectator got on join, then the shared frames
+		self.assertGreater(len(first.sent), 1)
+		self.assertLess(len(first.sent), match.clients[0].frames)
+		self.assertEqual(len(first.sent), len(second.sent))
+		self.assertTrue(all(a is b for a, b in zip(first.sent[1:], second.sent[1:])))
+		game.remove_spectator(first)
+		self.assertNotIn(first, game.queues)
+
+	def watch(self, script, join_at, ticks):
+		"""
+		Plays a match on the countdown of the first round with a spectator that joins at step join_at,
+		returns the match and the transforms the spectator saw, entity id -> (x, y)
+		"""
+		from .PongHeadless import HeadlessMatch, HeadlessScheduler
+
+		async def run():
+			match = HeadlessMatch(2, script=script, scheduler=HeadlessScheduler(asyncio.get_running_loop()))
+			spectator = FakeConsumer(3, 'match_headless')
+			with contextlib.redirect_stdout(io.StringIO()):
+				await match.start()
+				for step in range(ticks):
+					if step == join_at:
+						match.game.add_spectator(spectator)
+					await match.step()
+				for _ in range(3):
+					await asyncio.sleep(0)
+			return match, spectator
+		match, spectator = asyncio.run(run())
+		seen = {}
+		for frame in spectator.sent:
+			for message in frame if isinstance(frame, list) else []:
+				if message[0] in ('up', 'sp'):
+					seen[message[1]] = (message[2], message[3])
+				elif message[0] == 'dt':
+					x, y = seen.get(message[1], (None, None))
+					seen[message[1]] = (x if message[2] is None else message[2], y if message[3] is None else message[3])
+		return match, seen
+
+	def assertSeen(self, match, seen, entity):
+		x, y, _ = PongProtocol.quantize_transform(entity.position.x, entity.position.y, entity.rotation)
+		self.assertEqual(seen.get(entity.id), (x / PongProtocol.POSITION_SCALE, y / PongProtocol.POSITION_SCALE))
+
+	def test_spectator_sees_moves_while_idle(self):
+		# a short tap during the countdown, then the game goes idle until the ball launches
+		for length in range(1, 4):
+			with self.subTest(length=length):
+				match, seen = self.watch(lambda tick, seat: {30: 1, 30 + length: 0}.get(tick) if seat == 0 else None, 0, 40)
+				self.assertIsNotNone(match.game.gameLogic.launch_tick(match.game.ticks))
+				player = match.clients[0].player_c
+				self.assertNotEqual(player.position.y, player.start_pos.y)
+				self.assertSeen(match, seen, player)
+
+	def test_spectator_joins_while_idle(self):
+		for join_at in range(20, 50, 7):
+			with self.subTest(join_at=join_at):
+				match, seen = self.watch(None, join_at, join_at + 6)
+				self.assertIsNotNone(match.game.gameLogic.launch_tick(match.game.ticks))
+				self.assertLess(match.scheduler.ticks, join_at)
+				for client in match.clients:
+					self.assertSeen(match, seen, client.player_c)
+				self.assertSeen(match, seen, match.game.gameLogic.ball)
+
+
+class GameEventTests(SimpleTestCase):
+	"""
+	Events of a PongGame with the GameIO of the server, they go through the SendQueues
+	"""
+	def started(self, run):
+		from .GameIO import GameIO
+		from .PongHeadless import HeadlessMatch, HeadlessClient, HeadlessScheduler
+
+		class Client(HeadlessClient):
+			async def send(self, text_data=None, bytes_data=None):
+				await super().send(text_data, bytes_data)
+				self.sent.append(text_data if text_data is not None else PongProtocol.decode_frame(bytes_data))
+
+		async def main():
+			match = HeadlessMatch(2, scheduler=HeadlessScheduler(asyncio.get_running_loop()))
+			match.game.players = match.clients = [Client(index, 'match') for index in range(2)]
+			for client in match.clients:
+				client.sent = []
+			match.game.io = GameIO(match.game)
+			with contextlib.redirect_stdout(io.StringIO()):
+				await match.start()
+				for _ in range(3):
+					await match.step()
+				await run(match)
+				for _ in range(3):
+					await asyncio.sleep(0)
+			return match
+		return asyncio.run(main())
+
+	def test_names_and_scores_with_the_field(self):
+		match = self.started(lambda match: asyncio.sleep(0))
+		first, second = match.clients
+		records = [message for message in first.sent if isinstance(message, str)]
+		self.assertTrue(records[0].startswith('ne;'))
+		self.assertEqual([record.split(';')[2] for record in records[1:3]], ['1', '2'])
+		self.assertTrue(all(record.endswith(';1') for record in records[1:3]))
+
+	def test_events_behind_frames(self):
+		async def score(match):
+			match.game.send_frames([(PongProtocol.encode_frame([PongProtocol.encode_keyframe()], 5), match.clients)])
+			match.game.io.group_send({'type': 'player_score', 'id': 7, 'score': 3})
+		match = self.started(score)
+		for client in match.clients:
+			self.assertEqual(client.sent[-1], [('ss', 7, 3)])
+			self.assertIn(('kf',), client.sent[-2])
+
+	def test_player_left(self):
+		async def leave(match):
+			await match.game.player_left(match.clients[0])
+		match = self.started(leave)
+		first, second = match.clients
+		self.assertTrue(match.game.stopped)
+		self.assertEqual(second.sent[-1], [('dc', first.player_c.id)])
+		self.assertTrue(second.closed)
+		self.assertFalse(first.closed)
+
+
+class SpectatorTests(SimpleTestCase):
+	GROUP = 'tournament_7_loop_1'
+
+	def validate(self, status, authenticated=True):
+		from django.contrib.auth.models import AnonymousUser
+		from types import SimpleNamespace
+		from .PongConsumer import SpectatorConsumer
+
+		async def run():
+			consumer = SpectatorConsumer()
+			user = SimpleNamespace(id=1, username='watcher', is_authenticated=True) if authenticated else AnonymousUser()
+			consumer.scope = {'url_route': {'kwargs': {'group_name': self.GROUP}}, 'user': user}
+			consumer.read_group_name()
+			matches = json.dumps({'matches': [{'home': 2, 'status': status}]})
+			with fake_redis(FakeRedis({'tournament_7': matches})):
+				return await consumer.validate()
+		return asyncio.run(run())
+
+	def test_validate(self):
+		self.assertTrue(self.validate('pending'))
+		self.assertTrue(self.validate('running'))
+		self.assertFalse(self.validate('finished'))
+		self.assertFalse(self.validate('running', authenticated=False))
+
+	def test_closed_if_the_game_does_not_start(self):
+		from .Pong import GamesHandler
+
+		async def run():
+			handler = GamesHandler(self.GROUP)
+			GamesHandler.game_sessions[self.GROUP] = handler
+			try:
+				await handler.add_consumer(FakeConsumer(1, self.GROUP))
+				spectator = FakeConsumer(3, self.GROUP)
+				with mock.patch.object(GamesHandler, 'SPECTATOR_TIMEOUT', 0):
+					await GamesHandler.add_spectator(spectator, self.GROUP)
+				self.assertFalse(spectator.closed)
+				for _ in range(3):
+					await asyncio.sleep(0)
+				return handler, spectator
+			finally:
+				GamesHandler.game_sessions.pop(self.GROUP)
+		with contextlib.redirect_stdout(io.StringIO()):
+			handler, spectator = asyncio.run(run())
+		self.assertTrue(spectator.closed)
+		self.assertEqual(handler.game.spectators, [])
+
+
+class SessionRegistryTests(SimpleTestCase):
+	GROUP = 'match_5'
+
+	async def registry(self, redis, layer):
+		from .SessionRegistry import SessionRegistry
+		with fake_redis(redis):
+			registry = SessionRegistry()
+		registry.channel_layer = layer
+		registry.channel_name = await layer.new_channel('gameloop')
+		return registry
+
+	def run_nodes(self, run):
+		"""
+		run(redis, first, second) with two registries on one in memory channel layer
+		"""
+		from channels.layers import InMemoryChannelLayer
+
+		async def main():
+			redis = FakeRedis()
+			layer = InMemoryChannelLayer()
+			first = await self.registry(redis, layer)
+			second = await self.registry(redis, layer)
+			with contextlib.redirect_stdout(io.StringIO()):
+				return await run(redis, first, second)
+		return asyncio.run(main())
+
+	def test_claim_and_release(self):
+		async def run(redis, first, second):
+			owners = [await first.claim(self.GROUP), await second.claim(self.GROUP)]
+			await first.release(self.GROUP)
+			owners.append(await second.claim(self.GROUP))
+			return first, second, owners
+		first, second, owners = self.run_nodes(run)
+		self.assertEqual(owners, [first.channel_name, first.channel_name, second.channel_name])
+		self.assertEqual(first.owned, set())
+		self.assertEqual(second.owned, {self.GROUP})
+
+	def test_expired_lease_claimed_again(self):
+		from .utils import session_owner_string
+
+		async def run(redis, first, second):
+			await first.claim(self.GROUP)
+			del redis.data[session_owner_string(self.GROUP)]
+			await first.renew()
+			return first, redis.data[session_owner_string(self.GROUP)]
+		first, owner = self.run_nodes(run)
+		self.assertEqual(owner, first.channel_name)
+		self.assertEqual(first.owned, {self.GROUP})
+
+	def test_lost_lease_stops_session(self):
+		from .Pong import GamesHandler
+		from .utils import session_owner_string
+
+		async def run(redis, first, second):
+			await first.claim(self.GROUP)
+			handler = GamesHandler(self.GROUP)
+			GamesHandler.game_sessions[self.GROUP] = handler
+			consumer = FakeConsumer(1, self.GROUP)
+			await handler.add_consumer(consumer)
+			# the lease ran out and the second node took the session
+			redis.data[session_owner_string(self.GROUP)] = second.channel_name
+			await first.renew()
+			return first, handler, consumer
+		first, handler, consumer = self.run_nodes(run)
+		self.assertNotIn(self.GROUP, GamesHandler.game_sessions)
+		self.assertEqual(first.owned, set())
+		self.assertTrue(consumer.closed)
+		self.assertTrue(handler.game.stopped)
+
+	def test_forwarded_player(self):
+		async def run(redis, owner, node):
+			consumer = FakeConsumer(2, self.GROUP)
+			consumer.channel_name = await node.channel_layer.new_channel('specific.')
+			await node.join_remote(owner.channel_name, consumer)
+			join = await owner.channel_layer.receive(owner.channel_name)
+			consumer.player_c.handle_remote_movement(1)
+			await asyncio.gather(*node.tasks)
+			move = await owner.channel_layer.receive(owner.channel_name)
+			return consumer, join, move
+		consumer, join, move = self.run_nodes(run)
+		self.assertEqual(join['type'], 'seat.join')
+		self.assertEqual((join['uid'], join['channel']), (2, consumer.channel_name))
+		self.assertEqual(move, {'type': 'seat.input', 'input': 1, 'group_name': self.GROUP, 'channel': consumer.channel_name})
+
+	def test_channel_seat(self):
+		from .SessionRegistry import ChannelSeat
+
+		async def run(redis, owner, node):
+			channel = await owner.channel_layer.new_channel('specific.')
+			message = {'channel': channel, 'group_name': self.GROUP, 'match_type': 'match', 'lobby_id': '5', 'match_id': -1, 'uid': 3, 'username': 'remote'}
+			seat = ChannelSeat(owner, message)
+			owner.seats[(self.GROUP, channel)] = seat
+			inputs = []
+			seat.player_c = type('Player', (), {'handle_remote_movement': lambda self, input: inputs.append(input)})()
+			await owner.dispatch({'type': 'seat.input', 'group_name': self.GROUP, 'channel': channel, 'input': 2})
+			await seat.send(bytes_data=b'frame')
+			await seat.close()
+			received = [await owner.channel_layer.receive(channel) for _ in range(2)]
+			return seat, inputs, received
+		seat, inputs, received = self.run_nodes(run)
+		self.assertEqual(seat.user.username, 'remote')
+		self.assertEqual(inputs, [2])
+		self.assertEqual(received, [{'type': 'game.frame', 'text_data': None, 'bytes_data': b'frame'}, {'type': 'game.close'}])
+
+
+class ClockedGame:
+	"""
+	The part of PongGame the GameScheduler uses, counts its ticks
+	"""
+	def __init__(self):
+		self.world = None
+		self.players = []
+		self.next_tick = 0
+		self.idle_since = None
+		self.overruns = 0
+		self.stopped = False
+		self.ticks = 0
+
+	def tick(self):
+		self.ticks += 1
+
+	def idle_ticks(self):
+		return 0
+
+
+class GameSchedulerTests(SimpleTestCase):
+	# a power of two, so the deadlines add up exactly
+	INTERVAL = 1 / 64
+
+	def scheduler(self, *games):
+		from .GameScheduler import GameScheduler
+
+		async def create():
+			return GameScheduler(asyncio.get_running_loop())
+		scheduler = asyncio.run(create())
+		scheduler.tick_interval = self.INTERVAL
+		scheduler.games.extend(games)
+		return scheduler
+
+	def counter(self, name):
+		from prometheus_client import REGISTRY
+		return REGISTRY.get_sample_value(name) or 0
+
+	def test_catches_up(self):
+		game = ClockedGame()
+		scheduler = self.scheduler(game)
+		scheduler.catch_up(2 * self.INTERVAL)
+		self.assertEqual(game.ticks, 3)
+		self.assertEqual(game.next_tick, 3 * self.INTERVAL)
+		self.assertEqual((scheduler.overruns, game.overruns), (0, 0))
+
+	def test_overrun_drops_backlog(self):
+		game = ClockedGame()
+		scheduler = self.scheduler(game)
+		overruns = self.counter('gameloop_tick_overruns_total')
+		dropped = self.counter('gameloop_dropped_ticks_total')
+		# 11 ticks are due, MAX_CATCH_UP_TICKS of them run
+		now = 10 * self.INTERVAL
+		scheduler.catch_up(now)
+		self.assertEqual(game.ticks, scheduler.MAX_CATCH_UP_TICKS)
+		self.assertEqual((scheduler.overruns, game.overruns), (1, 1))
+		self.assertEqual(scheduler.dropped_ticks, 11 - scheduler.MAX_CATCH_UP_TICKS)
+		self.assertEqual(self.counter('gameloop_tick_overruns_total') - overruns, 1)
+		self.assertEqual(self.counter('gameloop_dropped_ticks_total') - dropped, 11 - scheduler.MAX_CATCH_UP_TICKS)
+		# back on the grid of now, the next wake up ticks once
+		self.assertEqual(game.next_tick, now + self.INTERVAL)
+		scheduler.catch_up(now + self.INTERVAL)
+		self.assertEqual(game.ticks, scheduler.MAX_CATCH_UP_TICKS + 1)
+		self.assertEqual(scheduler.overruns, 1)
+
+	def test_stopped_games_do_not_overrun(self):
+		game = ClockedGame()
+		game.stopped = True
+		scheduler = self.scheduler(game)
+		scheduler.catch_up(10 * self.INTERVAL)
+		self.assertEqual((game.ticks, scheduler.overruns), (0, 0))
+
+
+class FrameCoalescingTests(SimpleTestCase):
+	"""
+	Moves of a PongGame between two frames, the client gets one record per entity
+	"""
+	def frame_after(self, moves):
+		"""
+		moves(game, paddle) between two frames, returns the records of the paddle in the next frame
+		"""
+		from .PongHeadless import HeadlessMatch, HeadlessScheduler
+
+		async def run():
+			match = HeadlessMatch(2, scheduler=HeadlessScheduler(asyncio.get_running_loop()))
+			client = match.clients[0]
+			client.frames_sent = []
+			send = client.send
+
+			async def record(text_data=None, bytes_data=None):
+				await send(text_data, bytes_data)
+				if bytes_data is not None:
+					client.frames_sent.append(PongProtocol.decode_frame(bytes_data))
+			client.send = record
+			with contextlib.redirect_stdout(io.StringIO()):
+				await match.start()
+				for _ in range(3):
+					await match.step()
+				game = match.game
+				paddle = client.player_c
+				while game.ticks % game.send_every != game.send_every - 1:
+					game.flush()
+				client.frames_sent.clear()
+				moves(game, paddle)
+				game.flush()
+				for _ in range(3):
+					await asyncio.sleep(0)
+			return paddle, [[record for record in frame if len(record) > 1 and record[1] == paddle.id] for frame in client.frames_sent]
+		return asyncio.run(run())
+
+	def test_moves_coalesce(self):
+		def moves(game, paddle):
+			for y in (300, 310, 320):
+				paddle.set_pos(paddle.position.x, y)
+				game.send_entity_move(paddle)
+			self.assertEqual(len(game.move_tasks), 1)
+		paddle, frames = self.frame_after(moves)
+		self.assertEqual(len(frames), 1)
+		self.assertEqual(frames[0], [('dt', paddle.id, None, 320.0, None, False)])
+
+	def test_snap_stays_snap(self):
+		def moves(game, paddle):
+			paddle.set_pos(paddle.position.x, 200)
+			game.send_entity_set_pos(paddle)
+			paddle.set_pos(paddle.position.x, 210)
+			game.send_entity_move(paddle)
+		paddle, frames = self.frame_after(moves)
+		self.assertEqual(frames, [[('dt', paddle.id, None, 210.0, None, True)]])
+
+
+class InputTests(SimpleTestCase):
+	"""
+	Inputs of a consumer wait for the next tick boundary (PongGame.begin_tick)
+	"""
+	def setUp(self):
+		from .Pong import PongGame
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.game = PongGame(2)
+			self.game.build_field()
+		self.player = self.game.gameLogic.sections[0].player
+
+	def velocity(self):
+		return (self.player.physics.velocity.x, self.player.physics.velocity.y)
+
+	def test_applied_at_tick_boundary(self):
+		self.player.handle_remote_movement(1)
+		self.assertEqual(self.velocity(), (0, 0))
+		self.game.begin_tick()
+		self.assertGreater(self.player.physics.velocity.dot(self.player.up), 0)
+		self.assertIsNone(self.player.next_input)
+
+	def test_latest_input_wins(self):
+		self.player.handle_remote_movement(1)
+		self.player.handle_remote_movement(2)
+		self.game.begin_tick()
+		self.assertLess(self.player.physics.velocity.dot(self.player.up), 0)
+		self.assertEqual([(seat, input) for _, seat, input in self.game.replay.inputs], [(0, 2)])
+
+	def test_invalid_inputs_dropped(self):
+		for input in (3, -1, 'up', None):
+			self.player.handle_remote_movement(input)
+		self.assertIsNone(self.player.next_input)
+		self.game.begin_tick()
+		self.assertEqual(self.velocity(), (0, 0))
+		self.assertEqual(self.game.replay.inputs, [])
+
+
+class GamePoolTests(SimpleTestCase):
+
+	def test_take_and_refill(self):
+		from .GamePool import GamePool
+
+		async def run():
+			pool = GamePool(2, asyncio.get_running_loop())
+			for _ in range(4):
+				await asyncio.sleep(0)
+			ready = [len(pool.games[count]) for count in (2, 4)]
+			first = pool.take(4)
+			second = pool.take(4)
+			third = pool.take(4)
+			for _ in range(4):
+				await asyncio.sleep(0)
+			return ready, [first, second, third], len(pool.games[4])
+		with contextlib.redirect_stdout(io.StringIO()):
+			ready, games, refilled = asyncio.run(run())
+		self.assertEqual(ready, [2, 2])
+		self.assertEqual(refilled, 2)
+		self.assertEqual(len({id(game) for game in games}), 3)
+		for game in games:
+			self.assertEqual(len(game.gameLogic.sections), 4)
+			self.assertIsNotNone(game.static_state)
+
+	def test_finished_game_reused(self):
+		"""
+		A finished game goes back to the pool and plays the same match as a freshly built one
+		"""
+		from .GamePool import GamePool
+		from .PongHeadless import HeadlessMatch, alternating_inputs
+
+		def state(match):
+			return [(type(ent).__name__, ent.position.x, ent.position.y, ent.rotation) for ent in match.game.world.entities]
+
+		async def play(match, ticks):
+			await match.start()
+			for _ in range(ticks):
+				await match.step()
+
+		async def run(backend):
+			pool = GamePool(1, asyncio.get_running_loop())
+			saved = GamePool.instance
+			GamePool.instance = pool
+			try:
+				first = HeadlessMatch(2, script=alternating_inputs, backend=backend)
+				await play(first, 300)
+				first.game.stop()
+				await first.step()
+				game = first.game
+				pool.games[2].clear()
+				game.detach()
+				reused = pool.games[2][-1] is game
+				recycled = HeadlessMatch(2, script=alternating_inputs, backend=backend)
+				recycled.game.world.release()
+				recycled.game = game
+				game.io = recycled.io
+				game.players = recycled.clients
+				fresh = HeadlessMatch(2, script=alternating_inputs, backend=backend)
+				await play(recycled, 1500)
+				await play(fresh, 1500)
+				return reused, recycled, fresh
+			finally:
+				GamePool.instance = saved
+		for backend in ('python', 'numpy'):
+			with self.subTest(backend=backend):
+				with contextlib.redirect_stdout(io.StringIO()):
+					reused, recycled, fresh = asyncio.run(run(backend))
+				self.assertTrue(reused)
+				self.assertNotEqual(fresh.io.events, [])
+				self.assertEqual(state(recycled), state(fresh))
+				self.assertEqual(recycled.scores(), fresh.scores())
+				self.assertEqual([client.frames for client in recycled.clients], [client.frames for client in fresh.clients])
+				self.assertEqual([event['type'] for event in recycled.io.events], [event['type'] for event in fresh.io.events])
+				self.assertEqual([input[1:] for input in recycled.game.replay.inputs], [input[1:] for input in fresh.game.replay.inputs])
+
+
+class FakeConn:
+	def __init__(self):
+		self.sent = []
+
+	def send(self, message):
+		kind, messages = message
+		self.sent.extend(messages)
+
+
+class ShardedGameTests(SimpleTestCase):
+	GROUP = 'tournament_7_0_1'
+
+	def shards(self, conn):
+		"""
+		GameShards of the running event loop with conn as its only shard
+		"""
+		from .GameShards import GameShards
+		shards = GameShards.__new__(GameShards)
+		shards.event_loop = asyncio.get_running_loop()
+		shards.conns = [conn]
+		shards.games = {}
+		shards.outboxes = {}
+		shards.writers = {}
+		shards.sequence = itertools.count()
+		return shards
+
+	def start(self, redis, *uids):
+		"""
+		GamesHandler with the consumers of uids on one fake shard, returns the handler and the shard pipe
+		"""
+		from .GameShards import GameShards
+		from .Pong import GamesHandler
+
+		async def run():
+			shards = self.shards(FakeConn())
+			saved = GameShards.instance
+			GameShards.instance = shards
+			handler = GamesHandler(self.GROUP)
+			GamesHandler.game_sessions[self.GROUP] = handler
+			try:
+				with fake_redis(redis):
+					for uid in uids:
+						await handler.add_consumer(FakeConsumer(uid, self.GROUP))
+				for writer in list(shards.writers.values()):
+					await writer
+			finally:
+				GameShards.instance = saved
+				GamesHandler.game_sessions.pop(self.GROUP)
+			return handler, shards.conns[0]
+		with contextlib.redirect_stdout(io.StringIO()):
+			return asyncio.run(run())
+
+	def tournament(self, home):
+		return {'tournament_7': json.dumps({'matches': [{'home': home, 'status': 'pending'}]})}
+
+	def test_start_on_shard(self):
+		handler, conn = self.start(FakeRedis(self.tournament(2)), 1, 2)
+		self.assertFalse(handler.game.stopped)
+		kind, group_name, count, seats = conn.sent[-1]
+		self.assertEqual((kind, group_name, count), ('start', self.GROUP, 2))
+		# the home player takes the first seat
+		self.assertEqual([seat['uid'] for seat in seats], [2, 1])
+
+	def test_outbox_coalesces_inputs(self):
+		async def run():
+			conn = FakeConn()
+			shards = self.shards(conn)
+			for message in [('start', 'g', 2, []), ('input', 'g', 0, 1), ('input', 'g', 0, 2), ('ack', 'g', 0, 5), ('input', 'g', 1, 1), ('ack', 'g', 0, 7), ('left', 'g', 1)]:
+				shards.post(conn, message)
+			await shards.writers[conn]
+			return conn
+		conn = asyncio.run(run())
+		self.assertEqual(conn.sent, [('start', 'g', 2, []), ('input', 'g', 0, 2), ('ack', 'g', 0, 7), ('input', 'g', 1, 1), ('left', 'g', 1)])
+
+	def test_match_on_shard(self):
+		"""
+		A whole match with the ShardWorker on this event loop, both ends of a real pipe
+		"""
+		import multiprocessing
+		from .GameShards import GameShards, ShardWorker
+		from .Pong import GamesHandler
+		from .PongHeadless import HeadlessScheduler
+		group = 'match_5'
+		posted = []
+
+		async def run():
+			event_loop = asyncio.get_running_loop()
+			conn, shard_conn = multiprocessing.Pipe()
+			scheduler = HeadlessScheduler(event_loop)
+			worker = ShardWorker(0, shard_conn, scheduler)
+			running = event_loop.create_task(worker.run())
+			shards = self.shards(conn)
+			event_loop.add_reader(conn.fileno(), shards.on_readable, conn)
+			saved = GameShards.instance, MatchOutbox.instance
+			GameShards.instance = shards
+			MatchOutbox.instance = MatchOutbox(event_loop, post=posted.append)
+			handler = GamesHandler(group)
+			GamesHandler.game_sessions[group] = handler
+			consumers = [FakeConsumer(uid, group) for uid in (1, 2)]
+			try:
+				for consumer in consumers:
+					await handler.add_consumer(consumer)
+				for step in range(5000):
+					if all(consumer.closed for consumer in consumers) and posted:
+						break
+					if step == 10:
+						# with both paddles in the middle the ball would bounce between them forever
+						consumers[0].player_c.handle_remote_movement(1)
+					scheduler.step()
+					for _ in range(3):
+						for writer in list(shards.writers.values()):
+							await writer
+						await asyncio.sleep(0)
+			finally:
+				event_loop.remove_reader(conn.fileno())
+				conn.close()
+				await running
+				GameShards.instance, MatchOutbox.instance = saved
+				GamesHandler.game_sessions.pop(group)
+			return shards, worker, consumers
+		with self.settings(GAME_SHARDS=1, GAME_POOL_SIZE=0, GAME_REPLAY_DIR=''), contextlib.redirect_stdout(io.StringIO()):
+			shards, worker, consumers = asyncio.run(run())
+		for consumer in consumers:
+			self.assertTrue(consumer.closed)
+			frames = [message for message in consumer.sent if isinstance(message, list)]
+			self.assertIn(('go',), [record for frame in frames for record in frame])
+		self.assertEqual(len(posted), 1)
+		result = json.loads(posted[0])
+		self.assertEqual(result['type'], 'match')
+		self.assertEqual(sorted([result['home_score'], result['away_score']]), [0, 2])
+		self.assertEqual(shards.games, {})
+		# the match ended without a left or stop message
+		self.assertEqual(worker.games, {})
+
+	def test_stopped_while_reading_tournament(self):
+		from .Pong import GamesHandler
+		redis = FakeRedis(self.tournament(1))
+
+		async def leave(key):
+			# the first player leaves while the tournament read is in flight
+			GamesHandler.game_sessions[self.GROUP].game.stop()
+		redis.on_get = leave
+		handler, conn = self.start(redis, 1, 2)
+		self.assertTrue(handler.game.stopped)
+		self.assertNotIn('start', [message[0] for message in conn.sent])
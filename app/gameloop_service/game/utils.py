@@ -5,4 +5,7 @@ def match_lobby_string(lobby_id):
 	return (f"match_{lobby_id}")
 
 def multiple_lobby_string(lobby_id):
-	return (f"multiple_{lobby_id}")
\ No newline at end of file
+	return (f"multiple_{lobby_id}")
+
+def session_owner_string(group_name):
+	return (f"game_session_{group_name}")
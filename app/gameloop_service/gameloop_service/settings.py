@@ -27,7 +27,9 @@ SECRET_KEY = 'django-insecure-10ogm!7$h8+(j@uij5or_s3fgl_%3$+0q9dwb6eea=p9q@7r22
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
-ALLOWED_HOSTS = ['10.13.9.6', 'localhost', '10.13.8.1']
+ALLOWED_HOSTS = ['10.13.9.6', 'localhost', '10.13.8.1', 'gameloop-daphne', 'gameloop-service']
+
+PROMETHEUS_METRIC_NAMESPACE = "gameloopservice"
 
 
 # Application definition
@@ -42,9 +44,11 @@ INSTALLED_APPS = [
     'channels',
     'rest_framework',
     'rest_framework_simplejwt',
+	'django_prometheus',
 ]
 
 MIDDLEWARE = [
+	'django_prometheus.middleware.PrometheusBeforeMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +57,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
-
+	'django_prometheus.middleware.PrometheusAfterMiddleware',
 ]
 
 ROOT_URLCONF = 'gameloop_service.urls'
@@ -138,6 +142,29 @@ CSRF_TRUSTED_ORIGINS = ['http://localhost:8090']
 
 ASGI_APPLICATION = "gamehub_service.asgi.application"
 
+# 'python' or 'numpy' (struct of arrays batch physics, see game/BatchSystem.py)
+GAME_PHYSICS_BACKEND = os.getenv('GAME_PHYSICS_BACKEND', 'python')
+# number of game simulation processes, 0 runs the games in the daphne process (see game/GameShards.py)
+GAME_SHARDS = int(os.getenv('GAME_SHARDS', '0'))
+# share game sessions between several gameloop instances through redis (see game/SessionRegistry.py)
+GAME_SESSION_REGISTRY = os.getenv('GAME_SESSION_REGISTRY', 'false').lower() in ('1', 'true', 'yes')
+# simulation ticks per second, game speeds are scaled so the rules do not change (see game/GameScheduler.py)
+GAME_TICK_RATE = float(os.getenv('GAME_TICK_RATE', '62.5'))
+# frames per second sent to the clients, 0 sends a frame after every tick (see game/Pong.py)
+GAME_SEND_RATE = float(os.getenv('GAME_SEND_RATE', '0'))
+# 'ticks' sends the ball every tick, 'events' only on launch, collision and reset, clients extrapolate (see game/Pong.py)
+GAME_BALL_SYNC = os.getenv('GAME_BALL_SYNC', 'ticks')
+# directory the input replays of finished matches are written to, empty disables them (see game/PongReplay.py)
+GAME_REPLAY_DIR = os.getenv('GAME_REPLAY_DIR', '')
+# one tick in GAME_PROFILE_INTERVAL of every game is timed for the prometheus metrics, 0 disables it (see game/GameMetrics.py)
+GAME_PROFILE_INTERVAL = int(os.getenv('GAME_PROFILE_INTERVAL', '10'))
+# ticks per second of a game in which nothing can change (countdown, no key pressed), 0 ticks it at the full rate (see game/GameScheduler.py)
+GAME_IDLE_RATE = float(os.getenv('GAME_IDLE_RATE', '4'))
+# games per player count that are built ahead of time so a match starts without building its field, 0 disables the pool (see game/GamePool.py)
+GAME_POOL_SIZE = int(os.getenv('GAME_POOL_SIZE', '4'))
+# frames per second of the shared stream of spectators (ws/game/watch/), rounded to a multiple of the player send interval (see game/Pong.py)
+GAME_SPECTATOR_RATE = float(os.getenv('GAME_SPECTATOR_RATE', '20'))
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
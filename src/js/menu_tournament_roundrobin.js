@@ -121,7 +121,7 @@ function displayMatches(response)
             score = match.score_home + ":" + match.score_away;
         let status = match.status;
 
-        addMatchItem(tournamentMatchesList, player_home, player_away, score, status);
+        addMatchItem(tournamentMatchesList, player_home, player_away, score, status, match.match_id);
     }
 }
 
@@ -151,7 +151,7 @@ function addRowToStandingsTable(rank, player, games, wins, losses, goals, diff,
     tableBody.appendChild(row);
 }
 
-function addMatchItem(tournamentMatchesList, player_home, player_away, score, status) {
+function addMatchItem(tournamentMatchesList, player_home, player_away, score, status, match_id) {
 
     if (!tournamentMatchesList)
         return;
@@ -186,6 +186,10 @@ function addMatchItem(tournamentMatchesList, player_home, player_away, score, st
     {
         item = '<div class="pong-loader"><span class="ball"></span></div>'
         li.classList.add('lava-lamp');
+        // a running match can be watched, the gameloop group of a tournament match is tournament_<lobby>_loop_<match>
+        li.style.cursor = 'pointer';
+        li.title = 'Watch';
+        li.addEventListener('click', () => renderPong(`tournament_${g_lobbyId}_loop_${match_id}`, true));
     }
 
     let free_color_home = '';
@@ -226,9 +230,12 @@ function closeWebsocket() {
 }
 
 let g_socket;
+let g_lobbyId;
 
 export function renderMenuTournamentRoundRobin(lobbyId) {
 
+    g_lobbyId = lobbyId;
+
     const app = document.getElementById('app');
 
     app.innerHTML = `
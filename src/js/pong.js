@@ -1,12 +1,13 @@
 import {Vector, Plane, World, Entity, Mesh, Physics, Ray, Box, Circle, RenderSystem, CollisionSystem, MovementSystem, canvas, drawText, strokeText, drawLine, drawDot} from './GameSystem.js';
 import { showSection } from './index.js';
 import { startGame, useCountdownAsMessageDisplay } from './utils.js';
+import { decodeFrame, frameHeader } from './pong_protocol.js';
 
 const PLAYER_MOVE_SPEED = 20;
 const BALL_MOVE_SPEED = 20;
 const VECTOR_CENTER = new Vector(canvas.width * 0.5, canvas.height * 0.5);
 
-export function renderPong(match_id) {
+export function renderPong(match_id, spectate = false) {
 
 	const app = document.getElementById('app');
 	if (app)
@@ -24,7 +25,7 @@ export function renderPong(match_id) {
 		const canvasContainer = document.getElementById('canvasContainer');
 
 		canvasContainer.appendChild(canvas);
-		selectGamemode(match_id);
+		selectGamemode(match_id, spectate);
 	}
 }
 
@@ -472,13 +473,26 @@ function lerp(start, end, t) {
 }
 
 class RemoteHandler extends Entity{
-	constructor(){
+	constructor(spectate = false){
 		super(0, 0);
 		this.entities = {};
 		this.players = {};
 		this.complete = false;
-		window.addEventListener('keydown', sendMovementInput);
-		window.addEventListener('keyup', sendMovementInput);
+		// id -> ball state from the server, extrapolated every frame
+		this.ballStates = {};
+		// id -> [{time, x, y}], positions of the last server frames, rendered two frame intervals behind
+		this.tracks = {};
+		// game time of the frame that is handled, ms between two server frames
+		this.frameTime = undefined;
+		this.frameInterval = 50;
+		this.lastFrameTime = undefined;
+		this.serverOffset = Infinity;
+		// spectators only watch, the server ignores their input
+		this.spectate = spectate;
+		if (!spectate) {
+			window.addEventListener('keydown', sendMovementInput);
+			window.addEventListener('keyup', sendMovementInput);
+		}
 	}
 
 	newEntity(type, id, transform, height=undefined){
@@ -523,6 +537,11 @@ class RemoteHandler extends Entity{
 		ent.position.x = Number(transform.position.x);
 		ent.position.y = Number(transform.position.y);
 		ent.rotate(Number(transform.rotation));
+		// a snap is not interpolated, it is where the next move starts from
+		if (this.frameTime === undefined)
+			delete this.tracks[id];
+		else
+			this.tracks[id] = [{time: this.frameTime, x: ent.position.x, y: ent.position.y}];
 	}
 
 	moveEntity(id, transform){
@@ -531,9 +550,64 @@ class RemoteHandler extends Entity{
 			console.warn('Move called on missing entity');
 			return;
 		}
-		ent.position.x = lerp(ent.position.x, transform.position.x, .8);
-		ent.position.y = lerp(ent.position.y, transform.position.y, .8);
 		ent.rotate(transform.rotation);
+		if (this.frameTime === undefined) {
+			ent.position.x = lerp(ent.position.x, transform.position.x, .8);
+			ent.position.y = lerp(ent.position.y, transform.position.y, .8);
+			return;
+		}
+		const track = this.tracks[id] ??= [];
+		track.push({time: this.frameTime, x: transform.position.x, y: transform.position.y});
+	}
+
+	// called for every binary frame before its messages, tick 0 frames are not part of the tick stream
+	onFrame(tick, time) {
+		if (tick === 0) {
+			this.frameTime = undefined;
+			return;
+		}
+		if (this.lastFrameTime !== undefined && time > this.lastFrameTime)
+			this.frameInterval = lerp(this.frameInterval, time - this.lastFrameTime, .1);
+		this.lastFrameTime = time;
+		this.frameTime = time;
+		// the smallest receive delay seen so far maps game time to our clock
+		this.serverOffset = Math.min(this.serverOffset, performance.now() - time);
+	}
+
+	setBallState(id, x, y, vx, vy) {
+		const time = this.frameTime ?? performance.now() - this.serverOffset;
+		if (vx === 0 && vy === 0) {
+			delete this.ballStates[id];
+			this.setEntityPosition(id, {position: {x, y}, rotation: 0});
+			return;
+		}
+		this.ballStates[id] = {x, y, vx, vy, time};
+	}
+
+	update() {
+		// two frames behind, so there is a frame on both sides of the render time
+		const renderTime = performance.now() - this.serverOffset - this.frameInterval * 2;
+		for (const id in this.tracks) {
+			const ent = this.entities[id];
+			const track = this.tracks[id];
+			if (!ent || track.length === 0)
+				continue;
+			while (track.length > 2 && track[1].time <= renderTime)
+				track.shift();
+			const [from, to] = track;
+			const t = to ? Math.min(Math.max((renderTime - from.time) / (to.time - from.time || 1), 0), 1) : 0;
+			ent.position.x = to ? lerp(from.x, to.x, t) : from.x;
+			ent.position.y = to ? lerp(from.y, to.y, t) : from.y;
+		}
+		for (const id in this.ballStates) {
+			const ent = this.entities[id];
+			if (!ent)
+				continue;
+			const state = this.ballStates[id];
+			const elapsed = Math.max(0, renderTime - state.time) / 1000;
+			ent.position.x = state.x + state.vx * elapsed;
+			ent.position.y = state.y + state.vy * elapsed;
+		}
 	}
 
 	updatePlayerScore(id, score) {
@@ -581,7 +655,7 @@ function sendMovementInput(event) {
 let lobbyId;
 let matchType;
 
-function selectGamemode(groupName){
+function selectGamemode(groupName, spectate = false){
 	let split = groupName?.split('_');
 	matchType = split?.length > 0 ? split[0] : undefined;
 	lobbyId = split?.length > 1 ? split[1] : undefined;
@@ -592,9 +666,11 @@ function selectGamemode(groupName){
 		setupCloseLocal();
 	} else {
 		const token = localStorage.getItem('access_token');
-		socket = new WebSocket(`wss://${window.location.host}/ws/game/pong/${groupName}/?token=${token}`);
+		const path = spectate ? 'watch' : 'pong';
+		socket = new WebSocket(`wss://${window.location.host}/ws/game/${path}/${groupName}/?token=${token}`);
+		socket.binaryType = 'arraybuffer';
 		setupCloseWebsocket(socket);
-		manager = new RemoteHandler();
+		manager = new RemoteHandler(spectate);
 		setupSocketHandlers(socket);
 	}
 	world.addSystem(new RenderSystem());
@@ -605,58 +681,27 @@ function selectGamemode(groupName){
 }
 
 function setupSocketHandlers(socket){
+	// last transform of every entity, binary deltas are relative to it
+	const snapshot = new Map();
 
 	socket.onopen = () => {
 		console.log("Connection to remote Pong serverer");
 	}
 	
 	socket.onmessage = (event) => {
-		const data = event.data.split(';');
-
-		//newEntity		ne;id;type;xpos;ypos;rotation;?.height
-		//updatePos		up;id;xpos;ypos;rot
-		//setPos		sp;id;xpos;ypos;rot
-		//roundStart	rs
-		//setScore		ss;id;score
-		//initPlayer	ip;entid;uid;uname;sender_uid
-		//disconnect	dc;id
-		//gameOver		go
-		//drawDot		dd;x;y
-		//drawLine		dl;x1;y1;x2;y2
-		if (!data)
-			return;
-		if (data[0] !== 'up')
-			console.log(data);
-		if (data[0] === 'ne'){
-			manager.newEntity(data[2], data[1], {position: {x: data[3], y: data[4]}, rotation: data[5]}, data?.[6]);
-			return;
-		}
-		if (manager && !manager.complete) {
-			socket.send(JSON.stringify({type: 'incomplete'}));
-			console.warn('did not recieve all entities. Send request for resend!!!');
+		if (typeof event.data === 'string') {
+			// the world message holds one record per line
+			for (const record of event.data.split('\n'))
+				handleMessage(socket, record.split(';'));
 			return;
-		} 
-		if (data[0] === 'up'){
-			manager?.moveEntity(data[1], {position: {x: data[2], y: data[3]}, rotation: data[4]});
-		} else if (data[0] === 'sp'){
-			manager?.setEntityPosition(data[1], {position: {x: data[2], y: data[3]}, rotation: data[4]});
-		} else if (data[0] === 'rs'){
-			startGame();
-		} else if (data[0] === 'ss'){
-			manager.updatePlayerScore(data[1], data[2])
-		} else if (data[0] === 'ip') {
-			manager.addPlayer(data[1], data[2], data[3], data[4]);
-		} else if (data[0] === 'dc') {
-			let player = manager.players[data[1]];
-			useCountdownAsMessageDisplay(`${player.uname} disconnected!`);
-			endGame();
-		} else if (data[0] === 'go') {
-			endGame();
-		} else if (data[0] === 'dd'){
-			drawDot(data[1], data[2], 5, 'red');
-		} else if (data[0] === 'dl'){
-			drawLine(new Vector(data[1], data[2]), new Vector(data[3], data[4]), 'blue');
 		}
+		const [tick, time] = frameHeader(event.data);
+		manager?.onFrame(tick, time);
+		for (const message of decodeFrame(event.data, snapshot))
+			handleMessage(socket, message);
+		// the server holds back frames once too many of them are not acked (SendQueue.ACK_WINDOW)
+		if (tick !== 0)
+			socket.send(JSON.stringify({type: 'ack', tick: tick}));
 	}
 	
 	socket.onclose = () => {
@@ -669,6 +714,59 @@ function setupSocketHandlers(socket){
 	}
 }
 
+function handleMessage(socket, data){
+	//text messages
+	//world			records of the whole field separated by newlines: ne records, ne complete, sp records
+	//newEntity		ne;id;type;xpos;ypos;rotation;?.height
+	//initPlayer	ip;entid;uid;uname;sender_uid
+	//drawDot		dd;x;y
+	//drawLine		dl;x1;y1;x2;y2
+	//binary frames, decoded by pong_protocol.js to the same layout
+	//updatePos		up;id;xpos;ypos;rot
+	//setPos		sp;id;xpos;ypos;rot
+	//roundStart	rs
+	//setScore		ss;id;score
+	//disconnect	dc;id
+	//gameOver		go
+	//ballState		bs;id;xpos;ypos;xvel;yvel
+	if (!data)
+		return;
+	if (data[0] !== 'up' && data[0] !== 'bs')
+		console.log(data);
+	if (data[0] === 'ne'){
+		manager.newEntity(data[2], data[1], {position: {x: data[3], y: data[4]}, rotation: data[5]}, data?.[6]);
+		return;
+	}
+	if (manager && !manager.complete) {
+		socket.send(JSON.stringify({type: 'incomplete'}));
+		console.warn('did not recieve all entities. Send request for resend!!!');
+		return;
+	} 
+	if (data[0] === 'up'){
+		manager?.moveEntity(data[1], {position: {x: data[2], y: data[3]}, rotation: data[4]});
+	} else if (data[0] === 'sp'){
+		manager?.setEntityPosition(data[1], {position: {x: data[2], y: data[3]}, rotation: data[4]});
+	} else if (data[0] === 'bs'){
+		manager?.setBallState(data[1], data[2], data[3], data[4], data[5]);
+	} else if (data[0] === 'rs'){
+		startGame();
+	} else if (data[0] === 'ss'){
+		manager.updatePlayerScore(data[1], data[2])
+	} else if (data[0] === 'ip') {
+		manager.addPlayer(data[1], data[2], data[3], data[4]);
+	} else if (data[0] === 'dc') {
+		let player = manager.players[data[1]];
+		useCountdownAsMessageDisplay(`${player.uname} disconnected!`);
+		endGame();
+	} else if (data[0] === 'go') {
+		endGame();
+	} else if (data[0] === 'dd'){
+		drawDot(data[1], data[2], 5, 'red');
+	} else if (data[0] === 'dl'){
+		drawLine(new Vector(data[1], data[2]), new Vector(data[3], data[4]), 'blue');
+	}
+}
+
 function endGame() {
 	clearInterval(intervalId);
 	manager?.cleanup();
@@ -0,0 +1,121 @@
+// Client side of app/gameloop_service/game/PongProtocol.py, keep both in sync.
+// frame: u8 version, u32 tick, u32 time (ms since the game started), then messages, little endian
+// tick 0: the frame is not part of the tick stream (events, the scores sent with the field)
+//updatePos		u8 op, u32 id, i16 x, i16 y, u16 rot
+//setPos		u8 op, u32 id, i16 x, i16 y, u16 rot
+//setScore		u8 op, u32 id, u16 score
+//roundStart	u8 op
+//gameOver		u8 op
+//disconnect	u8 op, u32 id
+//delta		u8 op, u32 id, u8 mask, [i16 x], [i16 y], [u16 rot]
+//keyframe		u8 op
+//ballState		u8 op, u32 id, i16 x, i16 y, i16 vx, i16 vy
+
+export const PROTOCOL_VERSION = 3;
+const HEADER_SIZE = 9;
+
+const OP_UPDATE_POS = 1;
+const OP_SET_POS = 2;
+const OP_SET_SCORE = 3;
+const OP_ROUND_START = 4;
+const OP_GAME_OVER = 5;
+const OP_DISCONNECT = 6;
+const OP_DELTA = 7;
+const OP_KEYFRAME = 8;
+const OP_BALL_STATE = 9;
+
+const DELTA_X = 1;
+const DELTA_Y = 2;
+const DELTA_ROTATION = 4;
+const DELTA_SNAP = 8;
+
+const POSITION_SCALE = 8;
+const ROTATION_SCALE = 100;
+const VELOCITY_SCALE = 4;
+
+// Returns [tick, time] of a binary frame
+export function frameHeader(buffer) {
+	const view = new DataView(buffer);
+	if (view.byteLength < HEADER_SIZE)
+		return [0, 0];
+	return [view.getUint32(1, true), view.getUint32(5, true)];
+}
+
+// Returns the messages of a binary frame in the layout of the text messages, e.g. ['up', id, x, y, rot]
+// snapshot (Map id -> [x, y, rot]) holds the last transform of every entity, deltas only carry
+// the fields that changed and are completed from it to 'up' / 'sp' messages.
+export function decodeFrame(buffer, snapshot) {
+	const view = new DataView(buffer);
+	const messages = [];
+	if (view.byteLength < HEADER_SIZE || view.getUint8(0) !== PROTOCOL_VERSION) {
+		console.warn('Unsupported pong frame version', view.byteLength ? view.getUint8(0) : undefined);
+		return messages;
+	}
+	let offset = HEADER_SIZE;
+	while (offset < view.byteLength) {
+		const op = view.getUint8(offset);
+		if (op === OP_UPDATE_POS || op === OP_SET_POS) {
+			const id = view.getUint32(offset + 1, true);
+			const transform = [
+				view.getInt16(offset + 5, true) / POSITION_SCALE,
+				view.getInt16(offset + 7, true) / POSITION_SCALE,
+				view.getUint16(offset + 9, true) / ROTATION_SCALE
+			];
+			snapshot.set(id, transform);
+			messages.push([op === OP_UPDATE_POS ? 'up' : 'sp', id, ...transform]);
+			offset += 11;
+		} else if (op === OP_DELTA) {
+			const id = view.getUint32(offset + 1, true);
+			const mask = view.getUint8(offset + 5);
+			const transform = [...(snapshot.get(id) ?? [])];
+			offset += 6;
+			if (mask & DELTA_X) {
+				transform[0] = view.getInt16(offset, true) / POSITION_SCALE;
+				offset += 2;
+			}
+			if (mask & DELTA_Y) {
+				transform[1] = view.getInt16(offset, true) / POSITION_SCALE;
+				offset += 2;
+			}
+			if (mask & DELTA_ROTATION) {
+				transform[2] = view.getUint16(offset, true) / ROTATION_SCALE;
+				offset += 2;
+			}
+			// unknown entity and a partial delta, the next keyframe brings it
+			if (transform.length !== 3 || transform.includes(undefined))
+				continue;
+			snapshot.set(id, transform);
+			messages.push([mask & DELTA_SNAP ? 'sp' : 'up', id, ...transform]);
+		} else if (op === OP_BALL_STATE) {
+			// velocity in px per second
+			const id = view.getUint32(offset + 1, true);
+			const x = view.getInt16(offset + 5, true) / POSITION_SCALE;
+			const y = view.getInt16(offset + 7, true) / POSITION_SCALE;
+			snapshot.set(id, [x, y, snapshot.get(id)?.[2] ?? 0]);
+			messages.push([
+				'bs', id, x, y,
+				view.getInt16(offset + 9, true) / VELOCITY_SCALE,
+				view.getInt16(offset + 11, true) / VELOCITY_SCALE
+			]);
+			offset += 13;
+		} else if (op === OP_KEYFRAME) {
+			offset += 1;
+		} else if (op === OP_SET_SCORE) {
+			messages.push(['ss', view.getUint32(offset + 1, true), view.getUint16(offset + 5, true)]);
+			offset += 7;
+		} else if (op === OP_ROUND_START) {
+			messages.push(['rs']);
+			offset += 1;
+		} else if (op === OP_GAME_OVER) {
+			messages.push(['go']);
+			offset += 1;
+		} else if (op === OP_DISCONNECT) {
+			messages.push(['dc', view.getUint32(offset + 1, true)]);
+			offset += 5;
+		} else {
+			console.warn('Unknown pong opcode', op, 'at', offset);
+			break;
+		}
+	}
+	return messages;
+}